@@ -31,8 +31,13 @@ setup(
     author='Hugh Sorby',
     author_email='h.sorby@auckland.ac.nz',
     description='A Flask backend for the model-parameter-sensitivity Vue frontend.',
-    install_requires=['Flask', 'Flask-Cors', 'gunicorn', 'pyjwt', 'cryptography', 'libcellml', 'FileLock', 'psutil'],
+    extras_require={
+        'arrow': ['pyarrow'],
+        'sobol': ['scipy'],
+        'zstd': ['zstandard'],
+    },
+    install_requires=['Flask', 'Flask-Cors', 'gunicorn', 'pyjwt', 'cryptography', 'libcellml', 'FileLock', 'numpy'],
     entry_points={
-        'console_scripts': ['mps-serve=mps_server.run_server:main'],
+        'console_scripts': ['mps-serve=mps_server.run_server:main', 'mps-simulation-manager=mps_server.run_simulation_manager:main'],
     }
 )
@@ -1,14 +1,12 @@
-import json
-from urllib.request import urlopen
-
 import jwt
 
-from cryptography.hazmat.primitives import serialization
-from jwt.algorithms import RSAAlgorithm
-
-from flask import request, session
+from flask import current_app, request, session
 from functools import wraps
+from itsdangerous import BadSignature, URLSafeTimedSerializer
 from mps_server.config import Config
+from mps_server.jwks import JWKSCache
+from mps_server.metrics import request_stage_duration
+from mps_server.token_cache import VerifiedTokenCache
 
 
 # Format error response and append status code.
@@ -51,71 +49,117 @@ def get_token_auth_header() -> str:
     return token
 
 
+def _jwks_source():
+    if Config.AUTH0_JWKS_FILE:
+        return Config.AUTH0_JWKS_FILE
+
+    if Config.AUTH0_JWKS_URL:
+        return Config.AUTH0_JWKS_URL
+
+    return "https://" + str(Config.AUTH0_DOMAIN) + "/.well-known/jwks.json"
+
+
+jwks_cache = JWKSCache(_jwks_source(), ttl=Config.AUTH0_JWKS_CACHE_TTL, refresh_margin=Config.AUTH0_JWKS_REFRESH_MARGIN)
+token_cache = VerifiedTokenCache(Config.AUTH0_TOKEN_CACHE_SIZE)
+
+
+def _verified_payload(token):
+    """Return the payload of the access token, raise AuthError if it is not valid."""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.InvalidTokenError as jwt_error:
+        raise AuthError({"code": "invalid_header",
+                         "description":
+                             "Invalid header. "
+                             "Use an RS256 signed JWT Access Token"}, 401) from jwt_error
+    if unverified_header["alg"] == "HS256":
+        raise AuthError({"code": "invalid_header",
+                         "description":
+                             "Invalid header. "
+                             "Use an RS256 signed JWT Access Token"}, 401)
+    public_key_bytes = jwks_cache.get_key(unverified_header.get("kid"))
+    if public_key_bytes:
+        try:
+            payload = jwt.decode(
+                token,
+                public_key_bytes,
+                algorithms='RS256',
+                audience=Config.AUTH0_AUDIENCE,
+                issuer="https://" + Config.AUTH0_DOMAIN + "/"
+            )
+        except jwt.ExpiredSignatureError as expired_sign_error:
+            raise AuthError({"code": "token_expired",
+                             "description": "token is expired"}, 401) from expired_sign_error
+        except jwt.MissingRequiredClaimError as jwt_claims_error:
+            raise AuthError({"code": "invalid_claims",
+                             "description":
+                                 "incorrect claims,"
+                                 " please check the audience and issuer"}, 401) from jwt_claims_error
+        except jwt.InvalidTokenError as invalid_token_error:
+            raise AuthError({"code": "invalid_token",
+                             "description": "token is invalid"}, 401) from invalid_token_error
+        except Exception as exc:
+            raise AuthError({"code": "invalid_header",
+                             "description":
+                                 "Unable to parse authentication"
+                                 " token."}, 401) from exc
+
+        token_cache.put(token, payload)
+        return payload
+    raise AuthError({"code": "invalid_header",
+                     "description": "Unable to find appropriate key"}, 401)
+
+
 def requires_auth(func):
     """Determines if the access token is valid
     """
 
     @wraps(func)
     def decorated(*args, **kwargs):
-        token = get_token_auth_header()
-        jsonurl = urlopen("https://" + Config.AUTH0_DOMAIN + "/.well-known/jwks.json")
-        jwks = json.loads(jsonurl.read())
-        try:
-            unverified_header = jwt.get_unverified_header(token)
-        except jwt.InvalidTokenError as jwt_error:
-            raise AuthError({"code": "invalid_header",
-                             "description":
-                                 "Invalid header. "
-                                 "Use an RS256 signed JWT Access Token"}, 401) from jwt_error
-        if unverified_header["alg"] == "HS256":
-            raise AuthError({"code": "invalid_header",
-                             "description":
-                                 "Invalid header. "
-                                 "Use an RS256 signed JWT Access Token"}, 401)
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
-                break
-
-        if rsa_key:
-            true_rsa_key = RSAAlgorithm.from_jwk(rsa_key)
-            public_key_bytes = true_rsa_key.public_bytes(encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        with request_stage_duration.time('auth'):
+            payload = _verified_payload(get_token_auth_header())
+        session['user_id'] = payload['sub']
+        return func(*args, **kwargs)
+
+    return decorated
+
+
+def _scoped_token_serializer(scope):
+    return URLSafeTimedSerializer(current_app.secret_key, salt=scope)
+
+
+def issue_scoped_token(user_id, scope):
+    """Return a token signed by this server that stands in for the access token of 'user_id', for the requests of 'scope' only."""
+    return _scoped_token_serializer(scope).dumps({'sub': user_id})
+
+
+def requires_auth_or_scoped_token(scope, max_age):
+    """
+    Determines if the access token, or else a 'token' query parameter issued for 'scope' at most 'max_age' seconds ago, is valid.
+
+    For clients that cannot set the Authorization header, such as a browser's EventSource.
+    """
+
+    def decorator(func):
+
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            token = request.args.get('token')
+            if token is None or 'Authorization' in request.headers:
+                return requires_auth(func)(*args, **kwargs)
+
             try:
-                payload = jwt.decode(
-                    token,
-                    public_key_bytes,
-                    algorithms='RS256',
-                    audience=Config.AUTH0_AUDIENCE,
-                    issuer="https://" + Config.AUTH0_DOMAIN + "/"
-                )
-            except jwt.ExpiredSignatureError as expired_sign_error:
-                raise AuthError({"code": "token_expired",
-                                 "description": "token is expired"}, 401) from expired_sign_error
-            except jwt.MissingRequiredClaimError as jwt_claims_error:
-                raise AuthError({"code": "invalid_claims",
-                                 "description":
-                                     "incorrect claims,"
-                                     " please check the audience and issuer"}, 401) from jwt_claims_error
-            except jwt.InvalidTokenError as invalid_token_error:
+                payload = _scoped_token_serializer(scope).loads(token, max_age=max_age)
+            except BadSignature as error:
                 raise AuthError({"code": "invalid_token",
-                                 "description": "token is invalid"}, 401) from invalid_token_error
-            except Exception as exc:
-                raise AuthError({"code": "invalid_header",
-                                 "description":
-                                     "Unable to parse authentication"
-                                     " token."}, 401) from exc
-
-            user_id = payload['sub']
-            session['user_id'] = user_id
+                                 "description": "token is invalid or expired"}, 401) from error
+            session['user_id'] = payload['sub']
             return func(*args, **kwargs)
-        raise AuthError({"code": "invalid_header",
-                         "description": "Unable to find appropriate key"}, 401)
 
-    return decorated
+        return decorated
+
+    return decorator
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+
+from filelock import FileLock, Timeout
+
+from mps_server.common import file_sha256
+
+APPLICATION_DIR_NAME = "application"
+COMPLETE_FILE_NAME = "complete"
+COMPILER_ENVIRONMENT_VARIABLES = ['CC', 'CFLAGS', 'CXX', 'CXXFLAGS', 'LDFLAGS']
+LAST_USED_FILE_NAME = "last_used"
+PINS_DIR_NAME = "pins"
+
+
+def solver_revision(locations, ignore=()):
+    """Return a digest of the solver sources and build configuration at 'locations' and of the compiler environment, skipping the names in 'ignore'."""
+    revision = hashlib.sha256()
+    for location in locations:
+        revision.update(f"{location}\n".encode('utf-8'))
+        for root, dirs, files in os.walk(location):
+            dirs[:] = sorted(name for name in dirs if name not in ignore)
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                try:
+                    file_stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                revision.update(f"{os.path.relpath(file_path, location)}:{file_stat.st_size}:{file_stat.st_mtime_ns}\n".encode('utf-8'))
+
+    for name in COMPILER_ENVIRONMENT_VARIABLES:
+        revision.update(f"{name}={os.environ.get(name, '')}\n".encode('utf-8'))
+
+    return revision.hexdigest()
+
+
+def build_key(model_file, external_variables, solver_settings, revision=''):
+    """Return the key of the solver build for a model file, a set of external variables, solver settings and a solver revision."""
+    key = hashlib.sha256(file_sha256(model_file).encode('utf-8'))
+    key.update(json.dumps(sorted(external_variables)).encode('utf-8'))
+    key.update(json.dumps(solver_settings, sort_keys=True).encode('utf-8'))
+    key.update(revision.encode('utf-8'))
+    return key.hexdigest()
+
+
+def _tree_size(location):
+    size = 0
+    for root, _, files in os.walk(location):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                size += os.path.getsize(file_path)
+
+    return size
+
+
+class BuildCheckout(object):
+
+    def __init__(self, needs_build, application_dir=None):
+        self.needs_build = needs_build
+        self.application_dir = application_dir
+        self.succeeded = False
+
+    def built(self):
+        """Record that the solver was generated and compiled successfully."""
+        self.succeeded = True
+
+
+class BuildCache(object):
+    """
+    Content addressed cache of generated and compiled solver applications.
+
+    Every key has an application directory of its own that is built in place and never moved,
+    build systems record absolute source and build paths, so a hit builds incrementally in the
+    very tree it was configured in.  Application directories that are not in use are evicted
+    least recently used first once the cache is larger than 'max_bytes'.  A 'max_bytes' of zero
+    disables the cache.
+    """
+
+    def __init__(self, location, max_bytes):
+        self._location = location
+        self._max_bytes = max_bytes
+
+    def _entry_dir(self, key):
+        return os.path.join(self._location, key)
+
+    def _is_complete(self, key):
+        return os.path.isfile(os.path.join(self._entry_dir(key), COMPLETE_FILE_NAME))
+
+    @contextmanager
+    def checkout(self, key, reference, prepare):
+        """
+        Yield a BuildCheckout with the application directory of 'key' for the duration of the context.
+
+        BuildCheckout.needs_build tells whether the solver still has to be generated and compiled.
+        When it does, a new application directory is laid out by calling 'prepare' with its path
+        and kept for later runs only if BuildCheckout.built() is called.  If the cache is disabled
+        or another run is building the same solver BuildCheckout.application_dir is None, the run
+        builds privately.
+        """
+        if self._max_bytes <= 0:
+            yield BuildCheckout(True)
+            return
+
+        entry_dir = self._entry_dir(key)
+        pins_dir = os.path.join(entry_dir, PINS_DIR_NAME)
+        pin = os.path.join(pins_dir, reference)
+        os.makedirs(self._location, exist_ok=True)
+        lock = FileLock(os.path.join(self._location, f"{key}.lock"))
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            # Another run is building the solver or it is being evicted.
+            yield BuildCheckout(True)
+            return
+
+        hit = False
+        application_dir = os.path.join(entry_dir, APPLICATION_DIR_NAME)
+        try:
+            # The pin and check happen under the lock so eviction cannot remove the application in between.
+            os.makedirs(pins_dir, exist_ok=True)
+            with open(pin, 'w') as f:
+                f.write("")
+
+            hit = self._is_complete(key)
+            if hit:
+                lock.release()
+                yield BuildCheckout(False, application_dir)
+            else:
+                if os.path.isdir(application_dir):
+                    shutil.rmtree(application_dir)
+                prepare(application_dir)
+                checkout = BuildCheckout(True, application_dir)
+                yield checkout
+                if checkout.succeeded:
+                    with open(os.path.join(entry_dir, COMPLETE_FILE_NAME), 'w') as f:
+                        f.write("")
+        finally:
+            if lock.is_locked:
+                lock.release()
+            os.remove(pin)
+            with open(os.path.join(entry_dir, LAST_USED_FILE_NAME), 'w') as f:
+                f.write("")
+            if not hit:
+                self.evict()
+
+    def release(self, reference):
+        """Remove the pins left by the simulation run 'reference' if its process was killed while using the cache."""
+        if not os.path.isdir(self._location):
+            return
+
+        for key in os.listdir(self._location):
+            pin = os.path.join(self._entry_dir(key), PINS_DIR_NAME, reference)
+            if os.path.isfile(pin):
+                os.remove(pin)
+
+    def evict(self):
+        """Remove the least recently used applications that are not in use until the cache fits in its budget."""
+        if not os.path.isdir(self._location):
+            return
+
+        entries = []
+        for key in os.listdir(self._location):
+            entry_dir = self._entry_dir(key)
+            if not os.path.isdir(entry_dir):
+                continue
+
+            last_used = os.path.join(entry_dir, LAST_USED_FILE_NAME)
+            entries.append((os.path.getmtime(last_used) if os.path.isfile(last_used) else 0.0, key, _tree_size(entry_dir)))
+
+        total_size = sum(entry[2] for entry in entries)
+        for _, key, size in sorted(entries):
+            if total_size <= self._max_bytes:
+                break
+
+            entry_dir = self._entry_dir(key)
+            lock = FileLock(os.path.join(self._location, f"{key}.lock"))
+            try:
+                with lock.acquire(timeout=0):
+                    if os.listdir(os.path.join(entry_dir, PINS_DIR_NAME)):
+                        continue
+
+                    shutil.rmtree(entry_dir)
+                    total_size -= size
+            except (Timeout, FileNotFoundError):
+                continue
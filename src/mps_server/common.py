@@ -1,5 +1,34 @@
+import hashlib
+import os
+import uuid
 
 
 def normalise_for_use_as_path(data_in):
     """Normalise the 'data_in' so it can be used as part of a path."""
     return data_in.replace('|', '_').replace('.', '_dot_')
+
+
+def file_sha256(location):
+    """Return the SHA-256 digest of the contents of the file at 'location'."""
+    digest = hashlib.sha256()
+    with open(location, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def write_file_atomically(location, content):
+    """Write 'content' to a temporary file next to 'location' and move it into place, so readers never see a partial file."""
+    # Unique per call, the threads of a server process may write the same file at the same time.
+    temporary_location = f"{location}.{uuid.uuid4().hex}.tmp"
+    with open(temporary_location, 'w') as f:
+        f.write(content)
+    os.replace(temporary_location, location)
+
+
+class Status(object):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    CANCELLED = 'cancelled'
@@ -1,13 +1,40 @@
 import os
+import socket
 import tempfile
 
 
 class Config(object):
     AUTH0_AUDIENCE = "https://libcellml.org/mps/api"
     AUTH0_DOMAIN = os.environ.get('MPS_AUTH0_DOMAIN')
+    AUTH0_JWKS_CACHE_TTL = int(os.environ.get('MPS_AUTH0_JWKS_CACHE_TTL', 600))
+    AUTH0_JWKS_FILE = os.environ.get('MPS_AUTH0_JWKS_FILE')
+    AUTH0_JWKS_REFRESH_MARGIN = int(os.environ.get('MPS_AUTH0_JWKS_REFRESH_MARGIN', 60))
+    AUTH0_JWKS_URL = os.environ.get('MPS_AUTH0_JWKS_URL')
     AUTH0_SECRET = os.environ.get('MPS_AUTH0_SECRET')
+    AUTH0_TOKEN_CACHE_SIZE = int(os.environ.get('MPS_AUTH0_TOKEN_CACHE_SIZE', 1024))
     CLIENT_ORIGIN_URL = os.environ.get("MPS_CLIENT_ORIGIN_URL", "http://localhost:4040")
     CLIENT_WORKING_DIR = os.environ.get('MPS_CLIENT_WORKING_DIR')
+    SERVER_THREADS = int(os.environ.get('MPS_SERVER_THREADS', 32))
+    SIMULATION_BUILD_CACHE_BYTES = int(os.environ.get('MPS_SIMULATION_BUILD_CACHE_BYTES', 2 * 1024 ** 3))
+    SIMULATION_CONCURRENT_RUNS = int(os.environ.get('MPS_SIMULATION_CONCURRENT_RUNS', 2))
     SIMULATION_DATA_DIR = os.environ.get('MPS_SIMULATION_DATA_DIR', os.path.join(tempfile.gettempdir(), 'mps_simulation_data'))
+    SIMULATION_EVENTS_MAX_STREAMS = int(os.environ.get('MPS_SIMULATION_EVENTS_MAX_STREAMS', max(1, SERVER_THREADS * 3 // 4)))
+    SIMULATION_EVENTS_TIMEOUT = int(os.environ.get('MPS_SIMULATION_EVENTS_TIMEOUT', 60))
+    SIMULATION_EVENTS_TOKEN_TTL = int(os.environ.get('MPS_SIMULATION_EVENTS_TOKEN_TTL', 300))
+    SIMULATION_EXECUTOR = os.environ.get('MPS_SIMULATION_EXECUTOR', 'solver-manager')
+    SIMULATION_LEASE_SECONDS = float(os.environ.get('MPS_SIMULATION_LEASE_SECONDS', 60))
+    SIMULATION_MAX_ATTEMPTS = int(os.environ.get('MPS_SIMULATION_MAX_ATTEMPTS', 2))
+    SIMULATION_MAX_CPU_SECONDS = float(os.environ.get('MPS_SIMULATION_MAX_CPU_SECONDS', 0))
+    SIMULATION_MAX_OUTPUT_BYTES = int(os.environ.get('MPS_SIMULATION_MAX_OUTPUT_BYTES', 0))
+    SIMULATION_QUEUE_JOURNAL_MODE = os.environ.get('MPS_SIMULATION_QUEUE_JOURNAL_MODE', 'WAL')
+    SIMULATION_RESULT_CACHE_RETENTION = int(os.environ.get('MPS_SIMULATION_RESULT_CACHE_RETENTION', 7 * 24 * 60 * 60))
+    SIMULATION_RESULT_CACHE_SIZE = int(os.environ.get('MPS_SIMULATION_RESULT_CACHE_SIZE', 10000))
     SIMULATION_RUN_DIR = os.environ.get('MPS_SIMULATION_RUN_DIR')
+    SIMULATION_SHARD_TRIALS = int(os.environ.get('MPS_SIMULATION_SHARD_TRIALS', 0))
+    SIMULATION_TRIAL_FUNCTION = os.environ.get('MPS_SIMULATION_TRIAL_FUNCTION')
+    SIMULATION_TRIALS_PER_TASK = int(os.environ.get('MPS_SIMULATION_TRIALS_PER_TASK', 16))
+    SIMULATION_USER_CPU_BUDGET = float(os.environ.get('MPS_SIMULATION_USER_CPU_BUDGET', 0))
+    SIMULATION_WORKER_NAME = os.environ.get('MPS_SIMULATION_WORKER_NAME', socket.gethostname())
     SUNDIALS_CMAKE_CONFIG_DIR = os.environ.get('MPS_SUNDIALS_CMAKE_CONFIG_DIR')
+    UPLOAD_MAX_BYTES = int(os.environ.get('MPS_UPLOAD_MAX_BYTES', 64 * 1024 ** 2))
+    UPLOAD_VALIDATION_WORKERS = int(os.environ.get('MPS_UPLOAD_VALIDATION_WORKERS', 2))
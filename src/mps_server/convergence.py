@@ -0,0 +1,68 @@
+import warnings
+
+import numpy as np
+
+from mps_server.sampling import normal_ppf
+from mps_server.sensitivity import sobol_indices
+
+
+def _numeric_outputs(data):
+    """Return the numeric columns of extracted result 'data' as float64 arrays with one row per trial."""
+    outputs = {}
+    for name, values in data.items():
+        try:
+            array = np.asarray([np.asarray(v, dtype='<f8') for v in values], dtype='<f8')
+        except (TypeError, ValueError):
+            continue
+        outputs[name] = array.reshape(len(array), -1)
+
+    return outputs
+
+
+class ConvergenceMonitor(object):
+    """
+    Tracks the running estimates of the outputs of a simulation run as batches of trials arrive.
+
+    The run has converged when, for every output and time point, the half width of the
+    'confidence' interval of the mean is at most 'tolerance' relative to the mean (absolute
+    where the mean is zero).  For a Saltelli design ('number_parameters' given) the total Sobol
+    indices must also change by at most 'tolerance' from one batch to the next.
+    """
+
+    def __init__(self, tolerance, confidence=0.95, number_parameters=0):
+        self.tolerance = tolerance
+        self.number_parameters = number_parameters
+        self.history = []
+        self._z = float(normal_ppf([0.5 + confidence / 2])[0])
+        self._previous_total = None
+
+    def update(self, data, excluded=()):
+        """Add the estimates for all the trials so far, 'data' is the extracted result, return True if the run has converged."""
+        outputs = {name: values for name, values in _numeric_outputs(data).items() if name not in excluded}
+        trials = min((len(values) for values in outputs.values()), default=0)
+        entry = {'trials': trials, 'relative_half_width': None}
+        converged = False
+        if trials > 1:
+            widths = []
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                for values in outputs.values():
+                    mean = np.nanmean(values, axis=0)
+                    half_width = self._z * np.nanstd(values, axis=0, ddof=1) / np.sqrt(trials)
+                    widths.append(np.where(np.abs(mean) > 0, half_width / np.abs(mean), half_width))
+                relative_half_width = float(np.nanmax(np.concatenate(widths))) if widths else 0.0
+            entry['relative_half_width'] = relative_half_width
+            converged = relative_half_width <= self.tolerance
+
+        if self.number_parameters and outputs:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                total = np.concatenate([sobol_indices(values, self.number_parameters)[1].ravel() for values in outputs.values()])
+            change = None if self._previous_total is None else float(np.nanmax(np.abs(total - self._previous_total)))
+            entry['sobol_total_change'] = change
+            converged = converged and change is not None and change <= self.tolerance
+            self._previous_total = total
+
+        entry['converged'] = converged
+        self.history.append(entry)
+        return converged
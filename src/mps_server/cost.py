@@ -0,0 +1,50 @@
+import math
+
+BYTES_PER_VALUE = 8
+# CPU seconds per unit of work assumed before any run has been calibrated against.
+DEFAULT_CPU_SECONDS_PER_WORK_UNIT = 1e-5
+
+
+def work_units(settings, outputs):
+    """
+    Return the size of a simulation as trials x time points x outputs.
+
+    The number of time points is (timeStop - timeStart) / pointInterval, plus the starting point.
+    """
+    simulation = settings['simulation']
+    interval = float(simulation['pointInterval'])
+    span = float(simulation['timeStop']) - float(simulation['timeStart'])
+    points = math.floor(span / interval) + 1 if interval > 0 and span >= 0 else 1
+    return int(simulation['numberTrials']) * points * max(1, len(outputs))
+
+
+def estimate_cost(units, cpu_seconds_per_unit=None):
+    """Return the estimated CPU seconds and output bytes of a simulation of 'units' work units."""
+    calibrated = cpu_seconds_per_unit is not None
+    if not calibrated:
+        cpu_seconds_per_unit = DEFAULT_CPU_SECONDS_PER_WORK_UNIT
+
+    return {
+        'work_units': units,
+        'cpu_seconds': units * cpu_seconds_per_unit,
+        'output_bytes': units * BYTES_PER_VALUE,
+        'calibrated': calibrated,
+    }
+
+
+def admission_check(estimate, number_of_trials, max_cpu_seconds, max_output_bytes):
+    """
+    Return None if a simulation with 'estimate' is within the limits, otherwise the reason it is not.
+
+    The reason is a dict of the limit exceeded and the largest number of trials that would fit.
+    A limit of zero is no limit.
+    """
+    for name, limit in [('cpu_seconds', max_cpu_seconds), ('output_bytes', max_output_bytes)]:
+        if limit > 0 and estimate[name] > limit:
+            return {
+                'limit': name,
+                'maximum': limit,
+                'max_trials': int(number_of_trials * limit / estimate[name]),
+            }
+
+    return None
@@ -0,0 +1,248 @@
+import importlib
+import math
+import multiprocessing as mp
+import resource
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from time import process_time
+
+import numpy as np
+
+from mps_server.progress import SolverProgress
+
+EXECUTORS = ('solver-manager', 'process-pool', 'fake')
+FAKE_TRIAL_FUNCTION = "mps_server.executors:fake_trial"
+
+
+def time_points(simulation_config):
+    """Return the time points of a simulation converted for the solver, from StartingPoint to EndingPoint every PointInterval."""
+    start, stop, interval = simulation_config['StartingPoint'], simulation_config['EndingPoint'], simulation_config['PointInterval']
+    count = math.floor((stop - start) / interval) + 1 if interval > 0 and stop >= start else 1
+    return start + interval * np.arange(count, dtype='<f8')
+
+
+def fake_trial(model_file, parameters, times, outputs):
+    """Return made up, but deterministic, values of the outputs of a trial: exponential decays scaled by the parameter values."""
+    scale = 1.0 + sum(parameters.values())
+    return np.array([scale * (index + 1) * np.exp(-times / (index + 1)) for index in range(len(outputs))])
+
+
+def load_trial_function(path):
+    """Return the function at 'path', given as "module:function"."""
+    module_name, _, function_name = path.partition(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def children_cpu_seconds():
+    """Return the CPU seconds used by the child processes of this process that have been waited for."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class SolverTask(object):
+    """
+    A batch of trials of a simulation run for an executor.
+
+    'parameters' holds the parameter values of the trials, one row per trial and one column per
+    name in 'parameter_names', it is None when the solver samples the parameters itself.
+    """
+
+    def __init__(self, run_dir, config_file, model_file, outputs, times, parameter_names=None, parameters=None):
+        self.run_dir = run_dir
+        self.config_file = config_file
+        self.model_file = model_file
+        self.outputs = outputs
+        self.times = times
+        self.parameter_names = parameter_names
+        self.parameters = parameters
+
+
+class ExecutionResult(object):
+    """
+    What an executor returns for a batch of trials.
+
+    'data' is the result as a dict of column name to values, one per trial, None if it has to be
+    extracted from the output directory of the run.
+    """
+
+    def __init__(self, returncode, progress, cpu_seconds, data=None):
+        self.returncode = returncode
+        self.progress = progress
+        self.cpu_seconds = cpu_seconds
+        self.data = data
+
+
+def _result_columns(task, values, failed):
+    """Return the result of a batch as columns, the outputs (NaN for failed trials) followed by the parameter values."""
+    values[failed] = np.nan
+    data = {name: values[:, index, :] for index, name in enumerate(task.outputs)}
+    for index, name in enumerate(task.parameter_names):
+        data[name] = task.parameters[:, index]
+    return data
+
+
+class SolverManagerExecutor(object):
+    """
+    Runs a batch with simple-sundials-solver-manager, the solver compiled from the generated code of the model.
+
+    The solver manager samples the parameters of the trials itself, it does not read sampled values.
+    """
+
+    accepts_parameter_samples = False
+    compiled_solver = True
+
+    def run(self, task, report_progress):
+        progress = SolverProgress()
+        cpu_seconds_before = children_cpu_seconds()
+        process = subprocess.Popen(["simple-sundials-solver-manager", "--simulation-config", task.config_file], cwd=task.run_dir,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        for line in process.stdout:
+            print(line, end='')
+            if progress.parse_line(line):
+                report_progress(progress)
+
+        returncode = process.wait()
+        return ExecutionResult(returncode, progress, children_cpu_seconds() - cpu_seconds_before)
+
+
+class FakeExecutor(object):
+    """Runs a batch in this process with a trial function, fake_trial by default, for tests and machines without a solver."""
+
+    accepts_parameter_samples = True
+    compiled_solver = False
+
+    def __init__(self, trial_function=FAKE_TRIAL_FUNCTION):
+        self._trial_function = trial_function
+
+    def run(self, task, report_progress):
+        trial_function = load_trial_function(self._trial_function)
+        progress = SolverProgress(len(task.parameters))
+        cpu_seconds_before = process_time()
+        values = np.empty((len(task.parameters), len(task.outputs), len(task.times)), dtype='<f8')
+        failed = np.zeros(len(task.parameters), dtype=bool)
+        for trial, row in enumerate(task.parameters):
+            try:
+                values[trial] = trial_function(task.model_file, dict(zip(task.parameter_names, row.tolist())), task.times, task.outputs)
+                progress.trials_completed += 1
+            except Exception as e:
+                print(f"trial {trial} failed: {e}")
+                failed[trial] = True
+                progress.trials_failed += 1
+            report_progress(progress)
+
+        return ExecutionResult(0, progress, process_time() - cpu_seconds_before, _result_columns(task, values, failed))
+
+
+def _solve_trials(trial_function, model_file, parameter_names, outputs, times, parameters_name, values_name, trials, start, stop):
+    """Solve trials [start, stop) of a batch in a pool worker, reading and writing the batch arrays in shared memory, return the trials that failed."""
+    function = load_trial_function(trial_function)
+    # The workers share the resource tracker of the pool's parent, which unlinks the blocks.
+    parameters_memory = SharedMemory(parameters_name)
+    values_memory = SharedMemory(values_name)
+    try:
+        parameters = np.ndarray((trials, len(parameter_names)), dtype='<f8', buffer=parameters_memory.buf)
+        values = np.ndarray((trials, len(outputs), len(times)), dtype='<f8', buffer=values_memory.buf)
+        failed = []
+        for trial in range(start, stop):
+            try:
+                values[trial] = function(model_file, dict(zip(parameter_names, parameters[trial].tolist())), times, outputs)
+            except Exception as e:
+                print(f"trial {trial} failed: {e}")
+                failed.append(trial)
+        del parameters, values
+        return failed
+    finally:
+        parameters_memory.close()
+        values_memory.close()
+
+
+class ProcessPoolTrialExecutor(object):
+    """
+    Spreads the trials of a batch over a pool of 'workers' processes, 'trials_per_task' trials at a time.
+
+    The parameter values go to the workers and the output values come back through shared
+    memory, only the trial numbers pass through the pool.  More trials per task means less
+    dispatch overhead per trial but coarser load balancing and progress.
+    """
+
+    accepts_parameter_samples = True
+    compiled_solver = False
+
+    def __init__(self, trial_function, workers, trials_per_task=16):
+        self._trial_function = trial_function
+        self._workers = max(1, workers)
+        self._trials_per_task = max(1, trials_per_task)
+
+    def run(self, task, report_progress):
+        trials = len(task.parameters)
+        progress = SolverProgress(trials)
+        cpu_seconds_before = children_cpu_seconds()
+        shape = (trials, len(task.outputs), len(task.times))
+        parameters_memory = SharedMemory(create=True, size=max(1, task.parameters.nbytes))
+        values_memory = SharedMemory(create=True, size=max(1, 8 * math.prod(shape)))
+        try:
+            np.ndarray(task.parameters.shape, dtype='<f8', buffer=parameters_memory.buf)[:] = task.parameters
+            failed = np.zeros(trials, dtype=bool)
+            # Spawn, the simulation process is forked and need not be a safe parent for the pool.
+            with ProcessPoolExecutor(max_workers=self._workers, mp_context=mp.get_context('spawn')) as pool:
+                futures = {pool.submit(_solve_trials, self._trial_function, task.model_file, task.parameter_names, task.outputs, task.times,
+                                       parameters_memory.name, values_memory.name, trials, start, min(start + self._trials_per_task, trials)):
+                           min(self._trials_per_task, trials - start) for start in range(0, trials, self._trials_per_task)}
+                try:
+                    for future in as_completed(futures):
+                        failed_trials = future.result()
+                        failed[failed_trials] = True
+                        progress.trials_completed += futures[future] - len(failed_trials)
+                        progress.trials_failed += len(failed_trials)
+                        report_progress(progress)
+                except (BrokenProcessPool, ImportError, AttributeError) as e:
+                    print('The trial pool failed:', e)
+                    return ExecutionResult(1, progress, children_cpu_seconds() - cpu_seconds_before)
+
+            values = np.array(np.ndarray(shape, dtype='<f8', buffer=values_memory.buf))
+        finally:
+            parameters_memory.close()
+            parameters_memory.unlink()
+            values_memory.close()
+            values_memory.unlink()
+
+        return ExecutionResult(0, progress, children_cpu_seconds() - cpu_seconds_before, _result_columns(task, values, failed))
+
+
+class ExecutorConfigurationError(ValueError):
+    """An executor that is unknown or configured so it cannot run any trials."""
+
+
+def accepts_parameter_samples(name):
+    """Return True if the executor called 'name' solves the trials with the parameter values sampled by the server."""
+    executor_type = {'solver-manager': SolverManagerExecutor, 'process-pool': ProcessPoolTrialExecutor, 'fake': FakeExecutor}.get(name)
+    return executor_type is not None and executor_type.accepts_parameter_samples
+
+
+def create_executor(name, workers, trial_function=None, trials_per_task=16):
+    """Return the executor called 'name', one of EXECUTORS.  The process pool needs the trial function to run, as "module:function"."""
+    if name == 'solver-manager':
+        return SolverManagerExecutor()
+    if name == 'fake':
+        return FakeExecutor(trial_function or FAKE_TRIAL_FUNCTION)
+    if name == 'process-pool':
+        if not trial_function:
+            raise ExecutorConfigurationError("The process-pool executor needs a trial function, set MPS_SIMULATION_TRIAL_FUNCTION.")
+        return ProcessPoolTrialExecutor(trial_function, workers, trials_per_task)
+
+    raise ExecutorConfigurationError(f"Unknown executor '{name}', expected one of {', '.join(EXECUTORS)}.")
+
+
+def check_executor(name, trial_function=None):
+    """Return the executor called 'name', as create_executor() does, after checking that its trial function can be loaded."""
+    executor = create_executor(name, 1, trial_function)
+    if not executor.compiled_solver:
+        path = trial_function or FAKE_TRIAL_FUNCTION
+        try:
+            load_trial_function(path)
+        except (ImportError, AttributeError, ValueError) as e:
+            raise ExecutorConfigurationError(f"The trial function '{path}' of the {name} executor cannot be loaded: {e}") from e
+
+    return executor
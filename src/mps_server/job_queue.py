@@ -0,0 +1,518 @@
+import sqlite3
+from contextlib import closing
+from time import time
+
+from mps_server.common import Status
+from mps_server.progress import estimated_time_remaining
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    reference TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_seq ON jobs (status, seq);
+CREATE INDEX IF NOT EXISTS jobs_user_status ON jobs (user_id, status);
+CREATE INDEX IF NOT EXISTS jobs_user_seq ON jobs (user_id, seq);
+CREATE TABLE IF NOT EXISTS timings (
+    reference TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (reference, stage)
+);
+"""
+
+# Columns added after the jobs table was first created, they are added to existing queues.
+_ADDED_COLUMNS = [
+    ('title', 'TEXT'),
+    ('updated', 'REAL'),
+    ('trials_total', 'INTEGER'),
+    ('trials_completed', 'INTEGER NOT NULL DEFAULT 0'),
+    ('revision', 'INTEGER NOT NULL DEFAULT 0'),
+    ('trials_failed', 'INTEGER NOT NULL DEFAULT 0'),
+    ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('priority', 'INTEGER NOT NULL DEFAULT 0'),
+    ('model_key', 'TEXT'),
+    ('work_units', 'INTEGER'),
+    ('cpu_seconds_estimate', 'REAL'),
+    ('cpu_seconds', 'REAL'),
+    ('extension_trials', 'INTEGER NOT NULL DEFAULT 0'),
+    ('worker', 'TEXT'),
+    ('lease_expires', 'REAL'),
+    ('parent', 'TEXT'),
+    ('shards', 'INTEGER NOT NULL DEFAULT 0'),
+    ('trials_start', 'INTEGER'),
+    ('trials_stop', 'INTEGER'),
+    ('extended_trials_completed', 'INTEGER NOT NULL DEFAULT 0'),
+    ('extended_trials_failed', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+_ADDED_COLUMNS_SCHEMA = """
+CREATE INDEX IF NOT EXISTS jobs_revision ON jobs (revision);
+CREATE INDEX IF NOT EXISTS jobs_user_revision ON jobs (user_id, revision);
+CREATE INDEX IF NOT EXISTS jobs_status_priority_seq ON jobs (status, priority DESC, seq);
+CREATE INDEX IF NOT EXISTS jobs_model_key_seq ON jobs (model_key, seq);
+CREATE INDEX IF NOT EXISTS jobs_status_lease ON jobs (status, lease_expires);
+CREATE INDEX IF NOT EXISTS jobs_parent ON jobs (parent);
+"""
+
+# Number of the latest runs that calibrate the CPU seconds a unit of work takes.
+CALIBRATION_RUNS = 20
+
+# Every change to a run gives it the next revision, so clients can ask for the changes after a revision.
+_NEXT_REVISION = "(SELECT COALESCE(MAX(revision), 0) + 1 FROM jobs)"
+
+_RUN_INFO_COLUMNS = ['reference', 'title', 'status', 'priority', 'created', 'started', 'finished', 'updated', 'trials_total', 'trials_completed', 'trials_failed',
+                     'cpu_seconds_estimate', 'cpu_seconds', 'shards', 'revision']
+
+
+def _run_info(row):
+    """Return a row of run information columns as a dict, with the estimated seconds remaining for running runs."""
+    info = dict(zip(_RUN_INFO_COLUMNS, row))
+    info['eta'] = None
+    if info['status'] == Status.RUNNING and info['started'] is not None:
+        info['eta'] = estimated_time_remaining(time() - info['started'], info['trials_completed'] + info['trials_failed'], info['trials_total'])
+
+    return info
+
+
+class JobQueue(object):
+    """
+    A queue of simulation runs stored in an SQLite database.
+
+    Runs are dequeued through the (status, priority, seq) index, so claiming the next pending
+    run does not depend on how many finished runs are stored.  Of the pending runs with the
+    highest priority, the oldest run of the user with the fewest running runs is claimed first.  Every transition is a single
+    transaction, so several processes can share the queue.
+
+    The queue doubles as the index of every user's simulation runs, holding their titles,
+    timestamps and progress, so listing a user's runs is a single query.
+
+    A run claimed by a named worker is leased to it, the worker renews the lease with
+    heartbeats and a run whose lease expired goes back in the queue.  A large run can be split
+    into shards, runs of their own that are claimed in its stead, the run is merged once all
+    its shards are finished.  WAL journaling needs the queue on a local file system, a queue
+    shared between machines uses the 'DELETE' journal mode.
+
+    'on_change' is called after every change that gives a run a new revision.
+    """
+
+    def __init__(self, location, journal_mode='WAL', on_change=None):
+        self._location = location
+        self._on_change = on_change
+        with closing(self._connect()) as connection:
+            connection.execute(f"PRAGMA journal_mode={journal_mode}")
+            connection.executescript(_SCHEMA)
+            existing_columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+            for name, definition in _ADDED_COLUMNS:
+                if name not in existing_columns:
+                    connection.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            connection.executescript(_ADDED_COLUMNS_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self._location, timeout=30, isolation_level=None)
+
+    def _changed(self, changed=True):
+        if changed and self._on_change is not None:
+            self._on_change()
+
+    def enqueue(self, reference, user_id, status=Status.PENDING, created=None, title=None, trials_total=None, priority=0,
+                model_key=None, work_units=None, cpu_seconds_estimate=None, shards=()):
+        """
+        Add a run to the queue, a run that is already queued is left as it is.
+
+        Runs with a higher priority are claimed first.  The size of the run in 'work_units' and the
+        'model_key' of its model are used to calibrate the cost estimates of later runs.  With
+        'shards', a list of (trials_start, trials_stop) ranges, the trials of the run are split
+        into shards, "<reference>.<index>", which are claimed instead of the run.
+        """
+        created = time() if created is None else created
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = connection.execute("INSERT OR IGNORE INTO jobs (reference, user_id, status, created, updated, title, trials_total, priority, "
+                                            f"model_key, work_units, cpu_seconds_estimate, shards, revision) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {_NEXT_REVISION})",
+                                            (reference, user_id, status, created, created, title, trials_total, priority, model_key, work_units,
+                                             cpu_seconds_estimate, len(shards)))
+                if cursor.rowcount > 0:
+                    for index, (trials_start, trials_stop) in enumerate(shards):
+                        # The shards do not calibrate the cost estimates, the run they are merged into does.
+                        share = (trials_stop - trials_start) / max(1, trials_total or 0)
+                        connection.execute("INSERT INTO jobs (reference, user_id, status, created, updated, title, trials_total, priority, model_key, "
+                                           f"cpu_seconds_estimate, parent, trials_start, trials_stop, revision) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {_NEXT_REVISION})",
+                                           (f"{reference}.{index}", user_id, status, created, created, title, trials_stop - trials_start, priority, model_key,
+                                            None if cpu_seconds_estimate is None else cpu_seconds_estimate * share, reference, trials_start, trials_stop))
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+        self._changed(cursor.rowcount > 0)
+
+    def claim(self, cpu_budget=0, worker=None, lease_seconds=None):
+        """
+        Mark the next pending run as running and return its reference, None if nothing is pending.
+
+        With a 'cpu_budget' a run is only claimed if the estimated CPU seconds of the user's running
+        runs, this run included, fit in the budget, or if the user has nothing running.  The run is
+        leased to 'worker' for 'lease_seconds'.  Claiming a shard marks the run it belongs to as
+        running.
+        """
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Runs split into shards are never claimed themselves, nor do they count as running next to their shards.
+                row = connection.execute("SELECT reference FROM jobs AS pending WHERE status = ? AND shards = 0 AND (? <= 0 OR "
+                                         "(SELECT COALESCE(SUM(cpu_seconds_estimate), 0) + COALESCE(pending.cpu_seconds_estimate, 0) FROM jobs AS running "
+                                         "WHERE running.user_id = pending.user_id AND running.status = ? AND running.shards = 0) <= ? OR "
+                                         "NOT EXISTS (SELECT 1 FROM jobs AS running WHERE running.user_id = pending.user_id AND running.status = ? AND running.shards = 0)) "
+                                         "ORDER BY priority DESC, "
+                                         "(SELECT COUNT(*) FROM jobs AS running WHERE running.user_id = pending.user_id AND running.status = ? AND running.shards = 0), "
+                                         "seq LIMIT 1",
+                                         (Status.PENDING, cpu_budget, Status.RUNNING, cpu_budget, Status.RUNNING, Status.RUNNING)).fetchone()
+                if row is not None:
+                    now = time()
+                    connection.execute("UPDATE jobs SET status = ?, started = ?, updated = ?, attempts = attempts + 1, worker = ?, lease_expires = ?, "
+                                       f"revision = {_NEXT_REVISION} WHERE reference = ?",
+                                       (Status.RUNNING, now, now, worker, None if lease_seconds is None else now + lease_seconds, row[0]))
+                    connection.execute("UPDATE jobs SET status = ?, started = COALESCE(started, ?), updated = ?, "
+                                       f"revision = {_NEXT_REVISION} WHERE reference = (SELECT parent FROM jobs WHERE reference = ?) AND status = ?",
+                                       (Status.RUNNING, now, now, row[0], Status.PENDING))
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+        self._changed(row is not None)
+        return None if row is None else row[0]
+
+    def complete(self, reference, status=Status.FINISHED, worker=None):
+        """
+        Move a running run to its final status, return False if it is not running (it was cancelled meanwhile).
+
+        With a 'worker' the run must be leased to that worker, a worker that lost its lease does not complete the run.
+        """
+        with closing(self._connect()) as connection:
+            now = time()
+            cursor = connection.execute("UPDATE jobs SET status = ?, finished = ?, updated = ?, extension_trials = 0, lease_expires = NULL, "
+                                        f"revision = {_NEXT_REVISION} WHERE reference = ? AND status = ? AND (? IS NULL OR worker = ?)",
+                                        (status, now, now, reference, Status.RUNNING, worker, worker))
+
+        self._changed(cursor.rowcount > 0)
+        return cursor.rowcount > 0
+
+    def extend(self, reference, user_id, additional_trials, model_key, work_units=None, cpu_seconds_estimate=None):
+        """
+        Queue a finished run of a user again to run 'additional_trials' more trials, return False if there is no such run.
+
+        The run must have been of the model with 'model_key', a run of a model that has changed
+        since cannot be extended.  The size and cost of the run become those of the extension, so the CPU seconds it takes
+        calibrate the estimates like any other run.
+        """
+        with closing(self._connect()) as connection:
+            # The extension runs as one run, also for a run that was split into shards.
+            cursor = connection.execute("UPDATE jobs SET status = ?, started = NULL, finished = NULL, attempts = 0, extension_trials = ?, shards = 0, "
+                                        "extended_trials_completed = trials_completed, extended_trials_failed = trials_failed, "
+                                        "trials_total = COALESCE(trials_total, 0) + ?, work_units = ?, cpu_seconds_estimate = ?, cpu_seconds = NULL, "
+                                        f"updated = ?, revision = {_NEXT_REVISION} WHERE reference = ? AND user_id = ? AND status = ? AND model_key = ?",
+                                        (Status.PENDING, additional_trials, additional_trials, work_units, cpu_seconds_estimate, time(),
+                                         reference, user_id, Status.FINISHED, model_key))
+
+        self._changed(cursor.rowcount > 0)
+        return cursor.rowcount > 0
+
+    def extension_trials(self, reference):
+        """Return the number of trials a run is extended by, 0 if it is not being extended."""
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT extension_trials FROM jobs WHERE reference = ?", (reference,)).fetchone()
+
+        return 0 if row is None else row[0]
+
+    def cancel(self, reference, user_id):
+        """
+        Cancel a pending or running run of a user, and its shards, return the status it had, None if it could not be cancelled.
+
+        Cancelling the extension of a run only cancels the extension, the run is finished again
+        with the trials and progress it had before it was extended.
+        """
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT status, extension_trials FROM jobs WHERE reference = ? AND user_id = ? AND status IN (?, ?)",
+                                         (reference, user_id, Status.PENDING, Status.RUNNING)).fetchone()
+                now = time()
+                if row is not None and row[1]:
+                    connection.execute("UPDATE jobs SET status = ?, finished = ?, updated = ?, trials_total = trials_total - extension_trials, extension_trials = 0, "
+                                       "trials_completed = extended_trials_completed, trials_failed = extended_trials_failed, worker = NULL, lease_expires = NULL, "
+                                       f"revision = {_NEXT_REVISION} WHERE reference = ?", (Status.FINISHED, now, now, reference))
+                elif row is not None:
+                    connection.execute(f"UPDATE jobs SET status = ?, finished = ?, updated = ?, revision = {_NEXT_REVISION} WHERE reference = ?",
+                                       (Status.CANCELLED, now, now, reference))
+                    connection.execute(f"UPDATE jobs SET status = ?, finished = ?, updated = ?, revision = {_NEXT_REVISION} WHERE parent = ? AND status IN (?, ?)",
+                                       (Status.CANCELLED, now, now, reference, Status.PENDING, Status.RUNNING))
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+        self._changed(row is not None)
+        return None if row is None else row[0]
+
+    def set_priority(self, reference, user_id, priority):
+        """Change the priority of a pending or running run of a user, and of its shards, return False if there is no such run."""
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(f"UPDATE jobs SET priority = ?, updated = ?, revision = {_NEXT_REVISION} "
+                                        "WHERE (reference = ? OR parent = ?) AND user_id = ? AND status IN (?, ?)",
+                                        (priority, time(), reference, reference, user_id, Status.PENDING, Status.RUNNING))
+
+        self._changed(cursor.rowcount > 0)
+        return cursor.rowcount > 0
+
+    def requeue(self, reference, count_attempt=True, worker=None):
+        """
+        Put a running run back in the queue, with 'count_attempt' False the attempt it was on is not counted.
+
+        With a 'worker' the run must be leased to that worker.
+        """
+        with closing(self._connect()) as connection:
+            cursor = connection.execute("UPDATE jobs SET status = ?, started = NULL, trials_completed = 0, trials_failed = 0, worker = NULL, lease_expires = NULL, "
+                                        f"attempts = attempts - ?, updated = ?, revision = {_NEXT_REVISION} WHERE reference = ? AND status = ? AND (? IS NULL OR worker = ?)",
+                                        (Status.PENDING, 0 if count_attempt else 1, time(), reference, Status.RUNNING, worker, worker))
+
+        self._changed(cursor.rowcount > 0)
+
+    def running(self, worker_prefix=None):
+        """Return the references of the runs marked as running, with 'worker_prefix' only those of workers named so and those of no worker."""
+        query = "SELECT reference FROM jobs WHERE status = ? AND shards = 0"
+        parameters = [Status.RUNNING]
+        if worker_prefix is not None:
+            query += " AND (worker IS NULL OR substr(worker, 1, ?) = ?)"
+            parameters.extend([len(worker_prefix), worker_prefix])
+        with closing(self._connect()) as connection:
+            rows = connection.execute(query + " ORDER BY seq", parameters).fetchall()
+
+        return [row[0] for row in rows]
+
+    def heartbeat(self, references, worker, lease_seconds):
+        """Renew the leases 'worker' holds on the running runs in 'references', return the references whose lease it still holds."""
+        if not references:
+            return []
+
+        placeholders = ', '.join('?' * len(references))
+        with closing(self._connect()) as connection:
+            connection.execute(f"UPDATE jobs SET lease_expires = ? WHERE reference IN ({placeholders}) AND worker = ? AND status = ?",
+                               [time() + lease_seconds] + list(references) + [worker, Status.RUNNING])
+            rows = connection.execute(f"SELECT reference FROM jobs WHERE reference IN ({placeholders}) AND worker = ? AND status = ?",
+                                      list(references) + [worker, Status.RUNNING]).fetchall()
+
+        return [row[0] for row in rows]
+
+    def release_expired(self, max_attempts):
+        """
+        Take the running runs whose lease expired from their workers, presumed dead.
+
+        A run goes back in the queue unless it has had 'max_attempts' attempts, then it is
+        finished.  Return the released runs as a list of (reference, new status).
+        """
+        released = []
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time()
+                rows = connection.execute("SELECT reference, attempts FROM jobs WHERE status = ? AND lease_expires < ? AND shards = 0",
+                                          (Status.RUNNING, now)).fetchall()
+                for reference, attempts in rows:
+                    if attempts < max_attempts:
+                        connection.execute("UPDATE jobs SET status = ?, started = NULL, trials_completed = 0, trials_failed = 0, worker = NULL, "
+                                           f"lease_expires = NULL, updated = ?, revision = {_NEXT_REVISION} WHERE reference = ?",
+                                           (Status.PENDING, now, reference))
+                        released.append((reference, Status.PENDING))
+                    else:
+                        connection.execute("UPDATE jobs SET status = ?, finished = ?, lease_expires = NULL, updated = ?, "
+                                           f"revision = {_NEXT_REVISION} WHERE reference = ?",
+                                           (Status.FINISHED, now, now, reference))
+                        released.append((reference, Status.FINISHED))
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+        self._changed(bool(released))
+        return released
+
+    def shard(self, reference):
+        """Return the run a shard belongs to and the range of its trials as a dict of parent, trials_start and trials_stop, None if it is not a shard."""
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT parent, trials_start, trials_stop FROM jobs WHERE reference = ? AND parent IS NOT NULL", (reference,)).fetchone()
+
+        return None if row is None else dict(zip(['parent', 'trials_start', 'trials_stop'], row))
+
+    def shards(self, reference):
+        """Return the shards of a run in trial order, each a dict of reference, trials_start, trials_stop, status and cpu_seconds."""
+        columns = ['reference', 'trials_start', 'trials_stop', 'status', 'cpu_seconds']
+        with closing(self._connect()) as connection:
+            rows = connection.execute(f"SELECT {', '.join(columns)} FROM jobs WHERE parent = ? ORDER BY trials_start", (reference,)).fetchall()
+
+        return [dict(zip(columns, row)) for row in rows]
+
+    def claim_merge(self, worker, lease_seconds):
+        """Lease a running run whose shards are all finished to 'worker' to merge, return its reference, None if there is none."""
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time()
+                row = connection.execute("SELECT reference FROM jobs AS run WHERE status = ? AND shards > 0 AND (lease_expires IS NULL OR lease_expires < ?) "
+                                         "AND NOT EXISTS (SELECT 1 FROM jobs AS shard WHERE shard.parent = run.reference AND shard.status IN (?, ?)) "
+                                         "ORDER BY seq LIMIT 1",
+                                         (Status.RUNNING, now, Status.PENDING, Status.RUNNING)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE jobs SET worker = ?, lease_expires = ? WHERE reference = ?", (worker, now + lease_seconds, row[0]))
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+        return None if row is None else row[0]
+
+    def release_merge(self, reference, worker):
+        """Give up the lease 'worker' holds on a run it was merging, so another worker can merge it."""
+        with closing(self._connect()) as connection:
+            connection.execute("UPDATE jobs SET worker = NULL, lease_expires = NULL WHERE reference = ? AND worker = ? AND status = ? AND shards > 0",
+                               (reference, worker, Status.RUNNING))
+
+    def worker(self, reference):
+        """Return the worker a run is (or was last) leased to, None if there is none."""
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT worker FROM jobs WHERE reference = ?", (reference,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def attempts(self, reference):
+        """Return the number of times a run has been claimed."""
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT attempts FROM jobs WHERE reference = ?", (reference,)).fetchone()
+
+        return 0 if row is None else row[0]
+
+    def update_progress(self, reference, trials_completed, trials_failed, trials_total=None):
+        """Record the progress of a running run, the progress of a shard adds up to the progress of the run it belongs to."""
+        with closing(self._connect()) as connection:
+            now = time()
+            # A run that is no longer running, say a cancelled extension, keeps its progress.
+            connection.execute("UPDATE jobs SET trials_completed = ?, trials_failed = ?, trials_total = COALESCE(?, trials_total), "
+                               f"updated = ?, revision = {_NEXT_REVISION} WHERE reference = ? AND status = ?",
+                               (trials_completed, trials_failed, trials_total, now, reference, Status.RUNNING))
+            connection.execute("UPDATE jobs SET trials_completed = (SELECT SUM(trials_completed) FROM jobs AS shard WHERE shard.parent = jobs.reference), "
+                               "trials_failed = (SELECT SUM(trials_failed) FROM jobs AS shard WHERE shard.parent = jobs.reference), "
+                               f"updated = ?, revision = {_NEXT_REVISION} WHERE reference = (SELECT parent FROM jobs WHERE reference = ?)",
+                               (now, reference))
+
+        self._changed()
+
+    def record_cpu_seconds(self, reference, cpu_seconds):
+        """Record the CPU seconds a run took, calibrating the estimates of later runs of the same model."""
+        with closing(self._connect()) as connection:
+            connection.execute(f"UPDATE jobs SET cpu_seconds = ?, updated = ?, revision = {_NEXT_REVISION} WHERE reference = ?",
+                               (cpu_seconds, time(), reference))
+
+        self._changed()
+
+    def cpu_seconds_per_work_unit(self, model_key):
+        """Return the CPU seconds per unit of work of the latest runs of a model, of any model if it has no runs, None if no run was recorded."""
+        with closing(self._connect()) as connection:
+            for condition, parameters in [("model_key = ?", (model_key,)), ("1", ())]:
+                row = connection.execute(f"SELECT SUM(cpu_seconds), SUM(work_units) FROM (SELECT cpu_seconds, work_units FROM jobs WHERE {condition} "
+                                         "AND cpu_seconds IS NOT NULL AND work_units > 0 ORDER BY seq DESC LIMIT ?)",
+                                         parameters + (CALIBRATION_RUNS,)).fetchone()
+                if row[1]:
+                    return row[0] / row[1]
+
+        return None
+
+    def run_info(self, reference):
+        """Return the information of a run as a dict, None if there is no such run."""
+        with closing(self._connect()) as connection:
+            row = connection.execute(f"SELECT {', '.join(_RUN_INFO_COLUMNS)} FROM jobs WHERE reference = ?", (reference,)).fetchone()
+
+        return None if row is None else _run_info(row)
+
+    def status(self, reference):
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT status FROM jobs WHERE reference = ?", (reference,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def count(self, status):
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND parent IS NULL", (status,)).fetchone()
+
+        return row[0]
+
+    def count_leased(self, worker_prefix):
+        """Return the number of runs and shards running on workers named 'worker_prefix'..., runs being merged are not counted."""
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND shards = 0 AND substr(worker, 1, ?) = ?",
+                                     (Status.RUNNING, len(worker_prefix), worker_prefix)).fetchone()
+
+        return row[0]
+
+    def record_timings(self, reference, timings):
+        """Record the seconds spent in the stages of a run, given as a dict of stage name to seconds."""
+        with closing(self._connect()) as connection:
+            connection.executemany("INSERT OR REPLACE INTO timings (reference, stage, seconds) VALUES (?, ?, ?)",
+                                   [(reference, stage, seconds) for stage, seconds in timings.items()])
+
+    def timings(self, reference):
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT stage, seconds FROM timings WHERE reference = ?", (reference,)).fetchall()
+
+        return dict(rows)
+
+    def stage_histograms(self, buckets):
+        """Return, per stage, the cumulative number of runs in each of the 'buckets', the number of runs and the total seconds."""
+        bucket_columns = ', '.join('SUM(seconds <= ?)' for _ in buckets)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(f"SELECT stage, COUNT(*), SUM(seconds), {bucket_columns} FROM timings GROUP BY stage", list(buckets)).fetchall()
+
+        return {row[0]: (list(row[3:]), row[1], row[2]) for row in rows}
+
+    def list_runs(self, user_id, status=None, offset=0, limit=None):
+        """
+        Return the runs of a user, newest first, and the total number of runs matching the filter.
+
+        Each run is a dict of its reference, title, status, timestamps and trial progress.
+        """
+        condition = "user_id = ? AND parent IS NULL"
+        parameters = [user_id]
+        if status is not None:
+            condition += " AND status = ?"
+            parameters.append(status)
+        query = f"SELECT {', '.join(_RUN_INFO_COLUMNS)}, COUNT(*) OVER () FROM jobs WHERE {condition} ORDER BY seq DESC LIMIT ? OFFSET ?"
+
+        with closing(self._connect()) as connection:
+            rows = connection.execute(query, parameters + [-1 if limit is None else limit, offset]).fetchall()
+            if rows:
+                total = rows[0][-1]
+            else:
+                # An empty page, past the last run, does not carry the count.
+                total = connection.execute(f"SELECT COUNT(*) FROM jobs WHERE {condition}", parameters).fetchone()[0]
+
+        return [_run_info(row) for row in rows], total
+
+    def changed_runs(self, user_id, since, references=None):
+        """Return the runs of a user changed after revision 'since', oldest change first, optionally only the runs in 'references'."""
+        query = f"SELECT {', '.join(_RUN_INFO_COLUMNS)} FROM jobs WHERE user_id = ? AND revision > ? AND parent IS NULL"
+        parameters = [user_id, since]
+        if references:
+            query += f" AND reference IN ({', '.join('?' * len(references))})"
+            parameters.extend(references)
+        query += " ORDER BY revision"
+
+        with closing(self._connect()) as connection:
+            rows = connection.execute(query, parameters).fetchall()
+
+        return [_run_info(row) for row in rows]
@@ -0,0 +1,119 @@
+import json
+import threading
+from time import time
+from urllib.request import urlopen
+
+from cryptography.hazmat.primitives import serialization
+from jwt.algorithms import RSAAlgorithm
+
+
+def _load_jwks(source, timeout):
+    """Load a JSON Web Key Set from a URL, giving up after 'timeout' seconds, or a local file."""
+    if source.startswith('http://') or source.startswith('https://'):
+        with urlopen(source, timeout=timeout) as response:
+            return json.loads(response.read())
+
+    with open(source) as f:
+        return json.loads(f.read())
+
+
+def _public_key_bytes(key):
+    rsa_key = {
+        "kty": key["kty"],
+        "kid": key["kid"],
+        "use": key["use"],
+        "n": key["n"],
+        "e": key["e"]
+    }
+    true_rsa_key = RSAAlgorithm.from_jwk(rsa_key)
+    return true_rsa_key.public_bytes(encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+class JWKSCache(object):
+    """
+    Cache of the parsed public keys of a JSON Web Key Set, keyed by 'kid'.
+
+    Keys are kept for 'ttl' seconds.  A lookup made within 'refresh_margin' seconds
+    of expiry starts a refresh in the background, a lookup for an unknown 'kid'
+    refreshes straight away (at most once every 'min_refresh_interval' seconds).
+    A URL source that does not answer within 'timeout' seconds fails the refresh, after a
+    failed refresh the stale keys are kept for another 'failure_backoff' seconds.
+    The source can be a URL or the path of a local JWKS file.
+    """
+
+    def __init__(self, source, ttl=600, refresh_margin=60, min_refresh_interval=30, timeout=5, failure_backoff=30):
+        self._source = source
+        self._ttl = ttl
+        self._refresh_margin = refresh_margin
+        self._min_refresh_interval = min_refresh_interval
+        self._timeout = timeout
+        self._failure_backoff = failure_backoff
+        self._keys = {}
+        self._expires = 0.0
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        self._background_refresh = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def _refresh(self):
+        with self._lock:
+            self._last_refresh = time()
+            try:
+                jwks = _load_jwks(self._source, self._timeout)
+            except (OSError, ValueError):
+                self.refresh_errors += 1
+                self._expires = max(self._expires, time() + self._failure_backoff)
+                return
+
+            keys = {}
+            for key in jwks.get("keys", []):
+                if key.get("kty") == "RSA" and "kid" in key:
+                    keys[key["kid"]] = _public_key_bytes(key)
+
+            self._keys = keys
+            self._expires = time() + self._ttl
+            self.refreshes += 1
+
+    def _start_background_refresh(self):
+        if self._background_refresh is not None and self._background_refresh.is_alive():
+            return
+
+        self._background_refresh = threading.Thread(target=self._refresh, daemon=True)
+        self._background_refresh.start()
+
+    def get_key(self, kid):
+        """Return the PEM encoded public key for 'kid', or None if the key set does not have it."""
+        now = time()
+        if now >= self._expires:
+            self._refresh()
+        elif now >= self._expires - self._refresh_margin and now - self._last_refresh >= self._min_refresh_interval:
+            self._start_background_refresh()
+
+        key = self._keys.get(kid)
+        if key is None:
+            self.misses += 1
+            if self._last_refresh is None or time() - self._last_refresh >= self._min_refresh_interval:
+                self._refresh()
+                key = self._keys.get(kid)
+        else:
+            self.hits += 1
+
+        return key
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._expires = 0.0
+            self._last_refresh = None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'keys': len(self._keys),
+        }
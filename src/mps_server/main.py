@@ -1,21 +1,52 @@
+import json
 import os
+import threading
+from time import perf_counter, time
 
-from flask import Flask, jsonify, request, session
+from flask import Flask, Response, g, jsonify, request, session
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from mps_server.auth0 import requires_auth, AuthError
+from mps_server.auth0 import requires_auth, requires_auth_or_scoped_token, issue_scoped_token, AuthError, jwks_cache, token_cache
 from mps_server.config import Config
-from mps_server.management import store_cellml_file, list_model_files, model_parameter_information, store_parameter_uncertainties_file, \
-    parameter_uncertainty_distribution_information, list_uncertainty_definitions_files, list_output_parameter_files, output_parameters_information, store_output_parameters_file, \
-    store_simulation_info, list_simulation_references
-from mps_server.simulations import queue_simulation, get_simulation_info, get_simulation_result
+from mps_server.management import start_cellml_upload, cellml_upload_status, list_model_files, model_parameter_information, store_parameter_uncertainties_file, \
+    parameter_uncertainty_distribution_information, list_uncertainty_definitions_files, list_output_parameter_files, output_parameters_information, store_output_parameters_file
+from mps_server.metrics import PROMETHEUS_MIMETYPE, request_duration, request_stage_duration
+from mps_server.results import ARROW_STREAM_MIMETYPE, BINARY_MIMETYPE, arrow_available, iter_result_arrow, iter_result_binary, iter_result_json, iter_result_ndjson
+from mps_server.simulations import queue_simulation, cancel_simulation, set_simulation_priority, extend_simulation, get_simulation_info, simulation_metrics, list_simulations, wait_for_simulation_changes, get_simulation_result, get_simulation_statistics
+from mps_server.transport import available_encodings, iter_compressed
+
+# Room for the multipart boundaries and headers around an uploaded file.
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('MPS_SECRET_KEY', 'secret-key-value')
+# Larger request bodies are refused before they are read, no request is anywhere near an upload in size.
+app.config['MAX_CONTENT_LENGTH'] = Config.UPLOAD_MAX_BYTES + UPLOAD_MULTIPART_OVERHEAD
 
 CORS(app)
 
 
+@app.before_request
+def start_request_timer():
+    g.request_start = perf_counter()
+
+
+@app.after_request
+def record_request_duration(response):
+    # Streamed responses are timed until they start, streaming the result is timed as its own stage.
+    if 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_duration.observe(route, perf_counter() - g.request_start)
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    lines = request_duration.lines() + request_stage_duration.lines() + simulation_metrics()
+    return Response('\n'.join(lines) + '\n', mimetype=PROMETHEUS_MIMETYPE)
+
+
 @app.errorhandler(AuthError)
 def handle_auth_error(ex: AuthError):
     """
@@ -28,6 +59,13 @@ def handle_auth_error(ex: AuthError):
     return response
 
 
+@app.errorhandler(RequestEntityTooLarge)
+def handle_request_entity_too_large(ex: RequestEntityTooLarge):
+    response = jsonify({'message': 'Uploaded file is too large'})
+    response.status_code = ex.code
+    return response
+
+
 @app.route("/api/v1/messages/public-message")
 def public_message():
     return {"message": "Hello, the public API is working!"}
@@ -39,6 +77,12 @@ def protected_message():
     return {"message": "Hello, the protected API is working!"}
 
 
+@app.route("/api/v1/info/cache-statistics")
+@requires_auth
+def cache_statistics():
+    return jsonify({'jwks': jwks_cache.stats(), 'verified_tokens': token_cache.stats()})
+
+
 @app.route("/api/v1/info/model-parameters")
 @requires_auth
 def parameter_info():
@@ -68,13 +112,72 @@ def output_parameters_info():
     return jsonify({'output_parameters_information': output_information})
 
 
+RESULT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'binary': BINARY_MIMETYPE,
+    'arrow': ARROW_STREAM_MIMETYPE,
+}
+
+
+def _result_response(result, trial_offset):
+    """Serialise a simulation result in the format and encoding negotiated with the client, JSON by default."""
+    offered = [RESULT_FORMATS['json'], RESULT_FORMATS['ndjson'], RESULT_FORMATS['binary']]
+    if arrow_available():
+        offered.append(RESULT_FORMATS['arrow'])
+
+    mimetype = RESULT_FORMATS.get(request.args.get('format'))
+    if mimetype not in offered:
+        mimetype = request.accept_mimetypes.best_match(offered, default=RESULT_FORMATS['json'])
+
+    if mimetype == RESULT_FORMATS['ndjson']:
+        chunks = iter_result_ndjson(result, trial_offset)
+    elif mimetype == RESULT_FORMATS['binary']:
+        chunks = iter_result_binary(result)
+    elif mimetype == RESULT_FORMATS['arrow']:
+        chunks = iter_result_arrow(result)
+    else:
+        chunks = iter_result_json(result)
+
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is not None:
+        chunks = iter_compressed(chunks, encoding)
+        headers['Content-Encoding'] = encoding
+
+    return Response(request_stage_duration.iter_timed('serialize_result', chunks), mimetype=mimetype, headers=headers)
+
+
 @app.route("/api/v1/user/simulation-result")
 @requires_auth
 def user_simulation_result():
     reference = request.args.get('reference')
-    r = get_simulation_result(reference)
+    columns = request.args.get('columns')
+    trial_start = request.args.get('trialStart', None, type=int)
+    trial_stop = request.args.get('trialStop', None, type=int)
+    stride = request.args.get('stride', 1, type=int)
+    with request_stage_duration.time('load_result'):
+        r = get_simulation_result(reference, columns.split(',') if columns else None, trial_start, trial_stop, stride)
     if r is not None:
-        return r
+        return _result_response(r, trial_start or 0)
+
+    response = jsonify({'message': 'No information available for simulation.'})
+    response.status_code = 400
+    return response
+
+
+@app.route("/api/v1/user/simulation-statistics")
+@requires_auth
+def user_simulation_statistics():
+    reference = request.args.get('reference')
+    try:
+        with request_stage_duration.time('simulation_statistics'):
+            statistics = get_simulation_statistics(reference)
+    except OSError:
+        statistics = None
+
+    if statistics is not None:
+        return jsonify({'simulation_statistics': statistics})
 
     response = jsonify({'message': 'No information available for simulation.'})
     response.status_code = 400
@@ -94,6 +197,72 @@ def user_simulation_info():
     return response
 
 
+# Every open event stream or long-poll holds a server thread, leave threads for the other requests.
+_event_streams = threading.BoundedSemaphore(min(Config.SIMULATION_EVENTS_MAX_STREAMS, max(1, Config.SERVER_THREADS - 1)))
+SIMULATION_EVENTS_SCOPE = "simulation-events"
+
+
+@app.route("/api/v1/user/simulation-events/token", methods=['POST'])
+@requires_auth
+def user_simulation_events_token():
+    """Issue a short-lived token for the simulation event stream, an EventSource cannot send the Authorization header."""
+    return jsonify({'token': issue_scoped_token(session['user_id'], SIMULATION_EVENTS_SCOPE), 'expires_in': Config.SIMULATION_EVENTS_TOKEN_TTL})
+
+
+@app.route("/api/v1/user/simulation-events")
+@requires_auth_or_scoped_token(SIMULATION_EVENTS_SCOPE, Config.SIMULATION_EVENTS_TOKEN_TTL)
+def user_simulation_events():
+    """
+    Report changes to the user's simulation runs, optionally only those in 'references'.
+
+    By default the changes are pushed as Server-Sent Events, the event id is the revision of the
+    change so a reconnecting EventSource carries on where it left off.  An EventSource
+    authenticates with a 'token' from /api/v1/user/simulation-events/token, and gets a new one
+    when it is refused with 401.  With 'mode=poll' this is a long-poll that answers with the
+    changes after revision 'since' as soon as there are any, or with no changes after 'timeout'
+    seconds.  At most Config.SIMULATION_EVENTS_MAX_STREAMS streams and long-polls are open at a
+    time, beyond that the request is refused with 503.
+    """
+    user_id = session['user_id']
+    references = request.args.get('references')
+    references = references.split(',') if references else None
+    since = request.args.get('since', None, type=int)
+    if since is None:
+        try:
+            since = int(request.headers.get('Last-Event-ID', 0) or 0)
+        except ValueError:
+            since = 0
+
+    if not _event_streams.acquire(blocking=False):
+        response = jsonify({'message': 'Too many simulation event streams open, try again later.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+    if request.args.get('mode') == 'poll':
+        try:
+            timeout = min(request.args.get('timeout', 30.0, type=float), Config.SIMULATION_EVENTS_TIMEOUT)
+            runs = wait_for_simulation_changes(user_id, since, references, timeout)
+        finally:
+            _event_streams.release()
+        return jsonify({'simulation_info': runs, 'revision': max([since] + [run['revision'] for run in runs])})
+
+    def events(revision):
+        deadline = time() + Config.SIMULATION_EVENTS_TIMEOUT
+        while time() < deadline:
+            runs = wait_for_simulation_changes(user_id, revision, references, min(15.0, max(0.0, deadline - time())))
+            if not runs:
+                yield ': keep-alive\n\n'
+            for run in runs:
+                revision = run['revision']
+                yield f"id: {revision}\nevent: simulation-info\ndata: {json.dumps(run)}\n\n"
+
+    response = Response(events(since), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    # Closed by the server when the stream ends or the client goes away, started or not.
+    response.call_on_close(_event_streams.release)
+    return response
+
+
 @app.route("/api/v1/user/list-models")
 @requires_auth
 def user_models():
@@ -104,17 +273,12 @@ def user_models():
 @app.route("/api/v1/user/list-simulations")
 @requires_auth
 def user_simulations():
-    references = list_simulation_references(Config.CLIENT_WORKING_DIR, session['user_id'])
+    status = request.args.get('status')
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', None, type=int)
+    info, total = list_simulations(session['user_id'], status, max(0, offset), limit)
 
-    info = []
-    for reference in references:
-        i = get_simulation_info(reference)
-        if i:
-            info.append(i)
-        else:
-            print('remove dead reference.')
-
-    return jsonify({'simulation_info': info})
+    return jsonify({'simulation_info': info, 'total': total})
 
 
 @app.route("/api/v1/user/list-parameter-uncertainties")
@@ -140,21 +304,37 @@ def upload():
     result = -1
     if len(content) == 1 and 'file' in content:
         file_uploaded = content['file']
-        result = store_cellml_file({'id': session['user_id']}, {'base_dir': Config.CLIENT_WORKING_DIR, 'file': file_uploaded})
+        with request_stage_duration.time('store_upload'):
+            result, ticket = start_cellml_upload({'id': session['user_id']}, {'base_dir': Config.CLIENT_WORKING_DIR, 'file': file_uploaded, 'max_bytes': Config.UPLOAD_MAX_BYTES})
         if result == 0:
-            return jsonify({"message": "File upload success"})
+            response = jsonify({"message": "File upload received", "ticket": ticket})
+            response.status_code = 202
+            return response
 
     message = 'Something went wrong with upload'
     if result == 1:
         message = 'File upload error'
-    elif result == 2:
-        message = 'Uploaded file is not CellML 2.0'
+    elif result == 3:
+        message = 'Uploaded file is too large'
 
     response = jsonify({'message': message})
     response.status_code = 400
     return response
 
 
+@app.route("/api/v1/upload/status")
+@requires_auth
+def upload_status():
+    ticket = request.args.get('ticket')
+    status = cellml_upload_status(Config.CLIENT_WORKING_DIR, session['user_id'], ticket)
+    if status is not None:
+        return jsonify({'upload_status': status})
+
+    response = jsonify({'message': 'No information available for upload.'})
+    response.status_code = 400
+    return response
+
+
 @app.route("/api/v1/store/parameter-uncertainties", methods=['POST'])
 @requires_auth
 def store_uncertainty_definitions():
@@ -204,14 +384,69 @@ def submit_simulation():
     simulation_data['user_id'] = session['user_id']
     result = queue_simulation(simulation_data)
 
+    if result is not None and 'rejected' in result:
+        response = jsonify({'message': 'Job is larger than allowed, reduce the number of trials or time points', **result})
+        response.status_code = 400
+        return response
+
     if result is not None:
-        store_simulation_info({
-            'base_dir': Config.CLIENT_WORKING_DIR,
-            'user_id': session['user_id'],
-            **result,
-        })
-        return jsonify({'message': 'Job submitted successfully', **result})
+        message = 'Identical job already submitted' if result.get('cached') else 'Job submitted successfully'
+        return jsonify({'message': message, **result})
 
     response = jsonify({'message': 'An error occurred while trying to submit job'})
     response.status_code = 400
     return response
+
+
+@app.route("/api/v1/simulation/cancel", methods=['POST'])
+@requires_auth
+def cancel_submitted_simulation():
+    reference = request.json.get('reference')
+    info = cancel_simulation(session['user_id'], reference)
+    if info is not None:
+        return jsonify({'message': 'Job cancelled', 'simulation_info': info})
+
+    response = jsonify({'message': 'Job is not pending or running'})
+    response.status_code = 400
+    return response
+
+
+@app.route("/api/v1/simulation/priority", methods=['POST'])
+@requires_auth
+def change_simulation_priority():
+    reference = request.json.get('reference')
+    try:
+        priority = int(request.json.get('priority'))
+    except (TypeError, ValueError):
+        priority = None
+
+    info = None if priority is None else set_simulation_priority(session['user_id'], reference, priority)
+    if info is not None:
+        return jsonify({'message': 'Job priority changed', 'simulation_info': info})
+
+    response = jsonify({'message': 'Job priority could not be changed'})
+    response.status_code = 400
+    return response
+
+
+@app.route("/api/v1/simulation/extend", methods=['POST'])
+@requires_auth
+def extend_finished_simulation():
+    reference = request.json.get('reference')
+    try:
+        additional_trials = int(request.json.get('additionalTrials'))
+    except (TypeError, ValueError):
+        additional_trials = None
+
+    info = None if additional_trials is None else extend_simulation(session['user_id'], reference, additional_trials)
+    if info is not None and 'rejected' in info:
+        response = jsonify({'message': 'Job is larger than allowed, reduce the number of trials or time points', **info})
+        response.status_code = 400
+        return response
+
+    if info is not None:
+        return jsonify({'message': 'Job extended', 'simulation_info': info})
+
+    response = jsonify({'message': 'Job could not be extended'})
+    response.status_code = 400
+    return response
@@ -1,9 +1,26 @@
 import json
+import multiprocessing as mp
 import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from time import time
 
-from cellsolvertools.utilities import is_cellml_file, get_parameters_from_model
+try:
+    from cellsolvertools.utilities import is_cellml_file, get_parameters_from_model
+except ImportError:
+    # Simulations with the fake and process-pool executors run without cellsolvertools, models cannot be uploaded or inspected.
+    is_cellml_file = get_parameters_from_model = None
 
-from mps_server.common import normalise_for_use_as_path
+from mps_server.common import normalise_for_use_as_path, write_file_atomically
+from mps_server.config import Config
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+_upload_validation_executor = None
+_upload_validation_lock = threading.Lock()
 
 
 def _create_output_dir(required_dir):
@@ -17,15 +34,20 @@ def _model_files_dir(base_dir, user_id):
     return os.path.join(base_dir, user_path, 'model_files')
 
 
-def _output_parameter_files_dir(base_dir, user_id, associated_model):
+def _model_parameter_cache_dir(base_dir, user_id):
     user_path = normalise_for_use_as_path(user_id)
-    model_path = normalise_for_use_as_path(associated_model)
-    return os.path.join(base_dir, user_path, 'output_parameter_files', model_path)
+    return os.path.join(base_dir, user_path, 'model_parameter_cache')
+
+
+def _uploads_dir(base_dir, user_id):
+    user_path = normalise_for_use_as_path(user_id)
+    return os.path.join(base_dir, user_path, 'uploads')
 
 
-def _simulation_files_dir(base_dir, user_id):
+def _output_parameter_files_dir(base_dir, user_id, associated_model):
     user_path = normalise_for_use_as_path(user_id)
-    return os.path.join(base_dir, user_path, 'simulation_files')
+    model_path = normalise_for_use_as_path(associated_model)
+    return os.path.join(base_dir, user_path, 'output_parameter_files', model_path)
 
 
 def _uncertainty_definitions_files_dir(base_dir, user_id, associated_model):
@@ -52,29 +74,10 @@ def list_model_files(base_dir, user_id):
     return os.listdir(files_dir)
 
 
-def list_simulation_references(base_dir, user_id):
-    files_dir = _simulation_files_dir(base_dir, user_id)
-    _create_output_dir(files_dir)
-    return os.listdir(files_dir)
-
-
 def get_model_file(base_dir, user_id, model):
     return os.path.join(_model_files_dir(base_dir, user_id), model)
 
 
-def store_simulation_info(simulation_info):
-    output_dir = _simulation_files_dir(simulation_info['base_dir'], simulation_info['user_id'])
-    target_location = os.path.join(output_dir, simulation_info['reference'])
-    try:
-        with open(target_location, 'w') as f:
-            f.write("")
-
-    except OSError:
-        return 1
-
-    return 0
-
-
 def store_output_parameters_file(file_info, data):
     output_dir = _output_parameter_files_dir(file_info['base_dir'], file_info['user_id'], file_info['associated_model'])
     target_location = os.path.join(output_dir, file_info['filename'])
@@ -103,29 +106,200 @@ def store_parameter_uncertainties_file(file_info, data):
     return 0
 
 
-def store_cellml_file(user_info, file_info):
+def _save_upload(file, location, max_bytes):
+    """Copy an uploaded file to 'location' in chunks, return False (and remove the copy) if it is larger than 'max_bytes'."""
+    size = 0
+    with open(location, 'wb') as fb:
+        for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''):
+            size += len(chunk)
+            if size > max_bytes:
+                break
+            fb.write(chunk)
+
+    if size > max_bytes:
+        os.remove(location)
+        return False
+
+    return True
+
+
+def _upload_status_file(base_dir, user_id, ticket):
+    return os.path.join(_uploads_dir(base_dir, user_id), f"{ticket}.json")
+
+
+def _set_upload_status(base_dir, user_id, ticket, status, **details):
+    status_file = _upload_status_file(base_dir, user_id, ticket)
+    with open(status_file) as f:
+        upload_status = json.loads(f.read())
+
+    upload_status.update(details, status=status, updated=time())
+    write_file_atomically(status_file, json.dumps(upload_status))
+
+
+def _validate_cellml_upload(base_dir, user_id, ticket):
+    """Validate an uploaded file and, if it is CellML, move it to the model files and extract its parameter information."""
+    upload_location = os.path.join(_uploads_dir(base_dir, user_id), f"{ticket}.upload")
+    with open(_upload_status_file(base_dir, user_id, ticket)) as f:
+        filename = json.loads(f.read())['filename']
+
+    try:
+        _set_upload_status(base_dir, user_id, ticket, UploadStatus.VALIDATING)
+        if not is_cellml_file(upload_location):
+            os.remove(upload_location)
+            _set_upload_status(base_dir, user_id, ticket, UploadStatus.REJECTED, message='Uploaded file is not CellML 2.0')
+            return
+
+        _set_upload_status(base_dir, user_id, ticket, UploadStatus.EXTRACTING_PARAMETERS)
+        target_location = os.path.join(_model_files_dir(base_dir, user_id), filename)
+        os.replace(upload_location, target_location)
+        _cache_model_parameter_information(target_location, _model_parameter_cache_file(base_dir, user_id, filename))
+        _set_upload_status(base_dir, user_id, ticket, UploadStatus.ACCEPTED, message='File upload success')
+    except Exception as exc:
+        _set_upload_status(base_dir, user_id, ticket, UploadStatus.ERROR, message=f'File upload error: {exc}')
+
+
+def _upload_validation_pool():
+    global _upload_validation_executor
+    with _upload_validation_lock:
+        if _upload_validation_executor is None:
+            # Spawn, a forked gunicorn worker is not a safe parent for the pool.
+            _upload_validation_executor = ProcessPoolExecutor(max_workers=Config.UPLOAD_VALIDATION_WORKERS, mp_context=mp.get_context('spawn'))
+
+        return _upload_validation_executor
+
+
+def _discard_upload_validation_pool(executor):
+    """Forget a pool that broke because one of its workers died, the next upload starts a new one."""
+    global _upload_validation_executor
+    with _upload_validation_lock:
+        if _upload_validation_executor is executor:
+            _upload_validation_executor = None
+
+
+def _upload_validation_done(base_dir, user_id, ticket, executor, future):
+    """Mark an upload whose validation did not run to the end, because its worker crashed, as an error."""
+    exception = future.exception()
+    if exception is None:
+        return
+
+    if isinstance(exception, BrokenProcessPool):
+        _discard_upload_validation_pool(executor)
+    try:
+        _set_upload_status(base_dir, user_id, ticket, UploadStatus.ERROR, message='File upload error: the file could not be validated')
+    except OSError:
+        pass
+
+
+def _submit_upload_validation(base_dir, user_id, ticket):
+    """Queue the validation of an upload, replacing the pool once if it is broken, return False if it could not be queued."""
+    for _ in range(2):
+        executor = _upload_validation_pool()
+        try:
+            future = executor.submit(_validate_cellml_upload, base_dir, user_id, ticket)
+        except BrokenProcessPool:
+            _discard_upload_validation_pool(executor)
+            continue
+
+        future.add_done_callback(partial(_upload_validation_done, base_dir, user_id, ticket, executor))
+        return True
+
+    return False
+
+
+def start_cellml_upload(user_info, file_info):
+    """
+    Store an uploaded file and queue its validation, return a result code and the upload ticket.
+
+    The result code is 0 on success, 1 if the file could not be stored or queued for validation and 3
+    if it is too large.
+    The progress of the validation is reported by cellml_upload_status.
+    """
     file = file_info['file']
-    output_dir = _model_files_dir(file_info['base_dir'], user_info['id'])
-    target_location = os.path.join(output_dir, file.filename)
-    test_location = target_location + '.test'
+    base_dir = file_info['base_dir']
+    user_id = user_info['id']
+    uploads_dir = _uploads_dir(base_dir, user_id)
+    _create_output_dir(uploads_dir)
+    _create_output_dir(_model_files_dir(base_dir, user_id))
+    ticket = str(uuid.uuid4())
     try:
-        with open(test_location, 'wb') as fb:
-            file.save(fb)
-
-        if is_cellml_file(test_location):
-            os.rename(test_location, target_location)
-        else:
-            os.remove(test_location)
-            return 2
+        if not _save_upload(file, os.path.join(uploads_dir, f"{ticket}.upload"), file_info.get('max_bytes', Config.UPLOAD_MAX_BYTES)):
+            return 3, None
+
+        write_file_atomically(_upload_status_file(base_dir, user_id, ticket), json.dumps({
+            'ticket': ticket,
+            'filename': file.filename,
+            'status': UploadStatus.RECEIVED,
+            'created': time(),
+            'updated': time(),
+        }))
     except OSError:
-        return 1
+        return 1, None
+
+    if not _submit_upload_validation(base_dir, user_id, ticket):
+        _set_upload_status(base_dir, user_id, ticket, UploadStatus.ERROR, message='File upload error: the file could not be validated')
+        os.remove(os.path.join(uploads_dir, f"{ticket}.upload"))
+        return 1, None
+
+    return 0, ticket
 
-    return 0
+
+def cellml_upload_status(base_dir, user_id, ticket):
+    """Return the status of the upload 'ticket', None if there is no such upload."""
+    try:
+        ticket = str(uuid.UUID(ticket))
+        with open(_upload_status_file(base_dir, user_id, ticket)) as f:
+            return json.loads(f.read())
+    except (TypeError, ValueError, OSError):
+        return None
+
+
+class UploadStatus(object):
+    RECEIVED = 'received'
+    VALIDATING = 'validating'
+    EXTRACTING_PARAMETERS = 'extracting_parameters'
+    ACCEPTED = 'accepted'
+    REJECTED = 'rejected'
+    ERROR = 'error'
+
+
+def _model_parameter_cache_file(base_dir, user_id, model_filename):
+    return os.path.join(_model_parameter_cache_dir(base_dir, user_id), f"{model_filename}.json")
+
+
+def _model_file_version(model_location):
+    stat = os.stat(model_location)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _cache_model_parameter_information(model_location, cache_location):
+    """Parse the model at 'model_location' and store its parameter information for this version of the file."""
+    version = _model_file_version(model_location)
+    information = get_parameters_from_model(model_location)
+    try:
+        content = json.dumps({'version': version, 'information': information})
+    except TypeError:
+        return information
+
+    _create_output_dir(os.path.dirname(cache_location))
+    write_file_atomically(cache_location, content)
+
+    return information
 
 
 def model_parameter_information(base_dir, user_id, model_filename):
+    """Return the parameter information of a model, parsed once per version of the model file and kept on disk."""
     target_location = os.path.join(_model_files_dir(base_dir, user_id), model_filename)
-    return get_parameters_from_model(target_location)
+    cache_location = _model_parameter_cache_file(base_dir, user_id, model_filename)
+    try:
+        with open(cache_location) as f:
+            cached = json.loads(f.read())
+
+        if cached['version'] == _model_file_version(target_location):
+            return cached['information']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return _cache_model_parameter_information(target_location, cache_location)
 
 
 def parameter_uncertainty_distribution_information(base_dir, user_id, associated_model, filename):
@@ -0,0 +1,119 @@
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+# Upper bounds (seconds) of the histogram buckets, from a fast request to a long simulation run.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 14400.0)
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+def histogram_lines(name, documentation, label_name, series, buckets=DURATION_BUCKETS):
+    """
+    Return the Prometheus text exposition lines of a histogram.
+
+    'series' maps a label value to a (bucket counts, count, sum) tuple, the bucket counts are
+    cumulative and follow 'buckets'.
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} histogram"]
+    for label_value, (bucket_counts, count, total) in sorted(series.items()):
+        labels = [(label_name, label_value)] if label_name else []
+        for bound, bucket_count in zip(buckets, bucket_counts):
+            lines.append(f"{name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {bucket_count}")
+        lines.append(f"{name}_bucket{_format_labels(labels + [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    return lines
+
+
+def gauge_lines(name, documentation, value):
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+
+
+class Histogram(object):
+    """A histogram of durations in seconds with one label, kept in memory by this process."""
+
+    def __init__(self, name, documentation, label_name, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            bucket_counts, count, total = self._series.get(label_value, ([0] * len(self.buckets), 0, 0.0))
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    bucket_counts[index] += 1
+            self._series[label_value] = (bucket_counts, count + 1, total + seconds)
+
+    @contextmanager
+    def time(self, label_value):
+        """Observe the time spent in the context."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label_value, perf_counter() - start)
+
+    def iter_timed(self, label_value, chunks):
+        """Yield from 'chunks', observing the total time spent producing them once they are exhausted."""
+        elapsed = 0.0
+        iterator = iter(chunks)
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += perf_counter() - start
+                yield chunk
+        finally:
+            self.observe(label_value, elapsed)
+
+    def lines(self):
+        with self._lock:
+            series = {label_value: (list(bucket_counts), count, total) for label_value, (bucket_counts, count, total) in self._series.items()}
+
+        return histogram_lines(self.name, self.documentation, self.label_name, series, self.buckets)
+
+
+class StageTimer(object):
+    """Collects the durations of the named stages of a simulation run."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + perf_counter() - start
+
+
+request_duration = Histogram("mps_request_duration_seconds", "Time taken to handle API requests, by route.", 'route')
+request_stage_duration = Histogram("mps_request_stage_duration_seconds", "Time taken by stages of handling API requests.", 'stage')
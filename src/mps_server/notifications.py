@@ -0,0 +1,100 @@
+import os
+import select
+import socket
+import threading
+
+WAKE_MESSAGE = b"wake"
+
+
+def notify(location):
+    """
+    Wake the process listening on the UNIX datagram socket at 'location'.
+
+    Return True if the notification was delivered.  Nobody listening is not an error, the
+    listener looks at the job queue when it starts.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        try:
+            sender.sendto(WAKE_MESSAGE, location)
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+            return False
+
+    return True
+
+
+class WakeListener(object):
+    """
+    Receiving end of the wake notifications, a UNIX datagram socket at 'location'.
+
+    The listener can be waited on with select or multiprocessing.connection.wait together with
+    other handles.  Several notifications arriving before they are drained count as one.
+    """
+
+    def __init__(self, location):
+        self._location = location
+        if os.path.exists(location):
+            # Left behind by a listener that did not shut down cleanly.
+            os.remove(location)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(location)
+        self._socket.setblocking(False)
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def drain(self):
+        """Discard the pending notifications, return how many there were."""
+        count = 0
+        while True:
+            try:
+                self._socket.recv(64)
+            except BlockingIOError:
+                return count
+            count += 1
+
+    def close(self):
+        self._socket.close()
+        try:
+            os.remove(self._location)
+        except FileNotFoundError:
+            pass
+
+
+class WakeBroadcaster(object):
+    """
+    Wakes every thread waiting in wait() when a notification arrives at the listener at 'location'.
+
+    A daemon thread drains the listener, so one socket serves all the threads of a process.
+    """
+
+    def __init__(self, location):
+        self._listener = WakeListener(location)
+        self._condition = threading.Condition()
+        self._generation = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                select.select([self._listener], [], [])
+                self._listener.drain()
+            except (OSError, ValueError):
+                # Closed.
+                return
+
+            with self._condition:
+                self._generation += 1
+                self._condition.notify_all()
+
+    def generation(self):
+        """Return the number of wake-ups so far, to wait() for the next one."""
+        return self._generation
+
+    def wait(self, generation, timeout):
+        """Wait up to 'timeout' seconds for a wake-up after 'generation', return True if there was one."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._generation != generation, timeout)
+
+    def close(self):
+        self._listener.close()
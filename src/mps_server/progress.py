@@ -0,0 +1,60 @@
+import re
+from time import time
+
+_TRIAL_FINISHED = re.compile(r"\btrial\b\D*(\d+).*\b(complete|completed|finished|done|succeeded)\b", re.IGNORECASE)
+_TRIAL_FAILED = re.compile(r"\btrial\b\D*(\d+).*\b(fail|failed|failure|error)\b", re.IGNORECASE)
+_TRIALS_FRACTION = re.compile(r"(\d+)\s*(?:/|of)\s*(\d+)\s+trials\b", re.IGNORECASE)
+
+
+class SolverProgress(object):
+    """
+    Progress of a simple-sundials-solver-manager run, parsed from its output.
+
+    Lines reporting a trial as finished or failed (e.g. "trial 12 finished", "Trial 3 failed")
+    are counted, and a line reporting "<n>/<total> trials" sets the number of completed trials.
+    """
+
+    def __init__(self, trials_total=None):
+        self.trials_total = trials_total
+        self.trials_completed = 0
+        self.trials_failed = 0
+        self.start_time = time()
+        self._finished = set()
+        self._failed = set()
+
+    def elapsed(self):
+        return time() - self.start_time
+
+    def eta(self):
+        """Return the estimated number of seconds until all trials are done, None if it cannot be estimated yet."""
+        return estimated_time_remaining(self.elapsed(), self.trials_completed + self.trials_failed, self.trials_total)
+
+    def parse_line(self, line):
+        """Update the progress from a line of solver output, return True if the progress changed."""
+        match = _TRIAL_FAILED.search(line)
+        if match is not None:
+            self._failed.add(match.group(1))
+            self.trials_failed = len(self._failed)
+            return True
+
+        match = _TRIAL_FINISHED.search(line)
+        if match is not None:
+            self._finished.add(match.group(1))
+            self.trials_completed = max(self.trials_completed, len(self._finished))
+            return True
+
+        match = _TRIALS_FRACTION.search(line)
+        if match is not None:
+            self.trials_completed = max(self.trials_completed, int(match.group(1)))
+            self.trials_total = int(match.group(2))
+            return True
+
+        return False
+
+
+def estimated_time_remaining(elapsed, trials_done, trials_total):
+    """Return the estimated seconds until 'trials_total' trials are done, None if nothing is done yet or the total is unknown."""
+    if not trials_done or not trials_total:
+        return None
+
+    return max(0.0, elapsed / trials_done * (trials_total - trials_done))
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import sqlite3
+from contextlib import closing
+from time import time
+
+from mps_server.common import file_sha256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    fingerprint TEXT PRIMARY KEY,
+    reference TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS submissions_created ON submissions (created);
+CREATE INDEX IF NOT EXISTS submissions_reference ON submissions (reference);
+"""
+
+
+def submission_fingerprint(model_file, simulation_data):
+    """
+    Return the canonical fingerprint of a simulation submission.
+
+    The fingerprint covers the user, the contents of the model file, the uncertainties,
+    the settings (including the number of trials and the random seed, if one is given)
+    and the outputs.
+    """
+    canonical = json.dumps({
+        'user_id': simulation_data['user_id'],
+        'model': file_sha256(model_file),
+        'uncertainties': simulation_data['uncertainties'],
+        'settings': simulation_data['settings'],
+        'outputs': simulation_data['outputs'],
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Map of submission fingerprints to the simulation run that answers them.
+
+    Entries are kept for 'retention' seconds and at most 'max_entries' of the newest
+    entries are kept.  A 'retention' of zero disables the cache.
+    """
+
+    def __init__(self, location, retention, max_entries, journal_mode='WAL'):
+        self._location = location
+        self._retention = retention
+        self._max_entries = max_entries
+        with closing(self._connect()) as connection:
+            connection.execute(f"PRAGMA journal_mode={journal_mode}")
+            connection.executescript(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self._location, timeout=30, isolation_level=None)
+
+    def lookup(self, fingerprint):
+        """Return the reference of the simulation run for 'fingerprint', None if there is none."""
+        if self._retention <= 0:
+            return None
+
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT reference FROM submissions WHERE fingerprint = ? AND created > ?",
+                                     (fingerprint, time() - self._retention)).fetchone()
+
+        return None if row is None else row[0]
+
+    def store(self, fingerprint, reference):
+        if self._retention <= 0:
+            return
+
+        with closing(self._connect()) as connection:
+            connection.execute("INSERT OR REPLACE INTO submissions (fingerprint, reference, created) VALUES (?, ?, ?)",
+                               (fingerprint, reference, time()))
+        self.evict()
+
+    def forget(self, reference):
+        """Remove the entries answered by the simulation run 'reference'."""
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM submissions WHERE reference = ?", (reference,))
+
+    def evict(self):
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM submissions WHERE created <= ?", (time() - self._retention,))
+            connection.execute("DELETE FROM submissions WHERE fingerprint NOT IN "
+                               "(SELECT fingerprint FROM submissions ORDER BY created DESC, rowid DESC LIMIT ?)", (self._max_entries,))
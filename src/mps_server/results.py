@@ -0,0 +1,305 @@
+import json
+import math
+import os
+import shutil
+import struct
+import uuid
+
+import numpy as np
+
+from mps_server.common import write_file_atomically
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+ARROW_STREAM_MIMETYPE = "application/vnd.apache.arrow.stream"
+BINARY_MIMETYPE = "application/octet-stream"
+CHUNK_BYTES = 1 << 20
+MANIFEST_FILE_NAME = "manifest.json"
+PARAMETERS_FILE_NAME = "parameters.npy"
+PARAMETERS_MANIFEST_FILE_NAME = "parameters.json"
+STATISTICS_FILE_NAME = "statistics.json"
+
+
+def _column_values(values):
+    """Return the values of a column as a float64 array, None if the values are not numeric."""
+    try:
+        if len(values) and isinstance(values[0], (list, tuple, np.ndarray)):
+            return np.asarray([np.asarray(v, dtype='<f8') for v in values], dtype='<f8')
+
+        return np.asarray(values, dtype='<f8')
+    except (TypeError, ValueError):
+        return None
+
+
+def store_result(location, data):
+    """
+    Store the extracted result 'data' (a DataFrame, or a dict of column name to values) at 'location'.
+
+    Every numeric column is stored as its own little-endian float64 .npy file, so columns can be
+    read on their own and memory-mapped.  Columns of sequences become two dimensional arrays with
+    one row per trial.  The result is written to a temporary directory and moved into place, the
+    stored parameter values are kept and anything derived from an earlier result is dropped.
+    Every call writes its own temporary directory, so two workers storing the same result do
+    not write into each other's.
+    """
+    columns = list(data.keys())
+    temporary_location = f"{location}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(temporary_location)
+
+    manifest = {'columns': []}
+    for index, name in enumerate(columns):
+        values = list(data[name])
+        array = _column_values(values)
+        if array is None:
+            manifest['columns'].append({'name': name, 'values': values})
+        else:
+            file_name = f"column_{index}.npy"
+            np.save(os.path.join(temporary_location, file_name), array)
+            manifest['columns'].append({'name': name, 'file': file_name, 'shape': list(array.shape)})
+
+    with open(os.path.join(temporary_location, MANIFEST_FILE_NAME), 'w') as f:
+        f.write(json.dumps(manifest))
+
+    if os.path.isdir(location):
+        for file_name in [PARAMETERS_FILE_NAME, PARAMETERS_MANIFEST_FILE_NAME]:
+            if os.path.isfile(os.path.join(location, file_name)):
+                os.replace(os.path.join(location, file_name), os.path.join(temporary_location, file_name))
+        shutil.rmtree(location)
+    os.replace(temporary_location, location)
+
+
+def publish_result(staged_location, location):
+    """Move the result staged at 'staged_location', with its parameter values, into place at 'location', replacing the stored result."""
+    os.makedirs(os.path.dirname(location), exist_ok=True)
+    replaced_location = f"{location}.{uuid.uuid4().hex}.old"
+    try:
+        os.replace(location, replaced_location)
+    except FileNotFoundError:
+        replaced_location = None
+    os.replace(staged_location, location)
+    if replaced_location is not None:
+        shutil.rmtree(replaced_location, ignore_errors=True)
+
+
+def store_parameters(location, names, parameters, design=None):
+    """Store the sampled parameter values of a simulation run (one row per trial, one column per parameter name)."""
+    os.makedirs(location, exist_ok=True)
+    np.save(os.path.join(location, PARAMETERS_FILE_NAME), np.asarray(parameters, dtype='<f8'))
+    with open(os.path.join(location, PARAMETERS_MANIFEST_FILE_NAME), 'w') as f:
+        f.write(json.dumps({'names': list(names), 'design': design}))
+
+    if os.path.isfile(os.path.join(location, STATISTICS_FILE_NAME)):
+        os.remove(os.path.join(location, STATISTICS_FILE_NAME))
+
+
+def load_parameters(location):
+    """Return the parameter names, sampled parameter values and sampling design stored at 'location', None if there are none."""
+    try:
+        with open(os.path.join(location, PARAMETERS_MANIFEST_FILE_NAME)) as f:
+            manifest = json.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+    return manifest['names'], np.load(os.path.join(location, PARAMETERS_FILE_NAME)), manifest['design']
+
+
+def load_statistics(location):
+    """Return the statistics cached with the result at 'location', None if there are none."""
+    try:
+        with open(os.path.join(location, STATISTICS_FILE_NAME)) as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def store_statistics(location, statistics):
+    write_file_atomically(os.path.join(location, STATISTICS_FILE_NAME), json.dumps(statistics))
+
+
+def has_result(location):
+    return os.path.isfile(os.path.join(location, MANIFEST_FILE_NAME))
+
+
+def result_manifest(location):
+    with open(os.path.join(location, MANIFEST_FILE_NAME)) as f:
+        return json.loads(f.read())
+
+
+def load_result(location, columns=None):
+    """Return a dict of column name to values for the stored result at 'location', numeric columns are memory-mapped."""
+    manifest = result_manifest(location)
+    result = {}
+    for column in manifest['columns']:
+        if columns is not None and column['name'] not in columns:
+            continue
+
+        if 'file' in column:
+            # Empty arrays cannot be memory-mapped.
+            mmap_mode = 'r' if all(column['shape']) else None
+            result[column['name']] = np.load(os.path.join(location, column['file']), mmap_mode=mmap_mode)
+        else:
+            result[column['name']] = column['values']
+
+    return result
+
+
+def result_as_lists(result):
+    """Return 'result' as a dict of column name to lists, ready to serialise as JSON."""
+    return {name: values.tolist() if isinstance(values, np.ndarray) else values for name, values in result.items()}
+
+
+def select_result(result, trial_start=None, trial_stop=None, stride=1):
+    """
+    Return a view of 'result' restricted to the trials in [trial_start, trial_stop).
+
+    For columns holding a time series per trial only every 'stride'-th time point is kept.
+    Memory-mapped columns stay memory-mapped.
+    """
+    stride = max(1, stride)
+    trial_start = max(0, trial_start or 0)
+    trial_stop = None if trial_stop is None else max(0, trial_stop)
+    selection = {}
+    for name, values in result.items():
+        values = values[trial_start:trial_stop]
+        if isinstance(values, np.ndarray) and values.ndim == 2 and stride > 1:
+            values = values[:, ::stride]
+        selection[name] = values
+
+    return selection
+
+
+def _json_numbers(values):
+    """Return numeric values as (nested) lists with the non-finite values, NaN for failed trials, as None, JSON has no NaN."""
+    finite = np.isfinite(values)
+    if finite.all():
+        return values.tolist()
+
+    return np.where(finite, values, None).tolist()
+
+
+def _json_rows(values):
+    if isinstance(values, np.ndarray):
+        return _json_numbers(values)
+
+    return list(values)
+
+
+def _trial_bytes(values):
+    """Return the size in bytes of the values of a trial in a column, 8 per float64 value (a non-numeric value counts as one)."""
+    return 8 * math.prod(values.shape[1:]) if isinstance(values, np.ndarray) else 8
+
+
+def _trials_per_chunk(columns, chunk_bytes):
+    return max(1, chunk_bytes // max(1, sum(_trial_bytes(values) for values in columns)))
+
+
+def iter_result_json(result, chunk_bytes=CHUNK_BYTES):
+    """Yield 'result' serialised as a JSON object of column name to values, in chunks of about 'chunk_bytes' bytes of values."""
+    yield '{'
+    for column_index, (name, values) in enumerate(result.items()):
+        yield ('' if column_index == 0 else ',') + json.dumps(name) + ':['
+        chunk_size = _trials_per_chunk([values], chunk_bytes)
+        for start in range(0, len(values), chunk_size):
+            chunk = json.dumps(_json_rows(values[start:start + chunk_size]))[1:-1]
+            yield ('' if start == 0 else ',') + chunk
+        yield ']'
+    yield '}'
+
+
+def iter_result_ndjson(result, trial_offset=0):
+    """Yield 'result' serialised as newline delimited JSON, one object per trial."""
+    names = list(result.keys())
+    trials = min(len(values) for values in result.values()) if result else 0
+    for trial in range(trials):
+        row = {'trial': trial_offset + trial}
+        for name in names:
+            value = result[name][trial]
+            row[name] = _json_numbers(value) if isinstance(value, (np.ndarray, np.generic)) else value
+        yield json.dumps(row) + '\n'
+
+
+def iter_result_binary(result, chunk_bytes=CHUNK_BYTES):
+    """
+    Yield 'result' as raw little-endian float64 buffers preceded by a JSON header.
+
+    The body starts with the length of the header as a little-endian uint32 followed by the
+    header, a JSON object listing the columns with their shapes, byte offsets and lengths
+    relative to the end of the header.  Non-numeric columns are given in the header.
+    """
+    columns = []
+    offset = 0
+    for name, values in result.items():
+        if isinstance(values, np.ndarray):
+            length = values.size * 8
+            columns.append({'name': name, 'dtype': '<f8', 'shape': list(values.shape), 'offset': offset, 'length': length})
+            offset += length
+        else:
+            columns.append({'name': name, 'values': list(values)})
+
+    header = json.dumps({'columns': columns}).encode('utf-8')
+    yield struct.pack('<I', len(header)) + header
+    for values in result.values():
+        if isinstance(values, np.ndarray):
+            chunk_size = _trials_per_chunk([values], chunk_bytes)
+            for start in range(0, len(values), chunk_size):
+                yield np.ascontiguousarray(values[start:start + chunk_size], dtype='<f8').tobytes()
+
+
+class _ChunkSink(object):
+    """File-like object that collects what is written to it until it is taken."""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrow_available():
+    return pa is not None
+
+
+def _arrow_array(values):
+    if not isinstance(values, np.ndarray):
+        return pa.array(list(values))
+
+    values = np.ascontiguousarray(values, dtype='<f8')
+    if values.ndim == 2:
+        return pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), values.shape[1])
+
+    return pa.array(values)
+
+
+def iter_result_arrow(result, chunk_bytes=CHUNK_BYTES):
+    """Yield 'result' as an Arrow IPC stream, in record batches of about 'chunk_bytes' bytes of values.  Requires pyarrow."""
+    names = list(result.keys())
+    trials = min(len(values) for values in result.values()) if result else 0
+    chunk_size = _trials_per_chunk(result.values(), chunk_bytes)
+    sink = _ChunkSink()
+    writer = None
+    for start in range(0, max(trials, 1), chunk_size):
+        batch = pa.record_batch([_arrow_array(result[name][start:start + chunk_size]) for name in names], names=names)
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, batch.schema)
+        writer.write_batch(batch)
+        yield sink.take()
+
+    if writer is not None:
+        writer.close()
+    yield sink.take()
@@ -0,0 +1,100 @@
+import json
+import os
+from time import time
+
+from mps_server.common import Status, write_file_atomically
+
+CONVERGENCE_SUFFIX = ".convergence"
+JOURNAL_SUFFIX = ".journal"
+RECORD_SUFFIX = ".json"
+
+
+class RunRecordStore(object):
+    """
+    Store of simulation run records, one small JSON document per run.
+
+    A record holds the properties of a run that do not change, it is written once to a
+    temporary file and moved into place, so readers never see a partial record.  Status
+    transitions are appended to a journal next to the record, one JSON line per transition,
+    and the status of a run is the last complete line of its journal.  Neither reading nor
+    updating a run takes a lock.
+    """
+
+    def __init__(self, location):
+        self._location = location
+
+    def _record_file(self, reference):
+        return os.path.join(self._location, f"{reference}{RECORD_SUFFIX}")
+
+    def _journal_file(self, reference):
+        return os.path.join(self._location, f"{reference}{JOURNAL_SUFFIX}")
+
+    def _convergence_file(self, reference):
+        return os.path.join(self._location, f"{reference}{CONVERGENCE_SUFFIX}")
+
+    def create(self, reference, properties, status=Status.PENDING, created=None):
+        """Store the record of a new run with its initial status, 'created' backdates the record."""
+        os.makedirs(self._location, exist_ok=True)
+        write_file_atomically(self._record_file(reference), json.dumps(properties, separators=(',', ':')))
+        if created is not None:
+            os.utime(self._record_file(reference), (created, created))
+        self.append_status(reference, status)
+
+    def exists(self, reference):
+        return os.path.isfile(self._record_file(reference))
+
+    def append_status(self, reference, status, **details):
+        entry = json.dumps({'status': status, 'time': time(), **details}, separators=(',', ':')) + '\n'
+        # A single write in append mode is not interleaved with the writes of other processes.
+        fd = os.open(self._journal_file(reference), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, entry.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def journal(self, reference):
+        """Return the status transitions of a run, oldest first, as a list of dicts of status and time."""
+        try:
+            with open(self._journal_file(reference)) as f:
+                lines = f.read().split('\n')
+        except FileNotFoundError:
+            return []
+
+        # The last element is empty, or a transition that is still being written.
+        return [json.loads(line) for line in lines[:-1] if line]
+
+    def status(self, reference):
+        transitions = self.journal(reference)
+        return transitions[-1]['status'] if transitions else Status.PENDING
+
+    def load(self, reference):
+        """Return the properties of a run, with its current status as 'status'.  Raises FileNotFoundError if there is no such run."""
+        with open(self._record_file(reference)) as f:
+            properties = json.loads(f.read())
+
+        properties['status'] = self.status(reference)
+        return properties
+
+    def store_convergence(self, reference, convergence):
+        """Store the trials used and the convergence history of an adaptive run."""
+        write_file_atomically(self._convergence_file(reference), json.dumps(convergence, separators=(',', ':')))
+
+    def convergence(self, reference):
+        """Return the trials used and the convergence history of an adaptive run, None if the run is not adaptive or has not started."""
+        try:
+            with open(self._convergence_file(reference)) as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def references(self):
+        """Return the references of the stored runs, oldest first."""
+        if not os.path.isdir(self._location):
+            return []
+
+        records = [name for name in os.listdir(self._location) if name.endswith(RECORD_SUFFIX)]
+        records.sort(key=lambda name: os.path.getmtime(os.path.join(self._location, name)))
+        return [name[:-len(RECORD_SUFFIX)] for name in records]
+
+    def created(self, reference):
+        return os.path.getmtime(self._record_file(reference))
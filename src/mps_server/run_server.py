@@ -1,11 +1,40 @@
 import os
 import subprocess
+import sys
 import tempfile
+import threading
+
+from mps_server.config import Config
+
+# Seconds to wait before restarting a simulation manager that exited with an error.
+MANAGER_RESTART_DELAY = 5.0
+
+
+def supervise_simulation_manager(stop):
+    """Run the simulation manager until 'stop' is set, restarting it when it exits with an error other than a configuration error."""
+    while not stop.is_set():
+        process = subprocess.Popen([sys.executable, '-m', 'mps_server.run_simulation_manager'])
+        while process.poll() is None:
+            if stop.wait(1.0):
+                process.terminate()
+                process.wait()
+                return
+
+        if process.returncode == 0:
+            return
+
+        if process.returncode == os.EX_CONFIG:
+            print('simulation manager is not configured to run simulations, not restarting')
+            return
+
+        print('simulation manager exited with', process.returncode, 'restarting')
+        stop.wait(MANAGER_RESTART_DELAY)
 
 
 def run(*args, **kwargs):
     run_args = ['--reload', '--preload']
-    run_args.extend(['-w', '1'])
+    # Threads, so the simulation event streams (at most MPS_SIMULATION_EVENTS_MAX_STREAMS of them) do not hold up other requests.
+    run_args.extend(['-w', '1', '--threads', str(Config.SERVER_THREADS)])
     run_args.append('mps_server.main:app')
     run_args.extend(['--bind', 'localhost:6060'])
     subprocess.run(['gunicorn'] + run_args)
@@ -21,7 +50,14 @@ def setup():
 
 def main():
     setup()
-    run()
+    stop = threading.Event()
+    supervisor = threading.Thread(target=supervise_simulation_manager, args=(stop,))
+    supervisor.start()
+    try:
+        run()
+    finally:
+        stop.set()
+        supervisor.join()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,18 @@
+import os
+import sys
+
+from mps_server.executors import ExecutorConfigurationError
+from mps_server.simulations import simulation_manager
+
+
+def main():
+    try:
+        simulation_manager()
+    except ExecutorConfigurationError as e:
+        print('simulation manager not started:', e)
+        # Restarting would not help, tell the supervisor so.
+        sys.exit(os.EX_CONFIG)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import numpy as np
+
+try:
+    from scipy.stats import qmc
+except ImportError:
+    qmc = None
+
+DESIGNS = ('random', 'lhs', 'saltelli')
+
+# Coefficients of the rational approximations of the inverse normal CDF by P. J. Acklam.
+_A = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+_B = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01]
+_C = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+_D = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+_P_LOW = 0.02425
+
+
+def _polynomial(coefficients, x):
+    result = np.zeros_like(x)
+    for coefficient in coefficients:
+        result = result * x + coefficient
+    return result
+
+
+def normal_ppf(u):
+    """Return the inverse of the standard normal CDF at 'u' (0 < u < 1), accurate to about 1e-9."""
+    u = np.asarray(u, dtype='<f8')
+    x = np.empty_like(u)
+    low = u < _P_LOW
+    high = u > 1 - _P_LOW
+    central = ~(low | high)
+
+    q = np.sqrt(-2 * np.log(u[low]))
+    x[low] = _polynomial(_C, q) / (_polynomial(_D, q) * q + 1)
+    q = np.sqrt(-2 * np.log(1 - u[high]))
+    x[high] = -_polynomial(_C, q) / (_polynomial(_D, q) * q + 1)
+    q = u[central] - 0.5
+    r = q * q
+    x[central] = _polynomial(_A, r) * q / (_polynomial(_B, r) * r + 1)
+    return x
+
+
+def _transform(distribution, u):
+    """Return samples of a distribution (as converted for the solver, with parameters p1, p2, ...) from uniform samples 'u'."""
+    name = distribution['distribution'].lower()
+    if name in ('normal', 'gaussian'):
+        return distribution['p1'] + distribution['p2'] * normal_ppf(u)
+    if name == 'lognormal':
+        return np.exp(distribution['p1'] + distribution['p2'] * normal_ppf(u))
+    if name == 'uniform':
+        return distribution['p1'] + (distribution['p2'] - distribution['p1']) * u
+    if name == 'triangular':
+        left, mode, right = distribution['p1'], distribution['p2'], distribution['p3']
+        split = (mode - left) / (right - left)
+        return np.where(u < split, left + np.sqrt(u * (right - left) * (mode - left)), right - np.sqrt((1 - u) * (right - left) * (right - mode)))
+
+    raise ValueError(f"Cannot sample the '{distribution['distribution']}' distribution.")
+
+
+def _latin_hypercube(rng, samples, dimensions, start=0, stop=None):
+    """Return rows [start, stop) of a Latin hypercube of 'samples' points, every column has one point in each of 'samples' equal strata."""
+    stop = samples if stop is None else stop
+    strata = rng.permuted(np.tile(np.arange(samples), (dimensions, 1)), axis=1).T
+    # Every point takes one draw per dimension, the rows before 'start' are skipped rather than drawn.
+    rng.bit_generator.advance(start * dimensions)
+    return (strata[start:stop] + rng.random((stop - start, dimensions))) / samples
+
+
+def _space_filling(rng, samples, dimensions, seed):
+    """Return a scrambled Sobol sequence if SciPy is available, a Latin hypercube otherwise."""
+    if qmc is not None:
+        return qmc.Sobol(dimensions, scramble=True, seed=seed).random(samples)
+
+    return _latin_hypercube(rng, samples, dimensions)
+
+
+def _saltelli_rows(base, dimensions, start, stop):
+    """Return rows [start, stop) of the Saltelli layout of the base points 'base', A in the first 'dimensions' columns and B in the others."""
+    block, point = np.divmod(np.arange(start, stop), len(base))
+    a, b = base[:, :dimensions], base[:, dimensions:]
+    rows = np.where((block == 1)[:, np.newaxis], b[point], a[point])
+    for index in range(dimensions):
+        swapped = block == index + 2
+        rows[swapped, index] = b[point[swapped], index]
+    return rows
+
+
+def unit_design(design, trials, dimensions, seed=None, start=0, stop=None):
+    """
+    Return the design points in the unit hypercube for 'trials' trials, one row per trial, only rows [start, stop) if given.
+
+    'random' draws independent uniform points, 'lhs' a Latin hypercube and 'saltelli' the
+    Saltelli layout for Sobol indices: N points of matrix A, N of matrix B and then N for each
+    matrix AB_i (A with column i taken from B), with N = trials // (dimensions + 2).  Only full
+    Saltelli blocks are returned, so a 'saltelli' design may have fewer than 'trials' rows.
+    The rows of a range are those of the whole design, without drawing the rest of it.
+    """
+    rng = np.random.default_rng(seed)
+    if design == 'random':
+        stop = trials if stop is None else min(stop, trials)
+        rng.bit_generator.advance(start * dimensions)
+        return rng.random((max(0, stop - start), dimensions))
+    if design == 'lhs':
+        stop = trials if stop is None else min(stop, trials)
+        return _latin_hypercube(rng, trials, dimensions, start, max(start, stop))
+    if design == 'saltelli':
+        base_samples = trials // (dimensions + 2)
+        stop = base_samples * (dimensions + 2) if stop is None else min(stop, base_samples * (dimensions + 2))
+        base = _space_filling(rng, base_samples, 2 * dimensions, seed)
+        return _saltelli_rows(base, dimensions, start, max(start, stop))
+
+    raise ValueError(f"Unknown sampling design '{design}', expected one of {', '.join(DESIGNS)}.")
+
+
+def saltelli_order(base_samples, dimensions):
+    """
+    Return the order of the rows that turns Saltelli designs drawn one after the other into one Saltelli design.
+
+    'base_samples' lists the N of each design.  The result puts the A rows of all the designs
+    first, then the B rows, then the AB_1 rows and so on.
+    """
+    offsets = np.cumsum([0] + [n * (dimensions + 2) for n in base_samples])
+    return np.concatenate([np.arange(offset + block * n, offset + (block + 1) * n, dtype=int)
+                           for block in range(dimensions + 2) for offset, n in zip(offsets, base_samples)])
+
+
+def sample_parameters(distributions, trials, design='random', seed=None, start=0, stop=None):
+    """
+    Draw the values of the uncertain parameters for every trial in one go, or for the trials [start, stop) of the design.
+
+    'distributions' maps parameter names to distributions as converted for the solver.  Returns
+    the parameter names and a float64 matrix with one row per trial and one column per parameter.
+    The same seed gives the same samples.
+    """
+    names = list(distributions.keys())
+    u = unit_design(design, trials, len(names), seed, start, stop)
+    # Keep the points off the boundary, where unbounded distributions have no finite values.
+    u = np.clip(u, np.finfo('<f8').tiny, 1 - np.finfo('<f8').epsneg)
+    parameters = np.empty(u.shape, dtype='<f8')
+    for index, name in enumerate(names):
+        parameters[:, index] = _transform(distributions[name], u[:, index])
+
+    return names, parameters
@@ -0,0 +1,148 @@
+import warnings
+
+import numpy as np
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def _as_trials(values):
+    """Return 'values' as a float64 array with trials along the first axis and time points along the second."""
+    values = np.asarray(values, dtype='<f8')
+    return values.reshape(len(values), -1)
+
+
+def _json_values(values):
+    """Return 'values' as (nested) lists with NaN replaced by None, squeezing a single time point to a scalar."""
+    values = np.asarray(values, dtype='<f8')
+    if values.shape[-1:] == (1,):
+        values = values[..., 0]
+
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def output_statistics(values, percentiles=PERCENTILES):
+    """Return the mean, variance and percentile bands of an output over the trials, per time point."""
+    values = _as_trials(values)
+    with warnings.catch_warnings():
+        # All NaN time points give NaN statistics.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(values, axis=0)
+        variance = np.nanvar(values, axis=0, ddof=1) if len(values) > 1 else np.full(values.shape[1], np.nan)
+        bands = np.nanpercentile(values, percentiles, axis=0)
+
+    return {
+        'mean': _json_values(mean),
+        'variance': _json_values(variance),
+        'percentiles': {str(p): _json_values(band) for p, band in zip(percentiles, bands)},
+    }
+
+
+def _ranks(values):
+    return np.argsort(np.argsort(values, axis=0, kind='stable'), axis=0).astype('<f8')
+
+
+def _correlation(parameters, values):
+    return np.dot(_standardise(_ranks(parameters)).T, _standardise(_ranks(values))) / len(values)
+
+
+def _standardise(values):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (values - values.mean(axis=0)) / values.std(axis=0)
+
+
+def rank_correlation(parameters, values):
+    """
+    Return the Spearman rank correlation between every sampled parameter and an output.
+
+    'parameters' holds one row per trial and one column per parameter.  The result has one row
+    per parameter and one column per time point.  Failed trials (non-finite values) are left out
+    of the time points they failed at.
+    """
+    parameters = _as_trials(parameters)
+    values = _as_trials(values)
+    finite = np.isfinite(values) & np.isfinite(parameters).all(axis=1)[:, None]
+    if finite.all():
+        return _correlation(parameters, values)
+
+    correlation = np.full((parameters.shape[1], values.shape[1]), np.nan)
+    # Failed trials usually fail at every time point, so the time points share few masks.
+    masks, inverse = np.unique(finite.T, axis=0, return_inverse=True)
+    for index, rows in enumerate(masks):
+        columns = np.flatnonzero(inverse.reshape(-1) == index)
+        if rows.sum() > 1:
+            correlation[:, columns] = _correlation(parameters[rows], values[rows][:, columns])
+
+    return correlation
+
+
+def finite_trials(values):
+    """Return the number of trials with a finite value of an output, per time point."""
+    return np.isfinite(_as_trials(values)).sum(axis=0)
+
+
+def sobol_indices(values, number_parameters):
+    """
+    Return the first order and total Sobol indices of an output from a Saltelli design.
+
+    The trials are expected in Saltelli order: N trials of matrix A, N trials of matrix B and
+    then N trials for each matrix AB_i (A with column i taken from B).  The first order indices
+    use the Saltelli (2010) estimator and the total indices the Jansen estimator.  Both have one
+    row per parameter and one column per time point.  Only the Saltelli blocks without a failed
+    trial (a non-finite value) count at a time point, the number of trials in those blocks is
+    returned as well.
+    """
+    values = _as_trials(values)
+    base_samples = len(values) // (number_parameters + 2)
+    f_a = values[:base_samples]
+    f_b = values[base_samples:2 * base_samples]
+    f_ab = values[2 * base_samples:(number_parameters + 2) * base_samples].reshape(number_parameters, base_samples, -1)
+    complete = np.isfinite(f_a) & np.isfinite(f_b) & np.isfinite(f_ab).all(axis=0)
+    f_a = np.where(complete, f_a, np.nan)
+    f_b = np.where(complete, f_b, np.nan)
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        # Time points without a complete block give NaN indices.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        variance = np.nanvar(np.concatenate((f_a, f_b)), axis=0)
+        first_order = np.nanmean(f_b * (f_ab - f_a), axis=1) / variance
+        total = 0.5 * np.nanmean((f_a - f_ab) ** 2, axis=1) / variance
+
+    return first_order, total, complete.sum(axis=0) * (number_parameters + 2)
+
+
+def simulation_statistics(result, parameter_names=None, parameters=None, design=None, percentiles=PERCENTILES):
+    """
+    Return the statistics of the numeric outputs of a simulation result over its trials.
+
+    When the sampled parameter values are given ('parameters', one row per trial) the rank
+    correlation of every parameter with every output is included, and when 'design' says the
+    trials follow a Saltelli design the Sobol indices are included too.  Failed trials are left
+    out, 'trials_used' has the number of trials each output's statistics are over, per time point.
+    """
+    parameter_names = parameter_names or []
+    outputs = {name: values for name, values in result.items() if isinstance(values, np.ndarray) and name not in parameter_names}
+    statistics = {
+        'trials': min((len(values) for values in outputs.values()), default=0),
+        'parameters': list(parameter_names),
+        'outputs': {name: output_statistics(values, percentiles) for name, values in outputs.items()},
+        'trials_used': {name: _json_values(finite_trials(values)) for name, values in outputs.items()},
+    }
+
+    if parameters is not None and len(parameter_names) and len(parameters) == statistics['trials']:
+        correlations = {}
+        for name, values in outputs.items():
+            correlation = rank_correlation(parameters, values)
+            correlations[name] = {parameter: _json_values(correlation[index]) for index, parameter in enumerate(parameter_names)}
+        statistics['rank_correlation'] = correlations
+
+    if design is not None and design.get('name') == 'saltelli' and len(parameter_names):
+        indices = {}
+        for name, values in outputs.items():
+            first_order, total, trials_used = sobol_indices(values, len(parameter_names))
+            indices[name] = {
+                'first_order': {parameter: _json_values(first_order[index]) for index, parameter in enumerate(parameter_names)},
+                'total': {parameter: _json_values(total[index]) for index, parameter in enumerate(parameter_names)},
+                'trials_used': _json_values(trials_used),
+            }
+        statistics['sobol'] = indices
+
+    return statistics
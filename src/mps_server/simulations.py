@@ -1,14 +1,21 @@
+import atexit
+import glob
 import json
+import math
 import multiprocessing
 import os
 import pickle
-import subprocess
+import shutil
+import signal
+import threading
 import uuid
 
 import multiprocessing as mp
-from time import sleep, time
+from contextlib import nullcontext
+from multiprocessing.connection import wait
+from time import time
 
-import psutil as psutil
+import numpy as np
 from filelock import FileLock
 
 # import argparse
@@ -20,42 +27,142 @@ from filelock import FileLock
 # from cellsolvertools.utilities import import_code
 # import pandas as pd
 
-from cellsolvertools.generate_code import generate_c_code
-from cellsolvertools.common import construct_application_config
-from cellsolvertools.investigate_output_data import extract_result_for_config
+try:
+    from cellsolvertools.generate_code import generate_c_code
+    from cellsolvertools.common import construct_application_config
+    from cellsolvertools.investigate_output_data import extract_result_for_config
+except ImportError:
+    # Only the solver manager executor, and results from before results were stored, need cellsolvertools.
+    generate_c_code = construct_application_config = extract_result_for_config = None
 
+from mps_server.build_cache import BuildCache, build_key, solver_revision
+from mps_server.common import Status, file_sha256, normalise_for_use_as_path
 from mps_server.config import Config
+from mps_server.convergence import ConvergenceMonitor
+from mps_server.cost import admission_check, estimate_cost, work_units
+from mps_server.executors import ExecutorConfigurationError, SolverTask, accepts_parameter_samples, check_executor, create_executor, time_points
+from mps_server.job_queue import JobQueue
 from mps_server.management import get_model_file
-
+from mps_server.metrics import DURATION_BUCKETS, StageTimer, gauge_lines, histogram_lines
+from mps_server.notifications import WakeBroadcaster, WakeListener, notify
+from mps_server.result_cache import ResultCache, submission_fingerprint
+from mps_server.results import has_result, load_parameters, load_result, load_statistics, publish_result, result_as_lists, select_result, store_parameters, \
+    store_result, store_statistics
+from mps_server.run_records import RunRecordStore
+from mps_server.sampling import DESIGNS, sample_parameters, saltelli_order
+from mps_server.sensitivity import simulation_statistics
+
+BUILD_CACHE_DIR_NAME = "build_cache"
+EVENT_LISTENERS_DIR_NAME = "event_listeners"
+# Notifications do not cross machines, event streams look at the queue now and then regardless.
+EVENTS_RESCAN_INTERVAL = 5.0
+JOB_QUEUE_FILE_NAME = "queue.sqlite"
+KILL_GRACE_PERIOD = 10.0
+MANAGER_LOCK_FILE_NAME = "manager-{worker_name}.lock"
+# Notifications are not queued for ever, look at the queue now and then regardless.
+MANAGER_RESCAN_INTERVAL = 60.0
+MANAGER_SOCKET_FILE_NAME = "manager-{worker_name}.sock"
+# Users can only lower the priority of their simulations, raising it would let them jump the queue of everyone else.
+MAXIMUM_PRIORITY = 0
+MINIMUM_PRIORITY = -10
+PROGRESS_UPDATE_INTERVAL = 1.0
+RESULT_CACHE_FILE_NAME = "result_cache.sqlite"
+SIMULATION_RESULTS_DIR_NAME = "results"
+SIMULATION_RUNS_DIR_NAME = "runs"
 SIMULATIONS_DIR_NAME = "simulations"
 SIMULATIONS_OUTPUT_DIR = "output"
+SOLVER_BUILD_DIR_NAME = "build-simple-sundials-solver"
+STAGED_RESULT_DIR_NAME = "result"
+
+# The job queues this process has set up, by queue file.
+_job_queues = {}
+_job_queues_lock = threading.Lock()
+# The listener waking the event streams of this process, by socket.
+_event_broadcasters = {}
 
 
 def _simulations_dir():
     return os.path.join(Config.SIMULATION_DATA_DIR, SIMULATIONS_DIR_NAME)
 
 
-def _output_dir():
-    return os.path.join(Config.SIMULATION_RUN_DIR, SIMULATIONS_OUTPUT_DIR)
+def _run_dir(reference, worker=None, attempt=0):
+    """Return the run directory of an attempt by a worker at a simulation run, every attempt has its own."""
+    if worker is None:
+        return os.path.join(Config.SIMULATION_DATA_DIR, SIMULATION_RUNS_DIR_NAME, reference)
+
+    return os.path.join(Config.SIMULATION_DATA_DIR, SIMULATION_RUNS_DIR_NAME, f"{reference}-{normalise_for_use_as_path(worker)}-{attempt}")
+
+
+def _result_dir(reference):
+    return os.path.join(Config.SIMULATION_DATA_DIR, SIMULATION_RESULTS_DIR_NAME, reference)
+
+
+def _output_dir(reference):
+    return os.path.join(_run_dir(reference), SIMULATIONS_OUTPUT_DIR)
 
 
 def _shared_control_file(name, lock=False):
     return os.path.join(Config.SIMULATION_DATA_DIR, f"{name}.lock" if lock else name)
 
 
-def _running(lock=False):
-    return _shared_control_file('running.txt', lock)
+def _job_queue():
+    """Return the job queue, its schema is set up (and stored simulation runs migrated to a new queue) once per process."""
+    queue_file = _shared_control_file(JOB_QUEUE_FILE_NAME)
+    job_queue = _job_queues.get(queue_file)
+    if job_queue is None:
+        with _job_queues_lock:
+            job_queue = _job_queues.get(queue_file)
+            if job_queue is None:
+                new_queue = not os.path.isfile(queue_file)
+                job_queue = JobQueue(queue_file, Config.SIMULATION_QUEUE_JOURNAL_MODE, notify_simulation_event_streams)
+                if new_queue:
+                    _migrate_simulation_files(job_queue)
+                _job_queues[queue_file] = job_queue
 
+    return job_queue
 
-def _stopping(lock=False):
-    return _shared_control_file('stopping.txt', lock)
 
+def _migrate_simulation_files(job_queue):
+    """Add the stored simulation runs to a new job queue, oldest first."""
+    for reference in _pickled_simulation_runs():
+        try:
+            _migrate_pickled_simulation_run(reference)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            continue
+
+    run_records = _run_records()
+    for reference in run_records.references():
+        simulation_run = _load_simulation_run(reference)
+        status = simulation_run.status()
+        if status == Status.RUNNING:
+            # The manager that was running it is gone, run it again.
+            status = Status.PENDING
+        job_queue.enqueue(reference, simulation_run.user_id(), status, run_records.created(reference), simulation_run.title(), simulation_run.number_of_trials())
+
+
+def _pickled_simulation_runs():
+    """Return the references of the simulation runs stored as pickles, from before run records existed."""
+    simulations_dir = _simulations_dir()
+    if not os.path.isdir(simulations_dir):
+        return []
 
-def _is_simulation_file(filename):
-    if filename.endswith('.lock'):
-        return False
+    return [f for f in os.listdir(simulations_dir) if '.' not in f and os.path.isfile(os.path.join(simulations_dir, f))]
+
+
+def _migrate_pickled_simulation_run(reference):
+    """Convert a pickled simulation run to a run record and return it."""
+    pickled_file = os.path.join(_simulations_dir(), reference)
+    lock = FileLock(f"{pickled_file}.lock")
+    with lock:
+        run_records = _run_records()
+        if not run_records.exists(reference):
+            with open(pickled_file, 'rb') as f:
+                simulation_run = pickle.load(f)
 
-    return os.path.isfile(filename)
+            run_records.create(reference, simulation_run.to_record(), simulation_run.status(), os.path.getmtime(pickled_file))
+            os.remove(pickled_file)
+
+    return SimulationRun.from_record(run_records.load(reference))
 
 
 def _convert_solver_config(in_config):
@@ -79,170 +186,611 @@ def _convert_simulation_config(in_config):
     }
 
 
-def simulation_manager():
-    simulations_dir = _simulations_dir()
-    if not os.path.isdir(simulations_dir):
-        os.mkdir(simulations_dir)
-
-    sleep(0.2)
-    pid = os.getpid()
-    all_simulations_run = False
-    start_time = time()
-    while not all_simulations_run:
-        simulation = None
-        files = os.listdir(simulations_dir)
-        full_path_files = [os.path.join(simulations_dir, f) for f in files if _is_simulation_file(os.path.join(simulations_dir, f))]
-        full_path_files.sort(key=lambda x: os.path.getmtime(x))
-        if (time() - start_time) > 2:
-            print('alive', pid)
-            start_time = time()
-        for full_path_file in full_path_files:
-            lock = FileLock(f"{full_path_file}.lock")
-            with lock:
-                with open(full_path_file, 'rb') as f:
-                    simulation_run = pickle.load(f)
-
-                if simulation_run.status() == Status.PENDING:
-                    simulation = {
-                        'obj': simulation_run,
-                        'src': full_path_file,
-                    }
-                    break
+def _run_records():
+    return RunRecordStore(_simulations_dir())
 
-        if simulation is None:
-            all_simulations_run = True
-        else:
-            simulation_obj = simulation['obj']
-            simulation_src = simulation['src']
-
-            simulation_obj.set_status(Status.RUNNING)
-            lock = FileLock(f"{simulation_src}.lock")
-            with lock:
-                with open(simulation_src, 'wb') as f:
-                    pickle.dump(simulation_obj, f)
-
-            model_file = get_model_file(Config.CLIENT_WORKING_DIR, simulation_obj.user_id(), simulation_obj.model())
-            settings = simulation_obj.settings()
-            solver_config = settings['solver']
-            simulation_config = settings['simulation']
-            code_generation_config = {'external_variables': simulation_obj.uncertainties()}
-            config = {
-                'uncertainties': simulation_obj.uncertainties(),
-                'solver': _convert_solver_config(solver_config),
-                'simulation': _convert_simulation_config(simulation_config),
-                'workers': multiprocessing.cpu_count(),
-                'num_trials': simulation_config['numberTrials'],
-                'application': construct_application_config(Config.SIMULATION_RUN_DIR, Config.SUNDIALS_CMAKE_CONFIG_DIR)
-            }
 
-            generate_c_code(model_file, os.path.join(Config.SIMULATION_RUN_DIR, 'build-simple-sundials-solver', 'src'), code_generation_config)
+def _load_simulation_run(reference):
+    try:
+        return SimulationRun.from_record(_run_records().load(reference))
+    except FileNotFoundError:
+        return _migrate_pickled_simulation_run(reference)
 
-            # Save config to simulation run dir
-            simulation_run_config = os.path.join(Config.SIMULATION_RUN_DIR, 'simulation-run.config')
-            with open(simulation_run_config, 'w') as f:
-                f.write(json.dumps(config))
 
-            simulation_outputs_config = os.path.join(Config.SIMULATION_RUN_DIR, 'simulation-outputs.config')
-            with open(simulation_outputs_config, 'w') as f:
-                f.write(json.dumps(simulation_obj.outputs()))
+def _set_simulation_status(reference, status, **details):
+    """Journal a status transition of a simulation run, the shards of a run have no record of their own."""
+    run_records = _run_records()
+    if run_records.exists(reference):
+        run_records.append_status(reference, status, **details)
 
-            result = subprocess.run(["simple-sundials-solver-manager", "--simulation-config", simulation_run_config])
-            if result.returncode != 0:
-                print('**********************************************')
-                print("something went very wrong.")
 
-            # Cannot run this from a forked process?
-            # entry_point(config)
+def _prepare_run_dir(run_dir, compiled_solver=True):
+    """Create the isolated run directory for an attempt, for a compiled solver a copy of the simulation run directory without output and build tree."""
+    if os.path.isdir(run_dir):
+        shutil.rmtree(run_dir)
 
-            simulation_obj.set_status(Status.FINISHED)
-            lock = FileLock(f"{simulation_src}.lock")
-            with lock:
-                with open(simulation_src, 'wb') as f:
-                    pickle.dump(simulation_obj, f)
+    if compiled_solver:
+        shutil.copytree(Config.SIMULATION_RUN_DIR, run_dir, symlinks=True, ignore=shutil.ignore_patterns(SIMULATIONS_OUTPUT_DIR, SOLVER_BUILD_DIR_NAME))
+    else:
+        os.makedirs(run_dir)
+    return run_dir
 
-    print('dead', pid)
 
+def _prepare_application_dir(application_dir):
+    """Lay out a cached solver application: its own copy of the solver build tree and links to the rest of the simulation run directory."""
+    os.makedirs(application_dir)
+    for name in os.listdir(Config.SIMULATION_RUN_DIR):
+        if name == SOLVER_BUILD_DIR_NAME:
+            shutil.copytree(os.path.join(Config.SIMULATION_RUN_DIR, name), os.path.join(application_dir, name), symlinks=True)
+        elif name != SIMULATIONS_OUTPUT_DIR:
+            os.symlink(os.path.join(Config.SIMULATION_RUN_DIR, name), os.path.join(application_dir, name))
 
-def _running_manager_pid():
-    with open(_running()) as f:
-        content = f.read()
 
-    return int(content)
+def _solver_revision():
+    locations = [Config.SIMULATION_RUN_DIR] + ([Config.SUNDIALS_CMAKE_CONFIG_DIR] if Config.SUNDIALS_CMAKE_CONFIG_DIR else [])
+    return solver_revision(locations, [SIMULATIONS_OUTPUT_DIR])
 
 
-def _is_running_pid_active():
-    # Try reading from file to see if pid is alive
-    if not os.path.isfile(_running()):
-        return False
+def _build_cache():
+    return BuildCache(os.path.join(Config.SIMULATION_DATA_DIR, BUILD_CACHE_DIR_NAME), Config.SIMULATION_BUILD_CACHE_BYTES)
+
+
+def _result_cache():
+    return ResultCache(_shared_control_file(RESULT_CACHE_FILE_NAME), Config.SIMULATION_RESULT_CACHE_RETENTION, Config.SIMULATION_RESULT_CACHE_SIZE,
+                       Config.SIMULATION_QUEUE_JOURNAL_MODE)
 
-    return psutil.pid_exists(_running_manager_pid())
 
+def _workers_per_simulation():
+    return max(1, multiprocessing.cpu_count() // max(1, Config.SIMULATION_CONCURRENT_RUNS))
 
-def _is_running_pid_zombie():
+
+def _sample_batch(reference, simulation_run, trials, seed, batch_index, start=0, stop=None):
+    """Draw the parameter names, values and design of a batch of trials (of rows [start, stop) of it), None if a distribution is not supported here."""
+    design = simulation_run.settings()['simulation'].get('design', 'random')
+    batch_seed = int(np.random.SeedSequence([seed, batch_index]).generate_state(1)[0]) if batch_index else seed
     try:
-        p = psutil.Process(_running_manager_pid())
-        print(p.status == psutil.STATUS_ZOMBIE)
-        print(p.ppid(), os.getpid())
+        names, parameters = sample_parameters(simulation_run.uncertainties(), trials, design, batch_seed, start, stop)
+    except ValueError as e:
+        print('Leaving the sampling of', reference, 'to the solver:', e)
+        return None
 
-    except psutil.NoSuchProcess:
-        return False
+    return names, parameters, design
 
-    return p.status == psutil.STATUS_ZOMBIE
 
+def _executor(workers):
+    return create_executor(Config.SIMULATION_EXECUTOR, workers, Config.SIMULATION_TRIAL_FUNCTION, Config.SIMULATION_TRIALS_PER_TASK)
 
-def start_simulation_manager_process():
-    print('===============================')
-    print('pid stuff')
-    print(os.getpid())
-    print(os.getppid())
-    print(mp.current_process())
-    print(mp.parent_process())
-    print(mp.active_children())
-    lock = FileLock(_running(lock=True))
-    print('go time')
-    try:
-        with lock.acquire(5):
-            print('lock acquired', _running_manager_pid(), _is_running_pid_active())
-            simulation_process = None
-            if _is_running_pid_zombie():
-                print('Zombie manager process')
-            if not _is_running_pid_active():
-                print('running pid is not active')
-                simulation_process = mp.Process(target=simulation_manager)
-                simulation_process.start()
-                pid = simulation_process.pid
-                print('parent', os.getpid())
-                print('child pid', pid)
-                if pid is not None:
-                    with open(_running(), 'w') as f:
-                        f.write(str(pid))
-
-            print('simulation process', os.getpid(), simulation_process)
-    except TimeoutError:
+
+def check_executor_configuration():
+    """Check that the configured executor can run simulations, raise ExecutorConfigurationError if it cannot."""
+    executor = check_executor(Config.SIMULATION_EXECUTOR, Config.SIMULATION_TRIAL_FUNCTION)
+    if executor.compiled_solver:
+        if generate_c_code is None:
+            raise ExecutorConfigurationError(f"The {Config.SIMULATION_EXECUTOR} executor needs cellsolvertools to generate the solver code.")
+        if not Config.SIMULATION_RUN_DIR or not os.path.isdir(Config.SIMULATION_RUN_DIR):
+            raise ExecutorConfigurationError(f"The {Config.SIMULATION_EXECUTOR} executor needs MPS_SIMULATION_RUN_DIR, the directory with the solver sources.")
+
+
+def _execute_batch(executor, reference, task, trials_total, trials_completed=0, trials_failed=0):
+    """Run a batch of trials with 'executor', recording its progress on top of the trials of earlier batches."""
+    job_queue = _job_queue()
+    last_update = [0.0]
+
+    def report_progress(progress):
+        if time() - last_update[0] > PROGRESS_UPDATE_INTERVAL:
+            job_queue.update_progress(reference, trials_completed + progress.trials_completed, trials_failed + progress.trials_failed, trials_total)
+            last_update[0] = time()
+
+    execution = executor.run(task, report_progress)
+    progress = execution.progress
+    job_queue.update_progress(reference, trials_completed + progress.trials_completed, trials_failed + progress.trials_failed, trials_total)
+    if execution.returncode != 0:
         print('**********************************************')
-        print('timed out ...')
-        # Try reading from file to see if pid is alive
-        with open(_running()) as f:
-            content = f.read()
+        print(f"{Config.SIMULATION_EXECUTOR} failed for {reference} with exit code {execution.returncode} after {progress.elapsed():.1f}s, "
+              f"{progress.trials_completed} trials completed and {progress.trials_failed} failed.")
+
+    return execution
+
+
+def _append_batch(data, batch_data):
+    """Append the columns of the extracted result of a batch of trials to 'data'."""
+    for name in batch_data.keys():
+        data.setdefault(name, []).extend(list(batch_data[name]))
+
+
+def _reordered(data, order):
+    return {name: [values[index] for index in order] for name, values in data.items()}
+
+
+class _Trials(object):
+    """The trials of a simulation run so far, their result and parameter values."""
+
+    def __init__(self, seed, trial_cap):
+        self.seed = seed
+        self.trial_cap = trial_cap
+        self.data = {}
+        self.names = None
+        self.parameter_batches = []
+        self.base_samples = []
+        self.batch_index = 0
+        self.completed = 0
+        self.failed = 0
+
+    def add_parameters(self, names, parameters, saltelli=False):
+        self.names = names
+        self.parameter_batches.append(parameters)
+        if saltelli:
+            self.base_samples.append(len(parameters) // (len(names) + 2))
+
+    def add_result(self, batch_data, trials, trials_failed):
+        _append_batch(self.data, batch_data)
+        self.completed += trials
+        self.failed += trials_failed
+        self.batch_index += 1
+
+    def ordered(self):
+        """Return the result and parameter values (None if the solver sampled them), Saltelli batches merged into one design."""
+        parameters = np.concatenate(self.parameter_batches) if self.parameter_batches else None
+        if not self.base_samples:
+            return self.data, parameters
+
+        order = saltelli_order(self.base_samples, len(self.names))
+        return _reordered(self.data, order), parameters[order]
+
+
+def _extended_trials(reference, info, extension_trials, timer):
+    """Return the trials of a finished run that is being extended, its stored result is the first batch."""
+    with timer.stage('load_result'):
+        result_dir = _result_dir(reference)
+        data = result_as_lists(load_result(result_dir))
+        names, parameters, design = load_parameters(result_dir)
+    trials = _Trials(design['seed'], len(parameters) + extension_trials)
+    trials.data = data
+    trials.add_parameters(names, parameters, design['name'] == 'saltelli')
+    trials.completed = len(parameters)
+    # Every batch so far had at least one trial, numbering on from the trials run gives batch seeds not used before.
+    trials.batch_index = trials.completed
+    trials.failed = info['trials_failed'] or 0
+    return trials
+
+
+def _convergence_monitor(simulation_run, trial_cap):
+    """Return the convergence monitor and batch size of an adaptive run, no monitor and a single batch for other runs."""
+    simulation_config = simulation_run.settings()['simulation']
+    adaptive = simulation_config.get('adaptive')
+    if not adaptive:
+        return None, trial_cap
+
+    number_parameters = len(simulation_run.uncertainties()) if simulation_config.get('design') == 'saltelli' else 0
+    monitor = ConvergenceMonitor(float(adaptive['tolerance']), float(adaptive.get('confidence', 0.95)), number_parameters)
+    return monitor, max(1, min(int(adaptive.get('batchSize', trial_cap)), trial_cap))
+
+
+def _record_convergence(reference, monitor, trials, uncertainties):
+    """Follow the convergence of an adaptive run after a batch, return True once it has converged."""
+    converged = monitor.update(trials.ordered()[0], uncertainties)
+    _run_records().store_convergence(reference, {
+        'trials_used': trials.completed,
+        'trial_cap': trials.trial_cap,
+        'tolerance': monitor.tolerance,
+        'converged': converged,
+        'history': monitor.history,
+    })
+    return converged
+
+
+def _next_batch(reference, executor, simulation_run, shard, trials, batch_size):
+    """Return the parameter names, values and design of the next batch of trials, None if the solver samples them itself."""
+    if not executor.accepts_parameter_samples:
+        return None
+    if shard is None:
+        return _sample_batch(reference, simulation_run, min(batch_size, trials.trial_cap - trials.completed), trials.seed, trials.batch_index)
+
+    # The rows of the shard, of the design of the whole simulation.
+    return _sample_batch(reference, simulation_run, simulation_run.settings()['simulation']['numberTrials'], trials.seed, 0,
+                         shard['trials_start'], shard['trials_stop'])
+
+
+def _solver_checkout(executor, model_file, config, run_dir):
+    if not executor.compiled_solver:
+        # The executor solves the trials itself, there is no solver to build.
+        return nullcontext()
+
+    key = build_key(model_file, config['uncertainties'].keys(), config['solver'], _solver_revision())
+    return _build_cache().checkout(key, os.path.basename(run_dir), _prepare_application_dir)
+
+
+def _application_dir(checkout, run_dir):
+    """Return the directory the solver is built and run in, a private build copies the solver build tree to 'run_dir'."""
+    if checkout.application_dir is not None:
+        return checkout.application_dir
+
+    shutil.copytree(os.path.join(Config.SIMULATION_RUN_DIR, SOLVER_BUILD_DIR_NAME), os.path.join(run_dir, SOLVER_BUILD_DIR_NAME), symlinks=True)
+    return run_dir
+
+
+def _stage_result(run_dir, trials, simulation_config):
+    """Store the result and parameter values of a run in its run directory, return where."""
+    data, parameters = trials.ordered()
+    staged_result_dir = os.path.join(run_dir, STAGED_RESULT_DIR_NAME)
+    if parameters is not None:
+        store_parameters(staged_result_dir, trials.names, parameters, {'name': simulation_config.get('design', 'random'), 'seed': trials.seed})
+    store_result(staged_result_dir, data)
+    return staged_result_dir
+
+
+def run_simulation(reference, workers, worker=None, attempt=None):
+    """Run a claimed simulation or shard, completing it only while it is still leased to 'worker'."""
+    timer = StageTimer()
+    job_queue = _job_queue()
+    if attempt is None:
+        attempt = job_queue.attempts(reference)
+    info = job_queue.run_info(reference)
+    if info is not None and info['started'] is not None:
+        timer.timings['queue_wait'] = max(0.0, info['started'] - info['created'])
+
+    shard = job_queue.shard(reference)
+    with timer.stage('run_record'):
+        simulation_obj = _load_simulation_run(reference if shard is None else shard['parent'])
+        _set_simulation_status(simulation_obj.reference(), Status.RUNNING)
+    executor = _executor(workers)
+    if executor.compiled_solver and generate_c_code is None:
+        raise RuntimeError(f"{Config.SIMULATION_EXECUTOR} needs cellsolvertools to generate the solver code.")
+    with timer.stage('prepare_run_dir'):
+        run_dir = _prepare_run_dir(_run_dir(reference, worker, attempt), executor.compiled_solver)
+
+    model_file = get_model_file(Config.CLIENT_WORKING_DIR, simulation_obj.user_id(), simulation_obj.model())
+    settings = simulation_obj.settings()
+    solver_config = settings['solver']
+    simulation_config = settings['simulation']
+    code_generation_config = {'external_variables': simulation_obj.uncertainties()}
+    config = {
+        'uncertainties': simulation_obj.uncertainties(),
+        'solver': _convert_solver_config(solver_config),
+        'simulation': _convert_simulation_config(simulation_config),
+        'workers': workers,
+        'num_trials': simulation_config['numberTrials'],
+    }
+    extension_trials = job_queue.extension_trials(reference)
+    if extension_trials:
+        trials = _extended_trials(reference, info, extension_trials, timer)
+    else:
+        seed = simulation_config.get('seed')
+        trials = _Trials(int(np.random.SeedSequence().entropy % 2 ** 63) if seed is None else seed,
+                         config['num_trials'] if shard is None else shard['trials_stop'] - shard['trials_start'])
+    monitor, batch_size = _convergence_monitor(simulation_obj, trials.trial_cap)
+
+    cpu_seconds = 0.0
+    returncode = 0
+    with _solver_checkout(executor, model_file, config, run_dir) as checkout:
+        if checkout is not None:
+            application_dir = _application_dir(checkout, run_dir)
+            if checkout.needs_build:
+                with timer.stage('generate_code'):
+                    generate_c_code(model_file, os.path.join(application_dir, SOLVER_BUILD_DIR_NAME, 'src'), code_generation_config)
+            config['application'] = construct_application_config(application_dir, Config.SUNDIALS_CMAKE_CONFIG_DIR)
+
+        simulation_outputs_config = os.path.join(run_dir, 'simulation-outputs.config')
+        with open(simulation_outputs_config, 'w') as f:
+            f.write(json.dumps(simulation_obj.outputs()))
+
+        # Adaptive runs run batches until the outputs converge, other runs a single batch.
+        while trials.completed < trials.trial_cap:
+            with timer.stage('sample_parameters'):
+                batch = _next_batch(reference, executor, simulation_obj, shard, trials, batch_size)
+            config['num_trials'] = min(batch_size, trials.trial_cap - trials.completed)
+            if batch is not None:
+                names, parameters, design = batch
+                if not len(parameters):
+                    break
+                config['num_trials'] = len(parameters)
+                trials.add_parameters(names, parameters, design == 'saltelli' and shard is None)
+            elif not executor.compiled_solver:
+                print(f"{Config.SIMULATION_EXECUTOR} cannot run {reference}, only the solver manager samples parameters itself.")
+                returncode = 1
+                break
+            elif simulation_config.get('design', 'random') != 'random':
+                print(f"The solver samples the parameters of {reference} itself, it cannot follow a {simulation_config['design']} design.")
+                returncode = 1
+                break
+            elif monitor is not None:
+                # Without the Saltelli layout there are no Sobol indices to follow.
+                monitor.number_parameters = 0
+
+            # Save config to simulation run dir
+            simulation_run_config = os.path.join(run_dir, 'simulation-run.config')
+            with open(simulation_run_config, 'w') as f:
+                f.write(json.dumps(config))
 
-        if psutil.pid_exists(content):
-            print('simulation process is already running do nothing.')
+            task = SolverTask(run_dir, simulation_run_config, model_file, simulation_obj.outputs(), time_points(config['simulation']),
+                              *(batch[:2] if batch is not None else ()))
+            with timer.stage('compile_and_solve'):
+                execution = _execute_batch(executor, reference, task, trials.trial_cap, trials.completed, trials.failed)
+            cpu_seconds += execution.cpu_seconds
+            returncode = execution.returncode
+            if returncode != 0:
+                break
+
+            if checkout is not None:
+                checkout.built()
+            with timer.stage('extract_result'):
+                batch_data = execution.data
+                if batch_data is None:
+                    output_dir = os.path.join(run_dir, SIMULATIONS_OUTPUT_DIR)
+                    batch_data = extract_result_for_config(model_file, simulation_obj.outputs(), output_dir)
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                trials.add_result(batch_data, config['num_trials'], execution.progress.trials_failed)
+            if monitor is not None and _record_convergence(reference, monitor, trials, config['uncertainties'].keys()):
+                break
+
+    if returncode == 0:
+        with timer.stage('extract_result'):
+            staged_result_dir = _stage_result(run_dir, trials, simulation_config)
+        # Renewing the lease leaves a whole lease period to publish the result and complete the run in.
+        if worker is None or job_queue.heartbeat([reference], worker, Config.SIMULATION_LEASE_SECONDS):
+            job_queue.record_cpu_seconds(reference, cpu_seconds)
+            job_queue.update_progress(reference, trials.completed, trials.failed, trials.completed)
+            publish_result(staged_result_dir, _result_dir(reference))
         else:
-            print('lock file exists but the pid is not current.')
-            print('can I remove lock file????')
+            print('simulation lease lost, result discarded', reference)
+        shutil.rmtree(run_dir)
+    else:
+        _result_cache().forget(reference)
+
+    job_queue.record_timings(reference, timer.timings)
+    if job_queue.complete(reference, worker=worker):
+        _set_simulation_status(reference, Status.FINISHED)
+        if returncode == 0:
+            # The run directories of earlier attempts, by workers that died or lost their lease.
+            _remove_run_dirs(reference)
+
+
+def _merge_shards(job_queue, reference, worker):
+    """Merge the results of the shards of a simulation into its result, in trial order, and finish the simulation."""
+    timer = StageTimer()
+    shards = job_queue.shards(reference)
+    shard_result_dirs = [_result_dir(shard['reference']) for shard in shards]
+    with timer.stage('merge_shards'):
+        if all(has_result(result_dir) and load_parameters(result_dir) is not None for result_dir in shard_result_dirs):
+            data = {}
+            parameter_batches = []
+            for result_dir in shard_result_dirs:
+                _append_batch(data, load_result(result_dir))
+                names, parameters, design = load_parameters(result_dir)
+                parameter_batches.append(parameters)
+            store_parameters(_result_dir(reference), names, np.concatenate(parameter_batches), design)
+            store_result(_result_dir(reference), data)
+            job_queue.record_cpu_seconds(reference, sum(shard['cpu_seconds'] or 0.0 for shard in shards))
+            merged = True
+        else:
+            print('simulation shards failed', reference)
+            merged = False
+
+    job_queue.record_timings(reference, timer.timings)
+    if job_queue.complete(reference, worker=worker):
+        _set_simulation_status(reference, Status.FINISHED)
+        if not merged:
+            _result_cache().forget(reference)
+        # Not before, a manager that took the merge over from this one still reads them.
+        for result_dir in shard_result_dirs:
+            shutil.rmtree(result_dir, ignore_errors=True)
+
+
+def simulation_metrics():
+    """Return the Prometheus text exposition lines of the simulation stage durations, the queue depth and the worker utilization."""
+    job_queue = _job_queue()
+    running = job_queue.count(Status.RUNNING)
+    lines = histogram_lines("mps_simulation_stage_duration_seconds", "Time taken by stages of simulation runs.", 'stage',
+                            job_queue.stage_histograms(DURATION_BUCKETS))
+    lines += gauge_lines("mps_simulation_queue_depth", "Number of simulation runs waiting to run.", job_queue.count(Status.PENDING))
+    lines += gauge_lines("mps_simulation_running", "Number of simulation runs running.", running)
+    lines += gauge_lines("mps_simulation_worker_utilization", "Fraction of the concurrent simulation run slots of this worker in use.",
+                         job_queue.count_leased(f"{Config.SIMULATION_WORKER_NAME}:") / max(1, Config.SIMULATION_CONCURRENT_RUNS))
+    return lines
+
+
+def _manager_socket():
+    return _shared_control_file(MANAGER_SOCKET_FILE_NAME.format(worker_name=Config.SIMULATION_WORKER_NAME))
 
 
-def activate_simulation_runner():
-    pass
+def notify_simulation_manager():
+    """Tell the simulation manager there is a new simulation in the queue."""
+    if not notify(_manager_socket()):
+        print('No simulation manager is listening, the simulation waits in the queue until one starts.')
 
 
-class Status(object):
-    PENDING = 'pending'
-    RUNNING = 'running'
-    FINISHED = 'finished'
+def _detach_from_manager():
+    # Forked from the manager, do not inherit its signal handling.
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Lead a process group, so the solver processes can be killed along with this process.
+    os.setpgrp()
+
+
+def _run_simulation_process(reference, workers, worker, attempt):
+    _detach_from_manager()
+    run_simulation(reference, workers, worker, attempt)
+
+
+def _merge_shards_process(reference, worker):
+    _detach_from_manager()
+    _merge_shards(_job_queue(), reference, worker)
+
+
+def _kill_simulation_process(simulation_process):
+    """Kill the process running a simulation together with the solver processes it started."""
+    for signal_number in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(simulation_process.pid, signal_number)
+        except ProcessLookupError:
+            # The process has not made its process group yet, it has not started any solver processes either.
+            simulation_process.kill()
+
+        simulation_process.join(KILL_GRACE_PERIOD)
+        if not simulation_process.is_alive():
+            return
+
+    print('simulation process did not die', simulation_process.pid)
+
+
+def _remove_run_dirs(reference, run_dir=None):
+    """Remove the run directory 'run_dir' of a simulation run, all of its run directories without one, and release their solver builds."""
+    run_dirs = [run_dir] if run_dir is not None else [_run_dir(reference)] + glob.glob(f"{glob.escape(_run_dir(reference))}-*")
+    build_cache = _build_cache()
+    for location in run_dirs:
+        shutil.rmtree(location, ignore_errors=True)
+        build_cache.release(os.path.basename(location))
+
+
+def _discard_simulation_run(reference, run_dir=None):
+    """Remove what a simulation run that did not finish left behind, in 'run_dir' or, without one, in any of its run directories."""
+    _remove_run_dirs(reference, run_dir)
+    _result_cache().forget(reference)
+
+
+def _recover_simulation_run(job_queue, reference, worker=None, run_dir=None):
+    """Put a simulation that was running when its process died back in the queue, unless it has had all its attempts."""
+    _discard_simulation_run(reference, run_dir)
+    if job_queue.attempts(reference) < Config.SIMULATION_MAX_ATTEMPTS:
+        job_queue.requeue(reference, worker=worker)
+        _set_simulation_status(reference, Status.PENDING)
+    elif job_queue.complete(reference, worker=worker):
+        _set_simulation_status(reference, Status.FINISHED)
+
+
+def _release_expired_simulation_runs(job_queue):
+    """Take the simulations whose worker stopped renewing its lease from that worker, and run them again."""
+    for reference, status in job_queue.release_expired(Config.SIMULATION_MAX_ATTEMPTS):
+        print('simulation lease expired', reference)
+        if status == Status.FINISHED:
+            _discard_simulation_run(reference)
+        _set_simulation_status(reference, status)
+
+
+def _merge_sharded_simulation_runs(job_queue, worker, merging):
+    """Start a process merging each simulation whose shards have all finished, and add it to 'merging'."""
+    while True:
+        reference = job_queue.claim_merge(worker, Config.SIMULATION_LEASE_SECONDS)
+        if reference is None:
+            break
+
+        print('merging simulation shards', reference)
+        merge_process = mp.Process(target=_merge_shards_process, args=(reference, worker))
+        merge_process.start()
+        merging[merge_process.sentinel] = (reference, merge_process)
+
+
+def _check_merges(job_queue, worker, merging, ready, leased):
+    """Forget the merges in 'merging' that are over, and stop those whose simulation was cancelled or taken over by another manager."""
+    for sentinel in list(merging.keys()):
+        reference, merge_process = merging[sentinel]
+        if sentinel in ready:
+            merge_process.join()
+            if job_queue.status(reference) == Status.RUNNING and reference in leased:
+                # Merged again it would most likely fail again, the simulation finishes without a result.
+                print('merging simulation shards failed', reference, merge_process.exitcode)
+                if job_queue.complete(reference, worker=worker):
+                    _set_simulation_status(reference, Status.FINISHED)
+                    _result_cache().forget(reference)
+        elif reference not in leased and job_queue.status(reference) != Status.FINISHED:
+            print('merging simulation shards stopped', reference)
+            _kill_simulation_process(merge_process)
+        else:
+            continue
+
+        del merging[sentinel]
+
+
+def simulation_manager():
+    """Run the queued simulations, up to Config.SIMULATION_CONCURRENT_RUNS at a time, until SIGTERM or SIGINT."""
+    check_executor_configuration()
+    os.makedirs(Config.SIMULATION_DATA_DIR, exist_ok=True)
+    lock = FileLock(_shared_control_file(MANAGER_LOCK_FILE_NAME.format(worker_name=Config.SIMULATION_WORKER_NAME)))
+    with lock:
+        stop_reader, stop_writer = os.pipe()
+        os.set_blocking(stop_writer, False)
+        signal.set_wakeup_fd(stop_writer)
+        stopping = []
+        for signal_number in [signal.SIGTERM, signal.SIGINT]:
+            signal.signal(signal_number, lambda number, frame: stopping.append(number))
+
+        listener = WakeListener(_manager_socket())
+        job_queue = _job_queue()
+        worker = f"{Config.SIMULATION_WORKER_NAME}:{os.getpid()}"
+        # Holding the lock, no other manager of this worker name is running the simulations it leased.
+        for reference in job_queue.running(f"{Config.SIMULATION_WORKER_NAME}:"):
+            print('recovering simulation', reference)
+            _recover_simulation_run(job_queue, reference)
+
+        workers = _workers_per_simulation()
+        heartbeat_interval = Config.SIMULATION_LEASE_SECONDS / 3
+        running = {}
+        merging = {}
+        print('simulation manager started', worker)
+        try:
+            while not stopping:
+                _release_expired_simulation_runs(job_queue)
+                _merge_sharded_simulation_runs(job_queue, worker, merging)
+                while len(running) < Config.SIMULATION_CONCURRENT_RUNS:
+                    reference = job_queue.claim(Config.SIMULATION_USER_CPU_BUDGET, worker, Config.SIMULATION_LEASE_SECONDS)
+                    if reference is None:
+                        break
+
+                    attempt = job_queue.attempts(reference)
+                    simulation_process = mp.Process(target=_run_simulation_process, args=(reference, workers, worker, attempt))
+                    simulation_process.start()
+                    running[simulation_process.sentinel] = (reference, simulation_process, _run_dir(reference, worker, attempt))
+
+                ready = wait(list(running.keys()) + list(merging.keys()) + [listener, stop_reader],
+                             timeout=min(MANAGER_RESCAN_INTERVAL, heartbeat_interval))
+                if listener in ready:
+                    listener.drain()
+                leased = job_queue.heartbeat([reference for reference, _, _ in running.values()] + [reference for reference, _ in merging.values()],
+                                             worker, Config.SIMULATION_LEASE_SECONDS)
+                _check_merges(job_queue, worker, merging, ready, leased)
+                for sentinel in list(running.keys()):
+                    reference, simulation_process, run_dir = running[sentinel]
+                    status = job_queue.status(reference)
+                    # A cancelled extension leaves the run finished, but no longer leased to this manager.
+                    if status == Status.CANCELLED or (status == Status.FINISHED and job_queue.worker(reference) != worker):
+                        print('simulation cancelled', reference)
+                        _kill_simulation_process(simulation_process)
+                        _discard_simulation_run(reference, run_dir)
+                    elif sentinel in ready:
+                        simulation_process.join()
+                        if status == Status.RUNNING and reference in leased:
+                            print('simulation process failed', reference, simulation_process.exitcode)
+                            _recover_simulation_run(job_queue, reference, worker, run_dir)
+                    elif status != Status.FINISHED and reference not in leased:
+                        # Another manager took the simulation over, it runs there now in a run directory of its own.
+                        print('simulation lease lost', reference)
+                        _kill_simulation_process(simulation_process)
+                        _remove_run_dirs(reference, run_dir)
+                    else:
+                        continue
+
+                    del running[sentinel]
+        finally:
+            for reference, simulation_process, run_dir in running.values():
+                _kill_simulation_process(simulation_process)
+                _discard_simulation_run(reference, run_dir)
+                job_queue.requeue(reference, count_attempt=False, worker=worker)
+                _set_simulation_status(reference, Status.PENDING)
+            for reference, merge_process in merging.values():
+                _kill_simulation_process(merge_process)
+                job_queue.release_merge(reference, worker)
+
+            listener.close()
+            signal.set_wakeup_fd(-1)
+            os.close(stop_reader)
+            os.close(stop_writer)
+
+    print('simulation manager stopped', os.getpid())
 
 
 class SimulationRun(object):
+    __slots__ = ('_user_id', '_id', '_status', '_model', '_distributions', '_settings', '_outputs')
 
     def __init__(self, properties):
         self._user_id = properties['user_id']
@@ -284,9 +832,42 @@ class SimulationRun(object):
     def settings(self):
         return self._settings
 
+    def number_of_trials(self):
+        return self._settings['simulation']['numberTrials']
+
     def outputs(self):
         return self._outputs
 
+    def to_record(self):
+        """Return the properties of the simulation run that do not change, for storing as its run record."""
+        return {
+            'user_id': self._user_id,
+            'reference': self._id,
+            'model': self._model,
+            'uncertainties': self._distributions,
+            'settings': self._settings,
+            'outputs': self._outputs,
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        simulation_run = cls.__new__(cls)
+        simulation_run._user_id = record['user_id']
+        simulation_run._id = record['reference']
+        simulation_run._status = record.get('status', Status.PENDING)
+        simulation_run._model = record['model']
+        simulation_run._distributions = record['uncertainties']
+        simulation_run._settings = record['settings']
+        simulation_run._outputs = record['outputs']
+        return simulation_run
+
+    def __setstate__(self, state):
+        # Simulation runs pickled before __slots__ was introduced.
+        if isinstance(state, tuple):
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __str__(self):
         return json.dumps(self._outputs)
 
@@ -302,54 +883,325 @@ def _convert_distribution_definition(distribution):
     }
 
 
-def get_simulation_result(reference):
-    result = None
-    lock = FileLock(_shared_control_file(os.path.join(SIMULATIONS_DIR_NAME, reference), lock=True))
-    with lock:
-        try:
-            with open(_shared_control_file(os.path.join(SIMULATIONS_DIR_NAME, reference)), 'rb') as f:
-                simulation_run = pickle.load(f)
+def _extract_result(reference, simulation_run):
+    """Extract the result of a simulation run from the solver output and store it with the results."""
+    model_file = get_model_file(Config.CLIENT_WORKING_DIR, simulation_run.user_id(), simulation_run.model())
+    data = extract_result_for_config(model_file, simulation_run.outputs(), _output_dir(reference))
+    store_result(_result_dir(reference), data)
 
-            outputs = simulation_run.outputs()
-            model_file = get_model_file(Config.CLIENT_WORKING_DIR, simulation_run.user_id(), simulation_run.model())
-            data = extract_result_for_config(model_file, outputs, _output_dir())
-            result = data.to_dict(orient='list')
 
+def _stored_result_dir(reference):
+    """Return the directory of the stored result of a simulation run, None if the run has no result (yet)."""
+    result_dir = _result_dir(reference)
+    if not has_result(result_dir):
+        # Simulation runs from before results were stored, the output of a run that has not finished is partial.
+        if _job_queue().status(reference) != Status.FINISHED or extract_result_for_config is None:
+            return None
+        try:
+            _extract_result(reference, _load_simulation_run(reference))
         except OSError:
-            pass
+            return None
 
-    return result
+    return result_dir
 
 
-def get_simulation_info(reference):
-    info = {}
-    # reference = simulation['reference']
-    lock = FileLock(_shared_control_file(os.path.join(SIMULATIONS_DIR_NAME, reference), lock=True))
-    with lock:
-        try:
-            with open(_shared_control_file(os.path.join(SIMULATIONS_DIR_NAME, reference)), 'rb') as f:
-                simulation_run = pickle.load(f)
+def get_simulation_result(reference, columns=None, trial_start=None, trial_stop=None, stride=1):
+    """Return the (memory-mapped) result of a simulation run, restricted to the given columns, trials and time point stride."""
+    result_dir = _stored_result_dir(reference)
+    if result_dir is None:
+        return None
 
-            info['status'] = simulation_run.status()
-            info['reference'] = reference
-            info['title'] = simulation_run.title()
+    return select_result(load_result(result_dir, columns), trial_start, trial_stop, stride)
+
+
+def _same_parameters(parameters, names, values):
+    stored_names, stored_values, _ = parameters
+    return list(stored_names) == names and stored_values.shape == values.shape and np.allclose(stored_values, values)
+
+
+def get_simulation_statistics(reference):
+    """Return the sensitivity statistics of a simulation run, computed once and then kept with its result."""
+    result_dir = _stored_result_dir(reference)
+    if result_dir is None:
+        return None
+
+    statistics = load_statistics(result_dir)
+    if statistics is None:
+        result = load_result(result_dir)
+        parameters = load_parameters(result_dir)
+        # The uncertain parameters that are part of the result are the values the solver used.
+        parameter_names = [name for name in _load_simulation_run(reference).uncertainties() if isinstance(result.get(name), np.ndarray)]
+        parameter_values = np.stack([result[name] for name in parameter_names], axis=1) if parameter_names else None
+        if parameters is None or (parameter_names and not _same_parameters(parameters, parameter_names, parameter_values)):
+            parameters = parameter_names, parameter_values, None
+
+        statistics = simulation_statistics(result, *parameters)
+        store_statistics(result_dir, statistics)
+
+    return statistics
+
+
+def list_simulations(user_id, status=None, offset=0, limit=None):
+    """Return the simulation information of a user's simulation runs, newest first, and the total number matching the filter."""
+    return _job_queue().list_runs(user_id, status, offset, limit)
+
+
+def _event_listeners_dir():
+    return os.path.join(Config.SIMULATION_DATA_DIR, EVENT_LISTENERS_DIR_NAME)
+
+
+def notify_simulation_event_streams():
+    """Wake the event streams of every server process on this machine, a simulation run changed."""
+    try:
+        sockets = os.listdir(_event_listeners_dir())
+    except FileNotFoundError:
+        return
+
+    for name in sockets:
+        notify(os.path.join(_event_listeners_dir(), name))
+
+
+def _event_broadcaster():
+    location = os.path.join(_event_listeners_dir(), f"{normalise_for_use_as_path(Config.SIMULATION_WORKER_NAME)}-{os.getpid()}.sock")
+    broadcaster = _event_broadcasters.get(location)
+    if broadcaster is None:
+        with _job_queues_lock:
+            broadcaster = _event_broadcasters.get(location)
+            if broadcaster is None:
+                os.makedirs(_event_listeners_dir(), exist_ok=True)
+                broadcaster = WakeBroadcaster(location)
+                atexit.register(broadcaster.close)
+                _event_broadcasters[location] = broadcaster
+
+    return broadcaster
+
+
+def wait_for_simulation_changes(user_id, since, references=None, timeout=30.0):
+    """Return the user's simulation runs changed after revision 'since', waiting up to 'timeout' seconds for a change."""
+    job_queue = _job_queue()
+    broadcaster = _event_broadcaster()
+    deadline = time() + timeout
+    while True:
+        generation = broadcaster.generation()
+        runs = job_queue.changed_runs(user_id, since, references)
+        remaining = deadline - time()
+        if runs or remaining <= 0:
+            return runs
+
+        broadcaster.wait(generation, min(remaining, EVENTS_RESCAN_INTERVAL))
+
+
+def get_simulation_info(reference):
+    """Return the status, title, timestamps, progress (with an estimate of the seconds remaining), stage timings and convergence of a simulation run."""
+    job_queue = _job_queue()
+    info = job_queue.run_info(reference)
+    if info is None:
+        return {}
+
+    info['timings'] = job_queue.timings(reference)
+    info['convergence'] = _run_records().convergence(reference)
+    return info
 
-        except OSError:
-            pass
 
+def cancel_simulation(user_id, reference):
+    """Cancel a pending or running simulation of a user, return its simulation information, None if it cannot be cancelled."""
+    job_queue = _job_queue()
+    previous_status = job_queue.cancel(reference, user_id)
+    if previous_status is None:
+        return None
+
+    if job_queue.status(reference) == Status.FINISHED:
+        # Only an extension was cancelled, the simulation keeps its result.
+        _set_simulation_status(reference, Status.FINISHED, extension=Status.CANCELLED)
+    else:
+        _set_simulation_status(reference, Status.CANCELLED)
+        _result_cache().forget(reference)
+    if previous_status == Status.RUNNING:
+        notify_simulation_manager()
+
+    return job_queue.run_info(reference)
+
+
+def _clamped_priority(priority):
+    return max(MINIMUM_PRIORITY, min(MAXIMUM_PRIORITY, priority))
+
+
+def set_simulation_priority(user_id, reference, priority):
+    """Change the priority, clamped to MINIMUM_PRIORITY to MAXIMUM_PRIORITY, of a pending or running simulation of a user, return its simulation information."""
+    job_queue = _job_queue()
+    if not job_queue.set_priority(reference, user_id, _clamped_priority(priority)):
+        return None
+
+    return job_queue.run_info(reference)
+
+
+def extend_simulation(user_id, reference, additional_trials):
+    """Queue a finished simulation of a user again to run 'additional_trials' more trials, return its simulation information and estimated cost."""
+    job_queue = _job_queue()
+    result_dir = _result_dir(reference)
+    if job_queue.status(reference) != Status.FINISHED or not has_result(result_dir):
+        return None
+
+    parameters = load_parameters(result_dir)
+    simulation_run = _load_simulation_run(reference)
+    if parameters is None or simulation_run.user_id() != user_id:
+        return None
+
+    names, _, design = parameters
+    if additional_trials < (len(names) + 2 if design['name'] == 'saltelli' else 1):
+        return None
+
+    settings = simulation_run.settings()
+    units = work_units({**settings, 'simulation': {**settings['simulation'], 'numberTrials': additional_trials}}, simulation_run.outputs())
+    model_key = _model_key(simulation_run.to_record())
+    estimate = estimate_cost(units, job_queue.cpu_seconds_per_work_unit(model_key))
+    rejection = admission_check(estimate, additional_trials, Config.SIMULATION_MAX_CPU_SECONDS, Config.SIMULATION_MAX_OUTPUT_BYTES)
+    if rejection is not None:
+        return {
+            "title": simulation_run.title(),
+            "estimate": estimate,
+            "rejected": rejection,
+        }
+
+    if model_key is None or not job_queue.extend(reference, user_id, additional_trials, model_key, units, estimate['cpu_seconds']):
+        return None
+
+    # The result no longer answers the original submission.
+    _result_cache().forget(reference)
+    _set_simulation_status(reference, Status.PENDING)
+    notify_simulation_manager()
+
+    info = job_queue.run_info(reference)
+    info['estimate'] = estimate
     return info
 
 
+def _submission_fingerprint(simulation_data):
+    model_file = get_model_file(Config.CLIENT_WORKING_DIR, simulation_data['user_id'], simulation_data['model'])
+    try:
+        return submission_fingerprint(model_file, simulation_data)
+    except OSError:
+        return None
+
+
+def _valid_simulation_settings(simulation_data):
+    """Return True if the number of trials, time points and outputs of a submission, its cost is estimated from, are usable."""
+    try:
+        simulation_config = simulation_data['settings']['simulation']
+        number_trials = simulation_config['numberTrials']
+        times = [float(simulation_config[name]) for name in ['timeStart', 'timeStop', 'pointInterval']]
+        return isinstance(number_trials, int) and not isinstance(number_trials, bool) and number_trials > 0 \
+            and all(math.isfinite(value) for value in times) and isinstance(simulation_data['outputs'], list)
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def _valid_sampling_settings(simulation_data):
+    """Return True if the sampling design and the adaptive settings (tolerance, batchSize and confidence) of a submission are usable."""
+    simulation_config = simulation_data['settings']['simulation']
+    design = simulation_config.get('design', 'random')
+    if design not in DESIGNS:
+        return False
+    if design != 'random' and not accepts_parameter_samples(Config.SIMULATION_EXECUTOR):
+        # Only random samples can be left to a solver that samples the parameters itself.
+        return False
+
+    adaptive = simulation_config.get('adaptive')
+    if not adaptive:
+        return True
+
+    minimum_batch_size = len(simulation_data['uncertainties']) + 2 if design == 'saltelli' else 2
+    try:
+        return float(adaptive['tolerance']) > 0 and int(adaptive.get('batchSize', simulation_config['numberTrials'])) >= minimum_batch_size \
+            and 0 < float(adaptive.get('confidence', 0.95)) < 1
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def _model_key(simulation_data):
+    """Return the hash of the contents of the model of a submission, None if the model file cannot be read."""
+    try:
+        return file_sha256(get_model_file(Config.CLIENT_WORKING_DIR, simulation_data['user_id'], simulation_data['model']))
+    except OSError:
+        return None
+
+
+def _shard_ranges(simulation_run):
+    """Return the ranges of trials, as (trials_start, trials_stop), to split a large simulation into, none if it is not split."""
+    simulation_config = simulation_run.settings()['simulation']
+    if Config.SIMULATION_SHARD_TRIALS <= 0 or simulation_config.get('adaptive') or not accepts_parameter_samples(Config.SIMULATION_EXECUTOR):
+        return []
+
+    try:
+        sample_parameters(simulation_run.uncertainties(), 1)
+    except ValueError:
+        return []
+
+    trials = simulation_run.number_of_trials()
+    if simulation_config.get('design', 'random') == 'saltelli':
+        # The whole Saltelli blocks.
+        block = len(simulation_run.uncertainties()) + 2
+        trials = trials // block * block
+    count = -(-trials // Config.SIMULATION_SHARD_TRIALS)
+    if count < 2:
+        return []
+
+    bounds = [trials * index // count for index in range(count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
 def queue_simulation(simulation_data):
-    start_simulation_manager_process()
+    """Queue a simulation, or answer it with an identical earlier one, return its reference, status, title and estimated cost."""
+    result_cache = _result_cache()
+    job_queue = _job_queue()
+    fingerprint = _submission_fingerprint(simulation_data)
+    if fingerprint is not None:
+        reference = result_cache.lookup(fingerprint)
+        status = None if reference is None else job_queue.status(reference)
+        if status is not None:
+            return {
+                "reference": reference,
+                "status": status,
+                "title": os.path.splitext(simulation_data['model'])[0],
+                "cached": True,
+            }
+
+    if not _valid_simulation_settings(simulation_data) or not _valid_sampling_settings(simulation_data):
+        return None
+
+    try:
+        priority = _clamped_priority(int(simulation_data.get('priority', 0)))
+    except (TypeError, ValueError):
+        return None
+
     simulation_run = SimulationRun(simulation_data)
-    lock = FileLock(_shared_control_file(os.path.join(SIMULATIONS_DIR_NAME, simulation_run.id()), lock=True))
-    with lock:
-        with open(_shared_control_file(os.path.join(SIMULATIONS_DIR_NAME, simulation_run.id())), 'wb') as f:
-            pickle.dump(simulation_run, f)
+    model_key = _model_key(simulation_data)
+    units = work_units(simulation_run.settings(), simulation_run.outputs())
+    estimate = estimate_cost(units, job_queue.cpu_seconds_per_work_unit(model_key))
+    rejection = admission_check(estimate, simulation_run.number_of_trials(), Config.SIMULATION_MAX_CPU_SECONDS, Config.SIMULATION_MAX_OUTPUT_BYTES)
+    if rejection is not None:
+        return {
+            "title": simulation_run.title(),
+            "estimate": estimate,
+            "rejected": rejection,
+        }
+
+    shards = _shard_ranges(simulation_run)
+    if shards and simulation_run.settings()['simulation'].get('seed') is None:
+        # All the shards draw their rows from the same design.
+        simulation_run.settings()['simulation']['seed'] = int(np.random.SeedSequence().entropy % 2 ** 63)
+    _run_records().create(simulation_run.id(), simulation_run.to_record(), simulation_run.status())
+
+    job_queue.enqueue(simulation_run.id(), simulation_run.user_id(), title=simulation_run.title(), trials_total=simulation_run.number_of_trials(),
+                      priority=priority, model_key=model_key, work_units=units, cpu_seconds_estimate=estimate['cpu_seconds'],
+                      shards=shards)
+    if fingerprint is not None:
+        result_cache.store(fingerprint, simulation_run.id())
+    notify_simulation_manager()
 
     return {
         "reference": simulation_run.reference(),
         "status": simulation_run.status(),
         "title": simulation_run.title(),
+        "estimate": estimate,
     }
@@ -0,0 +1,71 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from time import time
+
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class VerifiedTokenCache(object):
+    """
+    Bounded LRU cache of the decoded payloads of verified tokens, keyed by a hash of the token.
+
+    An entry is only returned while the token's 'exp' claim is in the future,
+    tokens without an 'exp' claim are never cached.  A 'max_size' of zero disables the cache.
+    """
+
+    def __init__(self, max_size=1024):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, token):
+        """Return the cached payload for 'token', or None if it is not cached or has expired."""
+        key = _token_hash(token)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+
+            if payload['exp'] <= time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, token, payload):
+        if self._max_size <= 0 or not isinstance(payload.get('exp'), (int, float)):
+            return
+
+        key = _token_hash(token)
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self._entries),
+            'max_size': self._max_size,
+        }
@@ -0,0 +1,31 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def available_encodings():
+    """Return the content encodings results can be compressed with, most preferred first."""
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+
+def _compressor(encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+
+    return zlib.compressobj(wbits=31)
+
+
+def iter_compressed(chunks, encoding):
+    """Yield 'chunks' (str or bytes) compressed with 'encoding', 'gzip' or 'zstd'."""
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from mps_server.build_cache import BuildCache, build_key, solver_revision
+
+
+def _make_application_dir(location):
+    os.makedirs(os.path.join(location, 'build', 'src'))
+    with open(os.path.join(location, 'build', 'CMakeLists.txt'), 'w') as f:
+        f.write('project(solver)\n')
+
+
+class BuildCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._model_file = os.path.join(self._dir.name, 'model.cellml')
+        with open(self._model_file, 'w') as f:
+            f.write('<model/>')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_build_key(self):
+        key = build_key(self._model_file, ['b', 'a'], {'RelativeTolerance': 1e-7})
+        self.assertEqual(key, build_key(self._model_file, ['a', 'b'], {'RelativeTolerance': 1e-7}))
+        self.assertNotEqual(key, build_key(self._model_file, ['a'], {'RelativeTolerance': 1e-7}))
+        self.assertNotEqual(key, build_key(self._model_file, ['a', 'b'], {'RelativeTolerance': 1e-6}))
+        self.assertNotEqual(key, build_key(self._model_file, ['a', 'b'], {'RelativeTolerance': 1e-7}, 'revision'))
+
+    def test_solver_revision(self):
+        solver_dir = os.path.join(self._dir.name, 'solver')
+        _make_application_dir(solver_dir)
+        os.makedirs(os.path.join(solver_dir, 'output'))
+        revision = solver_revision([solver_dir], ['output'])
+        with open(os.path.join(solver_dir, 'output', 'trial_0.csv'), 'w') as f:
+            f.write('1.0\n')
+        self.assertEqual(revision, solver_revision([solver_dir], ['output']))
+
+        # Upgrading the solver sources or changing the compiler gives a new revision.
+        with mock.patch.dict(os.environ, {'CC': 'clang'}):
+            self.assertNotEqual(revision, solver_revision([solver_dir], ['output']))
+        with open(os.path.join(solver_dir, 'build', 'CMakeLists.txt'), 'w') as f:
+            f.write('project(solver C)\n')
+        os.utime(os.path.join(solver_dir, 'build', 'CMakeLists.txt'), ns=(time.time_ns(), time.time_ns() + 1000))
+        self.assertNotEqual(revision, solver_revision([solver_dir], ['output']))
+
+    def test_reuse_of_build(self):
+        cache = BuildCache(os.path.join(self._dir.name, 'cache'), 1 << 20)
+        with cache.checkout('key', 'first', _make_application_dir) as checkout:
+            self.assertTrue(checkout.needs_build)
+            application_dir = checkout.application_dir
+            with open(os.path.join(application_dir, 'build', 'src', 'model.c'), 'w') as f:
+                f.write('int main() {}\n')
+            checkout.built()
+
+        # The solver is built and reused at the same path, where its build system was configured.
+        with cache.checkout('key', 'second', self.fail) as checkout:
+            self.assertFalse(checkout.needs_build)
+            self.assertEqual(application_dir, checkout.application_dir)
+            self.assertTrue(os.path.isfile(os.path.join(application_dir, 'build', 'src', 'model.c')))
+            self.assertTrue(os.access(os.path.join(application_dir, 'build', 'src', 'model.c'), os.W_OK))
+
+    def test_failed_build_is_not_reused(self):
+        cache = BuildCache(os.path.join(self._dir.name, 'cache'), 1 << 20)
+        for reference in ['first', 'second']:
+            with cache.checkout('key', reference, _make_application_dir) as checkout:
+                self.assertTrue(checkout.needs_build)
+                self.assertTrue(os.path.isfile(os.path.join(checkout.application_dir, 'build', 'CMakeLists.txt')))
+
+    def test_eviction(self):
+        cache_dir = os.path.join(self._dir.name, 'cache')
+        cache = BuildCache(cache_dir, 1)
+        with cache.checkout('key', 'first', _make_application_dir) as checkout:
+            checkout.built()
+
+        self.assertFalse(os.path.isdir(os.path.join(cache_dir, 'key')))
+
+    def test_build_in_progress_is_private(self):
+        cache_dir = os.path.join(self._dir.name, 'cache')
+        cache = BuildCache(cache_dir, 1 << 20)
+        with cache.checkout('key', 'first', _make_application_dir) as checkout:
+            with cache.checkout('key', 'second', _make_application_dir) as private_checkout:
+                self.assertTrue(private_checkout.needs_build)
+                self.assertIsNone(private_checkout.application_dir)
+            checkout.built()
+
+        with cache.checkout('key', 'second', _make_application_dir) as checkout:
+            self.assertFalse(checkout.needs_build)
+            self.assertEqual(['second'], os.listdir(os.path.join(cache_dir, 'key', 'pins')))
+
+    def test_disabled(self):
+        cache = BuildCache(os.path.join(self._dir.name, 'cache'), 0)
+        with cache.checkout('key', 'first', _make_application_dir) as checkout:
+            self.assertTrue(checkout.needs_build)
+            self.assertIsNone(checkout.application_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from mps_server.common import write_file_atomically
+
+
+class WriteFileAtomicallyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_concurrent_writers(self):
+        location = os.path.join(self._dir.name, 'file.json')
+        errors = []
+
+        def write(index):
+            for count in range(200):
+                try:
+                    write_file_atomically(location, f"{index}:{count}")
+                except OSError as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(['file.json'], os.listdir(self._dir.name))
+        with open(location) as f:
+            self.assertRegex(f.read(), r"^\d:199$")
+
+
+if __name__ == '__main__':
+    unittest.main()
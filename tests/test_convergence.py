@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+
+from mps_server.convergence import ConvergenceMonitor
+
+
+class ConvergenceMonitorTestCase(unittest.TestCase):
+
+    def test_converges_as_trials_are_added(self):
+        rng = np.random.default_rng(0)
+        monitor = ConvergenceMonitor(0.01)
+        values = []
+        converged_at = None
+        for _ in range(50):
+            values.extend(10.0 + rng.normal(size=100))
+            if monitor.update({'y': values, 'label': ['x'] * len(values)}):
+                converged_at = len(values)
+                break
+
+        # The 95% interval of the mean is 1.96 / sqrt(n) wide relative to 10.
+        self.assertIsNotNone(converged_at)
+        self.assertTrue(300 <= converged_at <= 500)
+        self.assertEqual(converged_at, monitor.history[-1]['trials'])
+        self.assertFalse(monitor.history[0]['converged'])
+
+    def test_excluded_columns_and_time_series(self):
+        monitor = ConvergenceMonitor(0.1)
+        data = {'v': [[1.0, 2.0], [1.0, 2.0], [1.0, 2.0]], 'a': [0.0, 100.0, -100.0]}
+        self.assertTrue(monitor.update(data, excluded=['a']))
+        self.assertFalse(ConvergenceMonitor(0.1).update(data))
+
+    def test_single_trial_has_not_converged(self):
+        self.assertFalse(ConvergenceMonitor(0.1).update({'y': [1.0]}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from mps_server.cost import BYTES_PER_VALUE, DEFAULT_CPU_SECONDS_PER_WORK_UNIT, admission_check, estimate_cost, work_units
+
+
+def _settings(trials, time_start, time_stop, point_interval):
+    return {'simulation': {'numberTrials': trials, 'timeStart': time_start, 'timeStop': time_stop, 'pointInterval': point_interval}}
+
+
+class CostTestCase(unittest.TestCase):
+
+    def test_work_units(self):
+        self.assertEqual(10 * 11 * 2, work_units(_settings(10, 0, 100, 10), ['a', 'b']))
+        self.assertEqual(3 * 1 * 1, work_units(_settings(3, 0, 0, 1), []))
+
+    def test_estimate(self):
+        estimate = estimate_cost(1000)
+        self.assertFalse(estimate['calibrated'])
+        self.assertAlmostEqual(1000 * DEFAULT_CPU_SECONDS_PER_WORK_UNIT, estimate['cpu_seconds'])
+        self.assertEqual(1000 * BYTES_PER_VALUE, estimate['output_bytes'])
+        self.assertTrue(estimate_cost(1000, 0.5)['calibrated'])
+
+    def test_admission_check(self):
+        estimate = estimate_cost(1000, 0.1)
+        self.assertIsNone(admission_check(estimate, 10, 0, 0))
+        self.assertIsNone(admission_check(estimate, 10, 100, 8000))
+        self.assertEqual({'limit': 'cpu_seconds', 'maximum': 50, 'max_trials': 5}, admission_check(estimate, 10, 50, 0))
+        self.assertEqual('output_bytes', admission_check(estimate, 10, 0, 4000)['limit'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+from mps_server.executors import ExecutorConfigurationError, FakeExecutor, ProcessPoolTrialExecutor, SolverTask, accepts_parameter_samples, check_executor, create_executor, fake_trial, \
+    time_points
+
+
+def failing_trial(model_file, parameters, times, outputs):
+    if parameters['a'] > 0.5:
+        raise ValueError('no convergence')
+    return fake_trial(model_file, parameters, times, outputs)
+
+
+def _task(trials):
+    parameters = np.column_stack([np.linspace(0, 1, trials), np.ones(trials)])
+    return SolverTask('run', 'run.config', 'model.cellml', ['x', 'y'], time_points({'StartingPoint': 0.0, 'EndingPoint': 2.0, 'PointInterval': 0.5}),
+                      ['a', 'b'], parameters)
+
+
+class ExecutorsTestCase(unittest.TestCase):
+
+    def test_time_points(self):
+        self.assertEqual([0.0, 0.5, 1.0, 1.5, 2.0], time_points({'StartingPoint': 0.0, 'EndingPoint': 2.0, 'PointInterval': 0.5}).tolist())
+
+    def test_fake_executor(self):
+        reports = []
+        execution = FakeExecutor().run(_task(4), lambda progress: reports.append(progress.trials_completed))
+        self.assertEqual(0, execution.returncode)
+        self.assertEqual([1, 2, 3, 4], reports)
+        self.assertEqual((4, 5), execution.data['y'].shape)
+        self.assertEqual([0.0, 1 / 3, 2 / 3, 1.0], execution.data['a'].tolist())
+        self.assertAlmostEqual(2.0, execution.data['x'][0, 0])
+
+    def test_process_pool_executor_matches_fake_executor(self):
+        task = _task(10)
+        expected = FakeExecutor(f"{__name__}:failing_trial").run(task, lambda progress: None)
+        execution = ProcessPoolTrialExecutor(f"{__name__}:failing_trial", 2, 3).run(task, lambda progress: None)
+        self.assertEqual(0, execution.returncode)
+        self.assertEqual(5, execution.progress.trials_completed)
+        self.assertEqual(5, execution.progress.trials_failed)
+        for name in ['x', 'y', 'a', 'b']:
+            np.testing.assert_array_equal(expected.data[name], execution.data[name])
+        self.assertTrue(np.isnan(execution.data['x'][9]).all())
+
+    def test_create_executor(self):
+        self.assertTrue(create_executor('solver-manager', 1).compiled_solver)
+        self.assertFalse(create_executor('fake', 1).compiled_solver)
+        self.assertFalse(accepts_parameter_samples('solver-manager'))
+        self.assertTrue(accepts_parameter_samples('process-pool'))
+        self.assertTrue(accepts_parameter_samples('fake'))
+        self.assertFalse(accepts_parameter_samples('unknown'))
+        self.assertRaises(ValueError, create_executor, 'process-pool', 1)
+        self.assertRaises(ValueError, create_executor, 'cluster', 1)
+
+    def test_check_executor(self):
+        self.assertFalse(check_executor('process-pool', f"{__name__}:failing_trial").compiled_solver)
+        self.assertRaises(ExecutorConfigurationError, check_executor, 'process-pool')
+        self.assertRaises(ExecutorConfigurationError, check_executor, 'process-pool', f"{__name__}:missing_trial")
+        self.assertRaises(ExecutorConfigurationError, check_executor, 'fake', "missing_module:fake_trial")
@@ -0,0 +1,290 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from mps_server.common import Status
+from mps_server.job_queue import JobQueue
+
+
+def _claim_all(location, worker):
+    queue = JobQueue(location)
+    claimed = []
+    while True:
+        reference = queue.claim(worker=worker, lease_seconds=60)
+        if reference is None:
+            return claimed
+        claimed.append(reference)
+        queue.complete(reference, worker=worker)
+
+
+class JobQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._queue = JobQueue(os.path.join(self._dir.name, 'queue.sqlite'))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_claim_oldest_pending(self):
+        self._queue.enqueue('finished', 'user', Status.FINISHED, created=1.0)
+        self._queue.enqueue('first', 'user', created=2.0)
+        self._queue.enqueue('second', 'user', created=3.0)
+
+        self.assertEqual('first', self._queue.claim())
+        self.assertEqual(Status.RUNNING, self._queue.status('first'))
+        self.assertEqual('second', self._queue.claim())
+        self.assertIsNone(self._queue.claim())
+
+    def test_claim_is_fair_between_users(self):
+        self._queue.enqueue('busy-1', 'busy', created=1.0)
+        self._queue.enqueue('busy-2', 'busy', created=2.0)
+        self._queue.enqueue('busy-3', 'busy', created=3.0)
+        self._queue.enqueue('other-1', 'other', created=4.0)
+
+        self.assertEqual('busy-1', self._queue.claim())
+        self.assertEqual('other-1', self._queue.claim())
+        self.assertEqual('busy-2', self._queue.claim())
+
+    def test_complete(self):
+        self._queue.enqueue('run', 'user')
+        self.assertEqual('run', self._queue.claim())
+        self._queue.complete('run')
+        self.assertEqual(Status.FINISHED, self._queue.status('run'))
+        self.assertEqual(0, self._queue.count(Status.RUNNING))
+        self.assertEqual(1, self._queue.count(Status.FINISHED))
+
+    def test_enqueue_is_idempotent(self):
+        self._queue.enqueue('run', 'user')
+        self._queue.claim()
+        self._queue.enqueue('run', 'user')
+        self.assertEqual(Status.RUNNING, self._queue.status('run'))
+        self.assertIsNone(self._queue.status('unknown'))
+
+    def test_list_runs(self):
+        self._queue.enqueue('first', 'user', created=1.0, title='model', trials_total=10)
+        self._queue.enqueue('second', 'user', created=2.0, title='model', trials_total=20)
+        self._queue.enqueue('third', 'user', created=3.0, title='other', trials_total=30)
+        self._queue.enqueue('someone-else', 'other', created=4.0)
+        self._queue.claim()
+
+        runs, total = self._queue.list_runs('user')
+        self.assertEqual(3, total)
+        self.assertEqual(['third', 'second', 'first'], [run['reference'] for run in runs])
+        self.assertEqual('other', runs[0]['title'])
+        self.assertEqual(30, runs[0]['trials_total'])
+
+        runs, total = self._queue.list_runs('user', offset=1, limit=1)
+        self.assertEqual(3, total)
+        self.assertEqual(['second'], [run['reference'] for run in runs])
+
+        runs, total = self._queue.list_runs('user', status=Status.RUNNING)
+        self.assertEqual(1, total)
+        self.assertEqual('first', runs[0]['reference'])
+
+    def test_list_runs_past_the_last_page(self):
+        self._queue.enqueue('run', 'user')
+        self.assertEqual(([], 1), self._queue.list_runs('user', offset=5, limit=10))
+        self.assertEqual(([], 0), self._queue.list_runs('user', status=Status.RUNNING, offset=5, limit=10))
+        self.assertEqual(([], 0), self._queue.list_runs('nobody'))
+
+    def test_changed_runs(self):
+        self._queue.enqueue('a', 'user', created=1.0)
+        self._queue.enqueue('b', 'user', created=2.0)
+        self._queue.enqueue('someone-else', 'other', created=3.0)
+        runs = self._queue.changed_runs('user', 0)
+        self.assertEqual(['a', 'b'], [run['reference'] for run in runs])
+        revision = runs[-1]['revision']
+        self.assertEqual([], self._queue.changed_runs('user', revision))
+
+        self._queue.claim()
+        self._queue.update_progress('a', 1, 0)
+        runs = self._queue.changed_runs('user', revision)
+        self.assertEqual(['a'], [run['reference'] for run in runs])
+        self.assertEqual(Status.RUNNING, runs[0]['status'])
+        self.assertGreater(runs[0]['revision'], revision)
+        self.assertEqual([], self._queue.changed_runs('user', revision, ['b']))
+
+    def test_every_change_is_a_new_revision(self):
+        self._queue.enqueue('a', 'user')
+        self._queue.enqueue('b', 'user')
+        revisions = [self._queue.run_info('a')['revision'], self._queue.run_info('b')['revision']]
+        self._queue.claim()
+        revisions.append(self._queue.run_info('a')['revision'])
+        self._queue.set_priority('b', 'user', 1)
+        revisions.append(self._queue.run_info('b')['revision'])
+        self._queue.complete('a')
+        revisions.append(self._queue.run_info('a')['revision'])
+        self.assertEqual(sorted(set(revisions)), revisions)
+
+    def test_columns_are_added_to_existing_queue(self):
+        location = os.path.join(self._dir.name, 'old.sqlite')
+        connection = sqlite3.connect(location)
+        connection.execute("CREATE TABLE jobs (seq INTEGER PRIMARY KEY AUTOINCREMENT, reference TEXT NOT NULL UNIQUE, "
+                           "user_id TEXT NOT NULL, status TEXT NOT NULL, created REAL NOT NULL, started REAL, finished REAL)")
+        connection.execute("INSERT INTO jobs (reference, user_id, status, created) VALUES ('run', 'user', 'pending', 1.0)")
+        connection.commit()
+        connection.close()
+
+        runs, total = JobQueue(location).list_runs('user')
+        self.assertEqual(1, total)
+        self.assertEqual(0, runs[0]['trials_completed'])
+
+    def test_update_progress(self):
+        self._queue.enqueue('a', 'user-1', trials_total=10)
+        self._queue.claim()
+        self._queue.update_progress('a', 4, 1)
+        info = self._queue.run_info('a')
+        self.assertEqual((4, 1, 10), (info['trials_completed'], info['trials_failed'], info['trials_total']))
+        self.assertIsNotNone(info['eta'])
+        self.assertIsNone(self._queue.run_info('b'))
+
+    def test_stage_timings(self):
+        self._queue.enqueue('a', 'user-1')
+        self._queue.enqueue('b', 'user-1')
+        self._queue.record_timings('a', {'compile_and_solve': 2.0, 'extract_result': 0.5})
+        self._queue.record_timings('b', {'compile_and_solve': 20.0})
+        self.assertEqual({'compile_and_solve': 2.0, 'extract_result': 0.5}, self._queue.timings('a'))
+        histograms = self._queue.stage_histograms((1.0, 10.0))
+        self.assertEqual(([0, 1], 2, 22.0), histograms['compile_and_solve'])
+        self.assertEqual(([1, 1], 1, 0.5), histograms['extract_result'])
+
+    def test_requeue(self):
+        self._queue.enqueue('a', 'user-1')
+        self._queue.claim()
+        self._queue.requeue('a')
+        self.assertEqual(Status.PENDING, self._queue.status('a'))
+        self.assertEqual(1, self._queue.attempts('a'))
+        self.assertEqual('a', self._queue.claim())
+        self.assertEqual(['a'], self._queue.running())
+        self._queue.requeue('a', count_attempt=False)
+        self.assertEqual(1, self._queue.attempts('a'))
+
+    def test_claim_highest_priority_first(self):
+        self._queue.enqueue('low', 'user-1')
+        self._queue.enqueue('high', 'user-1', priority=1)
+        self._queue.enqueue('later', 'user-1')
+        self.assertTrue(self._queue.set_priority('later', 'user-1', 2))
+        self.assertFalse(self._queue.set_priority('later', 'user-2', 3))
+        self.assertEqual(['later', 'high', 'low'], [self._queue.claim() for _ in range(3)])
+
+    def test_cancel(self):
+        self._queue.enqueue('pending', 'user-1')
+        self._queue.enqueue('running', 'user-1')
+        self.assertIsNone(self._queue.cancel('pending', 'user-2'))
+        self.assertEqual(Status.PENDING, self._queue.cancel('pending', 'user-1'))
+        self.assertEqual('running', self._queue.claim())
+        self.assertEqual(Status.RUNNING, self._queue.cancel('running', 'user-1'))
+        self.assertIsNone(self._queue.cancel('running', 'user-1'))
+        self.assertFalse(self._queue.complete('running'))
+        self.assertEqual(Status.CANCELLED, self._queue.status('running'))
+
+    def test_extend(self):
+        self._queue.enqueue('a', 'user-1', trials_total=10, model_key='model')
+        self.assertFalse(self._queue.extend('a', 'user-1', 5, 'model'))
+        self.assertEqual('a', self._queue.claim())
+        self._queue.update_progress('a', 10, 0, 10)
+        self.assertTrue(self._queue.complete('a'))
+        self.assertFalse(self._queue.extend('a', 'user-2', 5, 'model'))
+        self.assertFalse(self._queue.extend('a', 'user-1', 5, 'changed-model'))
+        self.assertTrue(self._queue.extend('a', 'user-1', 5, 'model', 50, 2.0))
+        info = self._queue.run_info('a')
+        self.assertEqual(Status.PENDING, info['status'])
+        self.assertEqual(15, info['trials_total'])
+        self.assertEqual(10, info['trials_completed'])
+        self.assertEqual(5, self._queue.extension_trials('a'))
+        self.assertEqual('a', self._queue.claim())
+        self.assertTrue(self._queue.complete('a'))
+        self.assertEqual(0, self._queue.extension_trials('a'))
+
+        # Cancelling an extension leaves the run finished with the trials it had.
+        self.assertTrue(self._queue.extend('a', 'user-1', 5, 'model'))
+        self.assertEqual('a', self._queue.claim(worker='node1:1', lease_seconds=60))
+        self._queue.update_progress('a', 12, 1)
+        self.assertEqual(Status.RUNNING, self._queue.cancel('a', 'user-1'))
+        info = self._queue.run_info('a')
+        self.assertEqual((Status.FINISHED, 15, 10, 0), (info['status'], info['trials_total'], info['trials_completed'], info['trials_failed']))
+        self.assertEqual(0, self._queue.extension_trials('a'))
+        self.assertIsNone(self._queue.worker('a'))
+        self._queue.update_progress('a', 13, 1)
+        self.assertEqual(10, self._queue.run_info('a')['trials_completed'])
+
+    def test_cpu_seconds_calibration(self):
+        self.assertIsNone(self._queue.cpu_seconds_per_work_unit('model'))
+        self._queue.enqueue('a', 'user-1', model_key='model', work_units=100)
+        self._queue.enqueue('b', 'user-1', model_key='other', work_units=100)
+        self._queue.record_cpu_seconds('b', 50.0)
+        self.assertEqual(0.5, self._queue.cpu_seconds_per_work_unit('model'))
+        self._queue.record_cpu_seconds('a', 10.0)
+        self.assertEqual(0.1, self._queue.cpu_seconds_per_work_unit('model'))
+
+    def test_claim_within_cpu_budget(self):
+        self._queue.enqueue('a1', 'user-1', cpu_seconds_estimate=80.0)
+        self._queue.enqueue('a2', 'user-1', cpu_seconds_estimate=30.0)
+        self._queue.enqueue('a3', 'user-1', cpu_seconds_estimate=10.0)
+        self.assertEqual('a1', self._queue.claim(100.0))
+        self.assertEqual('a3', self._queue.claim(100.0))
+        self.assertIsNone(self._queue.claim(100.0))
+        self.assertEqual('a2', self._queue.claim())
+
+    def test_leases(self):
+        self._queue.enqueue('a', 'user-1')
+        self._queue.enqueue('b', 'user-1')
+        self.assertEqual('a', self._queue.claim(worker='node1:1', lease_seconds=60))
+        self.assertEqual('b', self._queue.claim(worker='node2:1', lease_seconds=-1))
+        self.assertEqual(['a'], self._queue.heartbeat(['a', 'b'], 'node1:1', 60))
+        self.assertEqual(['b'], self._queue.running('node2:'))
+        self.assertEqual([('b', Status.PENDING)], self._queue.release_expired(2))
+        self.assertFalse(self._queue.complete('a', worker='node2:1'))
+        self.assertTrue(self._queue.complete('a', worker='node1:1'))
+        self.assertEqual('b', self._queue.claim(worker='node1:1', lease_seconds=-1))
+        self.assertEqual([], self._queue.heartbeat(['b'], 'node2:1', 60))
+        self.assertEqual([('b', Status.FINISHED)], self._queue.release_expired(2))
+
+    def test_shards(self):
+        self._queue.enqueue('a', 'user-1', trials_total=10, cpu_seconds_estimate=10.0, shards=[(0, 4), (4, 10)])
+        self.assertEqual('a.0', self._queue.claim(worker='node1:1', lease_seconds=60))
+        self.assertEqual(Status.RUNNING, self._queue.status('a'))
+        self.assertEqual({'parent': 'a', 'trials_start': 0, 'trials_stop': 4}, self._queue.shard('a.0'))
+        self.assertEqual('a.1', self._queue.claim(worker='node2:1', lease_seconds=60))
+        self.assertIsNone(self._queue.claim())
+        self.assertEqual((1, 1), (self._queue.count_leased('node1:'), self._queue.count_leased('node2:')))
+        self._queue.update_progress('a.0', 3, 1)
+        self._queue.update_progress('a.1', 6, 0)
+        self.assertEqual((9, 1), (self._queue.run_info('a')['trials_completed'], self._queue.run_info('a')['trials_failed']))
+        self.assertEqual(1, self._queue.list_runs('user-1')[1])
+        self.assertTrue(self._queue.complete('a.0'))
+        self.assertIsNone(self._queue.claim_merge('node1:1', 60))
+        self.assertTrue(self._queue.complete('a.1'))
+        self.assertEqual('a', self._queue.claim_merge('node1:1', 60))
+        self.assertEqual(0, self._queue.count_leased('node1:'))
+        self.assertIsNone(self._queue.claim_merge('node2:1', 60))
+        self.assertEqual(['a'], self._queue.heartbeat(['a'], 'node1:1', 60))
+        self._queue.release_merge('a', 'node1:1')
+        self.assertEqual('a', self._queue.claim_merge('node2:1', 60))
+        self.assertFalse(self._queue.complete('a', worker='node1:1'))
+        self._queue.release_merge('a', 'node2:1')
+        self.assertEqual('a', self._queue.claim_merge('node1:1', 60))
+        self.assertEqual([4, 6], [shard['trials_stop'] - shard['trials_start'] for shard in self._queue.shards('a')])
+        self.assertTrue(self._queue.complete('a', worker='node1:1'))
+
+    def test_cancel_shards(self):
+        self._queue.enqueue('a', 'user-1', trials_total=10, shards=[(0, 5), (5, 10)])
+        self.assertEqual('a.0', self._queue.claim())
+        self.assertEqual(Status.RUNNING, self._queue.cancel('a', 'user-1'))
+        self.assertEqual([Status.CANCELLED, Status.CANCELLED], [shard['status'] for shard in self._queue.shards('a')])
+
+    def test_workers_in_several_processes_claim_each_run_once(self):
+        for index in range(60):
+            self._queue.enqueue(f"run-{index}", f"user-{index % 3}")
+        with multiprocessing.get_context('spawn').Pool(4) as pool:
+            claimed = pool.starmap(_claim_all, [(self._queue._location, f"node{index}:1") for index in range(4)])
+        references = [reference for references in claimed for reference in references]
+        self.assertEqual(sorted(f"run-{index}" for index in range(60)), sorted(references))
+        self.assertEqual(60, self._queue.count(Status.FINISHED))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import unittest
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+from mps_server.jwks import JWKSCache
+
+
+def _write_jwks(location, kids):
+    keys = []
+    for kid in kids:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+        jwk.update({'kid': kid, 'use': 'sig'})
+        keys.append(jwk)
+
+    with open(location, 'w') as f:
+        f.write(json.dumps({'keys': keys}))
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._jwks_file = os.path.join(self._dir.name, 'jwks.json')
+        _write_jwks(self._jwks_file, ['key-1'])
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_hit_and_miss(self):
+        cache = JWKSCache(self._jwks_file, ttl=600, min_refresh_interval=0)
+        key = cache.get_key('key-1')
+        self.assertTrue(key.startswith(b'-----BEGIN PUBLIC KEY-----'))
+        self.assertEqual(key, cache.get_key('key-1'))
+        self.assertIsNone(cache.get_key('unknown'))
+
+        stats = cache.stats()
+        self.assertEqual(2, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(2, stats['refreshes'])
+
+    def test_unknown_kid_refreshes(self):
+        cache = JWKSCache(self._jwks_file, ttl=600, min_refresh_interval=0)
+        self.assertIsNotNone(cache.get_key('key-1'))
+        _write_jwks(self._jwks_file, ['key-1', 'key-2'])
+        self.assertIsNotNone(cache.get_key('key-2'))
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        cache = JWKSCache(self._jwks_file, ttl=600, min_refresh_interval=600)
+        cache.get_key('unknown')
+        cache.get_key('unknown')
+        self.assertEqual(1, cache.stats()['refreshes'])
+
+    def test_expired_keys_are_refreshed(self):
+        cache = JWKSCache(self._jwks_file, ttl=0, refresh_margin=0)
+        cache.get_key('key-1')
+        cache.get_key('key-1')
+        self.assertEqual(2, cache.stats()['refreshes'])
+
+    def test_missing_source(self):
+        cache = JWKSCache(os.path.join(self._dir.name, 'missing.json'))
+        self.assertIsNone(cache.get_key('key-1'))
+        self.assertEqual(1, cache.stats()['refresh_errors'])
+        self.assertIsNone(cache.get_key('key-1'))
+        self.assertEqual(1, cache.stats()['refresh_errors'])
+
+    def test_failed_refresh_keeps_stale_keys(self):
+        cache = JWKSCache(self._jwks_file, ttl=0, refresh_margin=0, failure_backoff=600)
+        key = cache.get_key('key-1')
+        os.remove(self._jwks_file)
+        self.assertEqual(key, cache.get_key('key-1'))
+        self.assertEqual(key, cache.get_key('key-1'))
+        stats = cache.stats()
+        self.assertEqual(1, stats['refreshes'])
+        self.assertEqual(1, stats['refresh_errors'])
+
+
+if __name__ == '__main__':
+    unittest.main()
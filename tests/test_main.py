@@ -0,0 +1,169 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from mps_server import auth0, main, simulations
+from mps_server.config import Config
+
+
+class SimulationEventsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        for target, name, value in [(Config, 'SIMULATION_DATA_DIR', self._dir.name), (auth0, '_verified_payload', lambda token: {'sub': 'user'}),
+                                    (main, '_event_streams', threading.BoundedSemaphore(1))]:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self._client = main.app.test_client()
+        self._queue = simulations._job_queue()
+        self._queue.enqueue('a', 'user', created=1.0)
+        self._queue.enqueue('b', 'user', created=2.0)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _get(self, query, headers=None):
+        return self._client.get(f"/api/v1/user/simulation-events?{query}", headers={'Authorization': 'Bearer token', **(headers or {})})
+
+    def test_long_poll(self):
+        response = self._get('mode=poll&since=0')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['a', 'b'], [run['reference'] for run in response.json['simulation_info']])
+        revision = response.json['revision']
+
+        self._queue.claim()
+        response = self._get(f'mode=poll&since={revision}&timeout=0')
+        self.assertEqual(['a'], [run['reference'] for run in response.json['simulation_info']])
+        self.assertGreater(response.json['revision'], revision)
+
+        response = self._get(f"mode=poll&since={response.json['revision']}&timeout=0")
+        self.assertEqual([], response.json['simulation_info'])
+
+    def test_event_stream(self):
+        revision = self._queue.run_info('a')['revision']
+        with mock.patch.object(Config, 'SIMULATION_EVENTS_TIMEOUT', 0.1):
+            response = self._get('', {'Last-Event-ID': str(revision)})
+            body = response.get_data(as_text=True)
+        self.assertEqual('text/event-stream', response.mimetype)
+        self.assertIn(f"id: {self._queue.run_info('b')['revision']}\nevent: simulation-info\n", body)
+        self.assertNotIn('"reference": "a"', body)
+
+    def test_malformed_last_event_id(self):
+        response = self._get('mode=poll&timeout=0', {'Last-Event-ID': 'not-a-number'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(response.json['simulation_info']))
+
+    def test_scoped_token(self):
+        response = self._client.post('/api/v1/user/simulation-events/token', headers={'Authorization': 'Bearer token'})
+        token = response.json['token']
+        response = self._client.get(f"/api/v1/user/simulation-events?mode=poll&timeout=0&token={token}")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(response.json['simulation_info']))
+        self.assertEqual(401, self._client.get(f"/api/v1/user/simulation-events?mode=poll&timeout=0&token={token}x").status_code)
+        self.assertEqual(401, self._client.get("/api/v1/user/simulation-events?mode=poll&timeout=0").status_code)
+
+    def test_long_poll_is_woken_by_changes(self):
+        revision = self._queue.run_info('b')['revision']
+        responses = []
+        with mock.patch.object(simulations, 'EVENTS_RESCAN_INTERVAL', 30.0):
+            # Listening before the change.
+            simulations._event_broadcaster()
+            poll = threading.Thread(target=lambda: responses.append(self._get(f'mode=poll&since={revision}&timeout=20')))
+            start = time.time()
+            poll.start()
+            time.sleep(0.2)
+            self._queue.claim()
+            poll.join(20)
+        self.assertLess(time.time() - start, 5.0)
+        self.assertEqual(['a'], [run['reference'] for run in responses[0].json['simulation_info']])
+
+    def test_streams_are_limited(self):
+        with mock.patch.object(Config, 'SIMULATION_EVENTS_TIMEOUT', 0.1):
+            stream = self._client.get("/api/v1/user/simulation-events", headers={'Authorization': 'Bearer token'}, buffered=False)
+            response = self._get('mode=poll&timeout=0')
+            self.assertEqual(503, response.status_code)
+            self.assertIn('Retry-After', response.headers)
+            stream.close()
+        self.assertEqual(200, self._get('mode=poll&timeout=0').status_code)
+
+
+class SimulationPriorityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        for target, name, value in [(Config, 'SIMULATION_DATA_DIR', self._dir.name), (Config, 'CLIENT_WORKING_DIR', self._dir.name),
+                                    (auth0, '_verified_payload', lambda token: {'sub': 'user'})]:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self._client = main.app.test_client()
+        self._queue = simulations._job_queue()
+        self._queue.enqueue('a', 'user')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _post(self, path, data):
+        return self._client.post(path, json=data, headers={'Authorization': 'Bearer token'})
+
+    def test_priority_is_clamped(self):
+        response = self._post('/api/v1/simulation/priority', {'reference': 'a', 'priority': 100})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(simulations.MAXIMUM_PRIORITY, response.json['simulation_info']['priority'])
+        response = self._post('/api/v1/simulation/priority', {'reference': 'a', 'priority': -100})
+        self.assertEqual(simulations.MINIMUM_PRIORITY, response.json['simulation_info']['priority'])
+
+    def test_malformed_priority(self):
+        self.assertEqual(400, self._post('/api/v1/simulation/priority', {'reference': 'a', 'priority': 'high'}).status_code)
+        submission = {'model': 'model.cellml', 'uncertainties': [], 'outputs': [], 'priority': 'high',
+                      'settings': {'solver': {}, 'simulation': {'numberTrials': 10}}}
+        self.assertEqual(400, self._post('/api/v1/simulation/submit', submission).status_code)
+
+    def test_malformed_settings(self):
+        simulation = {'numberTrials': 10, 'timeStart': 0.0, 'timeStop': 2.0, 'pointInterval': 0.5}
+        for changes in [{'numberTrials': 'abc'}, {'numberTrials': 0}, {'pointInterval': 'abc'}, {'timeStart': None}, {'timeStop': float('nan')}]:
+            submission = {'model': 'model.cellml', 'uncertainties': [], 'outputs': [], 'settings': {'solver': {}, 'simulation': {**simulation, **changes}}}
+            self.assertEqual(400, self._post('/api/v1/simulation/submit', submission).status_code, changes)
+        submission = {'model': 'model.cellml', 'uncertainties': [], 'outputs': [], 'settings': {'solver': {}}}
+        self.assertEqual(400, self._post('/api/v1/simulation/submit', submission).status_code)
+
+    def test_design_needs_an_executor_accepting_samples(self):
+        simulation = {'numberTrials': 10, 'timeStart': 0.0, 'timeStop': 2.0, 'pointInterval': 0.5, 'design': 'lhs'}
+        submission = {'model': 'model.cellml', 'uncertainties': [], 'outputs': [], 'settings': {'solver': {}, 'simulation': simulation}}
+        with mock.patch.object(Config, 'SIMULATION_EXECUTOR', 'solver-manager'):
+            self.assertEqual(400, self._post('/api/v1/simulation/submit', submission).status_code)
+
+
+class UploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        for target, name, value in [(Config, 'CLIENT_WORKING_DIR', self._dir.name), (auth0, '_verified_payload', lambda token: {'sub': 'user'})]:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(main.app.config, {'MAX_CONTENT_LENGTH': 1024})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._client = main.app.test_client()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_oversized_upload_is_refused_before_it_is_read(self):
+        with mock.patch.object(main, 'start_cellml_upload') as start_cellml_upload:
+            response = self._client.post('/api/v1/upload', data={'file': (io.BytesIO(b'<model/>' * 1024), 'model.cellml')},
+                                         headers={'Authorization': 'Bearer token'})
+        self.assertEqual(413, response.status_code)
+        self.assertEqual('Uploaded file is too large', response.json['message'])
+        start_cellml_upload.assert_not_called()
+        self.assertEqual([], os.listdir(self._dir.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
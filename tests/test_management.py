@@ -0,0 +1,156 @@
+import io
+import os
+import tempfile
+import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from mps_server import management
+
+
+class _UploadedFile(object):
+
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.stream = io.BytesIO(content)
+
+
+class _InlineExecutor(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def submit(self, function, *args):
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class _BrokenExecutor(object):
+
+    def submit(self, function, *args):
+        raise BrokenProcessPool('A child process terminated abruptly')
+
+
+class _CrashingExecutor(object):
+
+    def submit(self, function, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool('A child process terminated abruptly'))
+        return future
+
+
+class CellMLUploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        for name, value in [('ProcessPoolExecutor', _InlineExecutor), ('_upload_validation_executor', None),
+                            ('is_cellml_file', lambda location: open(location).read().startswith('<model')),
+                            ('get_parameters_from_model', lambda location: {'parameters': ['a']})]:
+            patcher = mock.patch.object(management, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _upload(self, content, max_bytes=1024):
+        return management.start_cellml_upload({'id': 'user|1'}, {'base_dir': self._dir.name, 'file': _UploadedFile('model.cellml', content), 'max_bytes': max_bytes})
+
+    def _status(self, ticket):
+        return management.cellml_upload_status(self._dir.name, 'user|1', ticket)
+
+    def test_accepted_upload(self):
+        result, ticket = self._upload(b'<model/>')
+        self.assertEqual(0, result)
+        self.assertEqual(management.UploadStatus.ACCEPTED, self._status(ticket)['status'])
+        self.assertEqual(['model.cellml'], management.list_model_files(self._dir.name, 'user|1'))
+        self.assertEqual({'parameters': ['a']}, management.model_parameter_information(self._dir.name, 'user|1', 'model.cellml'))
+
+    def test_rejected_upload(self):
+        result, ticket = self._upload(b'not cellml')
+        self.assertEqual(0, result)
+        self.assertEqual(management.UploadStatus.REJECTED, self._status(ticket)['status'])
+        self.assertEqual([], management.list_model_files(self._dir.name, 'user|1'))
+
+    def test_upload_too_large(self):
+        self.assertEqual((3, None), self._upload(b'<model/>', max_bytes=4))
+
+    def test_failing_validation(self):
+        with mock.patch.object(management, 'get_parameters_from_model', side_effect=ValueError('bad model')):
+            _, ticket = self._upload(b'<model/>')
+        status = self._status(ticket)
+        self.assertEqual(management.UploadStatus.ERROR, status['status'])
+        self.assertIn('bad model', status['message'])
+
+    def test_broken_pool_is_replaced(self):
+        management._upload_validation_executor = _BrokenExecutor()
+        result, ticket = self._upload(b'<model/>')
+        self.assertEqual(0, result)
+        self.assertEqual(management.UploadStatus.ACCEPTED, self._status(ticket)['status'])
+        self.assertIsInstance(management._upload_validation_executor, _InlineExecutor)
+
+    def test_crashed_validation(self):
+        management._upload_validation_executor = _CrashingExecutor()
+        result, ticket = self._upload(b'<model/>')
+        self.assertEqual(0, result)
+        self.assertEqual(management.UploadStatus.ERROR, self._status(ticket)['status'])
+        self.assertIsNone(management._upload_validation_executor)
+
+    def test_pool_that_stays_broken(self):
+        with mock.patch.object(management, 'ProcessPoolExecutor', lambda *args, **kwargs: _BrokenExecutor()):
+            self.assertEqual((1, None), self._upload(b'<model/>'))
+        uploads = os.listdir(management._uploads_dir(self._dir.name, 'user|1'))
+        self.assertEqual([], [name for name in uploads if name.endswith('.upload')])
+        with open(os.path.join(management._uploads_dir(self._dir.name, 'user|1'), uploads[0])) as f:
+            self.assertIn('"status": "error"', f.read())
+
+    def test_unknown_upload_status(self):
+        self.assertIsNone(self._status('not-a-ticket'))
+        self.assertIsNone(self._status('00000000-0000-0000-0000-000000000000'))
+
+
+class ModelParameterInformationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._model_files_dir = management._model_files_dir(self._dir.name, 'user|1')
+        os.makedirs(self._model_files_dir)
+        self._write_model('<model name="first"/>')
+        patcher = mock.patch.object(management, 'get_parameters_from_model', side_effect=lambda location: {'size': os.path.getsize(location)})
+        self._get_parameters = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write_model(self, content):
+        with open(os.path.join(self._model_files_dir, 'model.cellml'), 'w') as f:
+            f.write(content)
+
+    def test_unchanged_model_is_parsed_once(self):
+        information = management.model_parameter_information(self._dir.name, 'user|1', 'model.cellml')
+        self.assertEqual(information, management.model_parameter_information(self._dir.name, 'user|1', 'model.cellml'))
+        self.assertEqual(1, self._get_parameters.call_count)
+
+    def test_replaced_model_is_parsed_again(self):
+        management.model_parameter_information(self._dir.name, 'user|1', 'model.cellml')
+        self._write_model('<model name="second, larger"/>')
+        self.assertEqual({'size': 30}, management.model_parameter_information(self._dir.name, 'user|1', 'model.cellml'))
+        self.assertEqual(2, self._get_parameters.call_count)
+
+    def test_touched_model_is_parsed_again(self):
+        management.model_parameter_information(self._dir.name, 'user|1', 'model.cellml')
+        model_file = os.path.join(self._model_files_dir, 'model.cellml')
+        stat = os.stat(model_file)
+        os.utime(model_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        management.model_parameter_information(self._dir.name, 'user|1', 'model.cellml')
+        self.assertEqual(2, self._get_parameters.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
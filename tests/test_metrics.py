@@ -0,0 +1,41 @@
+import unittest
+
+from mps_server.metrics import Histogram, StageTimer, gauge_lines, histogram_lines
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test durations.', 'stage', buckets=(1.0, 10.0))
+        histogram.observe('solve', 0.5)
+        histogram.observe('solve', 5.0)
+        histogram.observe('solve', 50.0)
+        lines = histogram.lines()
+        self.assertIn('test_seconds_bucket{stage="solve",le="1.0"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="solve",le="10.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="solve",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{stage="solve"} 55.5', lines)
+        self.assertIn('test_seconds_count{stage="solve"} 3', lines)
+
+    def test_iter_timed_observes_once_exhausted(self):
+        histogram = Histogram('test_seconds', 'Test durations.', 'stage')
+        chunks = histogram.iter_timed('serialize', iter(['a', 'b']))
+        self.assertEqual([], histogram.lines()[2:])
+        self.assertEqual(['a', 'b'], list(chunks))
+        self.assertIn('test_seconds_count{stage="serialize"} 1', histogram.lines())
+
+    def test_stage_timer(self):
+        timer = StageTimer()
+        with timer.stage('generate_code'):
+            pass
+        with timer.stage('generate_code'):
+            pass
+        self.assertEqual(['generate_code'], list(timer.timings))
+
+    def test_formatting(self):
+        self.assertEqual(['# HELP depth Queue depth.', '# TYPE depth gauge', 'depth 3.0'], gauge_lines('depth', 'Queue depth.', 3))
+        self.assertIn('empty_count 0', histogram_lines('empty', 'Nothing.', None, {None: ([0], 0, 0.0)}, buckets=(1.0,)))
+
+
+if __name__ == '__main__':
+    unittest.main()
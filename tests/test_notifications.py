@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from multiprocessing.connection import wait
+
+from mps_server.notifications import WakeListener, notify
+
+
+class NotificationsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._location = os.path.join(self._dir.name, 'manager.sock')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_notify_without_listener(self):
+        self.assertFalse(notify(self._location))
+
+    def test_notify_wakes_listener(self):
+        listener = WakeListener(self._location)
+        try:
+            self.assertEqual([], wait([listener], timeout=0))
+            self.assertTrue(notify(self._location))
+            self.assertTrue(notify(self._location))
+            self.assertEqual([listener], wait([listener], timeout=5))
+            self.assertEqual(2, listener.drain())
+            self.assertEqual([], wait([listener], timeout=0))
+        finally:
+            listener.close()
+
+        self.assertFalse(os.path.exists(self._location))
+
+    def test_stale_socket_is_replaced(self):
+        WakeListener(self._location)
+        listener = WakeListener(self._location)
+        try:
+            self.assertTrue(notify(self._location))
+        finally:
+            listener.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
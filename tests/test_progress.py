@@ -0,0 +1,31 @@
+import unittest
+
+from mps_server.progress import SolverProgress, estimated_time_remaining
+
+
+class SolverProgressTestCase(unittest.TestCase):
+
+    def test_parse_trial_lines(self):
+        progress = SolverProgress(4)
+        self.assertTrue(progress.parse_line('Trial 1 finished in 0.2s\n'))
+        self.assertTrue(progress.parse_line('trial 2 complete\n'))
+        self.assertTrue(progress.parse_line('Trial 2 complete\n'))
+        self.assertTrue(progress.parse_line('trial 3 failed: CV_TOO_MUCH_WORK\n'))
+        self.assertFalse(progress.parse_line('Compiling solver\n'))
+        self.assertEqual(2, progress.trials_completed)
+        self.assertEqual(1, progress.trials_failed)
+
+    def test_parse_fraction(self):
+        progress = SolverProgress()
+        self.assertTrue(progress.parse_line('15/60 trials\n'))
+        self.assertEqual(15, progress.trials_completed)
+        self.assertEqual(60, progress.trials_total)
+
+    def test_estimated_time_remaining(self):
+        self.assertIsNone(estimated_time_remaining(10.0, 0, 10))
+        self.assertIsNone(estimated_time_remaining(10.0, 5, None))
+        self.assertEqual(30.0, estimated_time_remaining(10.0, 5, 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
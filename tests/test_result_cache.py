@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from mps_server.result_cache import ResultCache, submission_fingerprint
+
+
+def _submission(number_trials):
+    return {
+        'user_id': 'user',
+        'model': 'model.cellml',
+        'uncertainties': [{'id': 'a', 'distribution': {'name': 'normal', 'parameters': {'values': [1.0, 0.1]}}}],
+        'settings': {'simulation': {'numberTrials': number_trials}},
+        'outputs': ['v'],
+    }
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._model_file = os.path.join(self._dir.name, 'model.cellml')
+        with open(self._model_file, 'w') as f:
+            f.write('<model/>')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_fingerprint(self):
+        fingerprint = submission_fingerprint(self._model_file, _submission(10))
+        self.assertEqual(fingerprint, submission_fingerprint(self._model_file, _submission(10)))
+        self.assertNotEqual(fingerprint, submission_fingerprint(self._model_file, _submission(20)))
+
+        with open(self._model_file, 'w') as f:
+            f.write('<model name="changed"/>')
+        self.assertNotEqual(fingerprint, submission_fingerprint(self._model_file, _submission(10)))
+
+    def test_lookup(self):
+        cache = ResultCache(os.path.join(self._dir.name, 'cache.sqlite'), 60, 10)
+        self.assertIsNone(cache.lookup('fingerprint'))
+        cache.store('fingerprint', 'reference')
+        self.assertEqual('reference', cache.lookup('fingerprint'))
+        cache.forget('reference')
+        self.assertIsNone(cache.lookup('fingerprint'))
+
+    def test_size_limit(self):
+        cache = ResultCache(os.path.join(self._dir.name, 'cache.sqlite'), 60, 1)
+        cache.store('first', 'reference-1')
+        cache.store('second', 'reference-2')
+        self.assertIsNone(cache.lookup('first'))
+        self.assertEqual('reference-2', cache.lookup('second'))
+
+    def test_disabled(self):
+        cache = ResultCache(os.path.join(self._dir.name, 'cache.sqlite'), 0, 10)
+        cache.store('fingerprint', 'reference')
+        self.assertIsNone(cache.lookup('fingerprint'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import json
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from mps_server.results import arrow_available, has_result, iter_result_arrow, iter_result_binary, iter_result_json, iter_result_ndjson, load_result, result_as_lists, select_result, store_result
+
+
+class ResultsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._location = os.path.join(self._dir.name, 'reference')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_store_and_load(self):
+        data = {
+            'apd': [1.0, 2.0, 3.0],
+            'v': [[0.0, 1.0], [0.5, 1.5], [1.0, 2.0]],
+            'label': ['a', 'b', 'c'],
+        }
+        self.assertFalse(has_result(self._location))
+        store_result(self._location, data)
+        self.assertTrue(has_result(self._location))
+
+        result = load_result(self._location)
+        self.assertIsInstance(result['v'], np.memmap)
+        self.assertEqual((3, 2), result['v'].shape)
+        self.assertEqual(data, result_as_lists(result))
+        self.assertEqual(['apd'], list(load_result(self._location, columns=['apd']).keys()))
+
+    def test_replace_result(self):
+        store_result(self._location, {'apd': [1.0]})
+        store_result(self._location, {'apd': [2.0, 3.0]})
+        self.assertEqual({'apd': [2.0, 3.0]}, result_as_lists(load_result(self._location)))
+
+    def test_select_and_stream(self):
+        store_result(self._location, {'apd': [1.0, 2.0, 3.0], 'v': [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0], [6.0, 7.0, 8.0]]})
+        selection = select_result(load_result(self._location), trial_start=1, stride=2)
+        self.assertEqual({'apd': [2.0, 3.0], 'v': [[3.0, 5.0], [6.0, 8.0]]}, json.loads(''.join(iter_result_json(selection, chunk_bytes=1))))
+
+        lines = [json.loads(line) for line in iter_result_ndjson(selection, trial_offset=1)]
+        self.assertEqual([{'trial': 1, 'apd': 2.0, 'v': [3.0, 5.0]}, {'trial': 2, 'apd': 3.0, 'v': [6.0, 8.0]}], lines)
+
+    def test_chunks_are_bounded_in_bytes(self):
+        store_result(self._location, {'apd': [1.0] * 8, 'v': [[0.0] * 100] * 8})
+        result = load_result(self._location)
+        # Eight time series of 100 values, 800 bytes each, two per chunk of 1600 bytes.
+        chunks = list(iter_result_json(result, chunk_bytes=1600))
+        self.assertEqual([2] * 4, [chunk.count('[0.0') for chunk in chunks if '[0.0' in chunk])
+        self.assertEqual({'apd': [1.0] * 8, 'v': [[0.0] * 100] * 8}, json.loads(''.join(chunks)))
+        # After the header, 'apd' fits in one chunk and 'v' takes four.
+        self.assertEqual([64] + [1600] * 4, [len(chunk) for chunk in iter_result_binary(result, chunk_bytes=1600)][1:])
+
+    def test_failed_trials_stream_as_null(self):
+        store_result(self._location, {'apd': [1.0, float('nan')], 'v': [[0.0, 1.0], [float('nan'), float('nan')]]})
+        result = load_result(self._location)
+
+        def reject_constant(name):
+            raise ValueError(f"{name} is not JSON")
+
+        self.assertEqual({'apd': [1.0, None], 'v': [[0.0, 1.0], [None, None]]}, json.loads(''.join(iter_result_json(result)), parse_constant=reject_constant))
+        lines = [json.loads(line, parse_constant=reject_constant) for line in iter_result_ndjson(result)]
+        self.assertEqual([{'trial': 0, 'apd': 1.0, 'v': [0.0, 1.0]}, {'trial': 1, 'apd': None, 'v': [None, None]}], lines)
+
+    def test_binary(self):
+        store_result(self._location, {'apd': [1.0, 2.0], 'v': [[0.0, 1.0], [2.0, 3.0]], 'label': ['a', 'b']})
+        body = b''.join(iter_result_binary(load_result(self._location), chunk_bytes=1))
+        header_length = struct.unpack('<I', body[:4])[0]
+        header = json.loads(body[4:4 + header_length])
+        buffers = body[4 + header_length:]
+
+        columns = {column['name']: column for column in header['columns']}
+        self.assertEqual(['a', 'b'], columns['label']['values'])
+        v = columns['v']
+        values = np.frombuffer(buffers[v['offset']:v['offset'] + v['length']], dtype='<f8').reshape(v['shape'])
+        self.assertEqual([[0.0, 1.0], [2.0, 3.0]], values.tolist())
+
+    @unittest.skipUnless(arrow_available(), 'pyarrow is not installed')
+    def test_arrow(self):
+        import pyarrow as pa
+
+        store_result(self._location, {'apd': [1.0, 2.0, 3.0], 'v': [[0.0, 1.0], [2.0, 3.0], [4.0, 5.0]]})
+        body = b''.join(iter_result_arrow(load_result(self._location), chunk_bytes=48))
+        table = pa.ipc.open_stream(body).read_all()
+        self.assertEqual({'apd': [1.0, 2.0, 3.0], 'v': [[0.0, 1.0], [2.0, 3.0], [4.0, 5.0]]}, table.to_pydict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from mps_server.common import Status
+from mps_server.run_records import RunRecordStore
+
+
+class RunRecordStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._store = RunRecordStore(os.path.join(self._dir.name, 'simulations'))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_create_and_load(self):
+        self._store.create('a', {'model': 'model.cellml'})
+        self.assertEqual({'model': 'model.cellml', 'status': Status.PENDING}, self._store.load('a'))
+        self.assertTrue(self._store.exists('a'))
+        self.assertRaises(FileNotFoundError, self._store.load, 'b')
+
+    def test_status_transitions_are_journalled(self):
+        self._store.create('a', {})
+        self._store.append_status('a', Status.RUNNING)
+        self._store.append_status('a', Status.FINISHED)
+        self.assertEqual([Status.PENDING, Status.RUNNING, Status.FINISHED], [entry['status'] for entry in self._store.journal('a')])
+        self.assertEqual(Status.FINISHED, self._store.status('a'))
+
+    def test_partial_journal_line_is_ignored(self):
+        self._store.create('a', {})
+        with open(os.path.join(self._dir.name, 'simulations', 'a.journal'), 'a') as f:
+            f.write('{"status": "runn')
+        self.assertEqual(Status.PENDING, self._store.status('a'))
+
+    def test_references_oldest_first(self):
+        self._store.create('new', {})
+        self._store.create('old', {}, created=1.0)
+        self.assertEqual(['old', 'new'], self._store.references())
+        self.assertEqual(1.0, self._store.created('old'))
+
+
+if __name__ == '__main__':
+    unittest.main()
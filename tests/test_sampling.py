@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from mps_server.sampling import normal_ppf, saltelli_order, sample_parameters, unit_design
+
+DISTRIBUTIONS = {
+    'a': {'distribution': 'normal', 'p1': 10.0, 'p2': 2.0},
+    'b': {'distribution': 'uniform', 'p1': -1.0, 'p2': 1.0},
+    'c': {'distribution': 'triangular', 'p1': 0.0, 'p2': 1.0, 'p3': 4.0},
+}
+
+
+class SamplingTestCase(unittest.TestCase):
+
+    def test_normal_ppf(self):
+        np.testing.assert_allclose([-1.959963984540054, 0.0, 1.2815515655446004], normal_ppf([0.025, 0.5, 0.9]), atol=1e-8)
+        np.testing.assert_allclose([-4.264890793922825], normal_ppf([1e-5]), rtol=1e-8)
+
+    def test_seeded_samples_are_reproducible(self):
+        names, first = sample_parameters(DISTRIBUTIONS, 100, 'lhs', seed=7)
+        _, second = sample_parameters(DISTRIBUTIONS, 100, 'lhs', seed=7)
+        _, other = sample_parameters(DISTRIBUTIONS, 100, 'lhs', seed=8)
+        self.assertEqual(['a', 'b', 'c'], names)
+        self.assertEqual((100, 3), first.shape)
+        np.testing.assert_array_equal(first, second)
+        self.assertFalse(np.array_equal(first, other))
+
+    def test_distributions(self):
+        _, samples = sample_parameters(DISTRIBUTIONS, 20000, 'random', seed=1)
+        self.assertAlmostEqual(10.0, samples[:, 0].mean(), delta=0.1)
+        self.assertAlmostEqual(2.0, samples[:, 0].std(), delta=0.1)
+        self.assertTrue(np.all((samples[:, 1] >= -1.0) & (samples[:, 1] <= 1.0)))
+        self.assertAlmostEqual(5.0 / 3.0, samples[:, 2].mean(), delta=0.05)
+
+    def test_latin_hypercube_is_stratified(self):
+        u = unit_design('lhs', 50, 4, seed=3)
+        for column in u.T:
+            self.assertEqual(list(range(50)), sorted(np.floor(column * 50).astype(int)))
+
+    def test_saltelli_layout(self):
+        u = unit_design('saltelli', 27, 3, seed=5)
+        self.assertEqual((25, 3), u.shape)
+        a, b = u[:5], u[5:10]
+        for index in range(3):
+            ab = u[10 + 5 * index:15 + 5 * index]
+            np.testing.assert_array_equal(b[:, index], ab[:, index])
+            np.testing.assert_array_equal(np.delete(a, index, axis=1), np.delete(ab, index, axis=1))
+
+    def test_rows_of_a_design(self):
+        for design in ['random', 'lhs', 'saltelli']:
+            whole = unit_design(design, 27, 3, seed=5)
+            for start, stop in [(0, 4), (4, 13), (13, 27), (20, 40)]:
+                np.testing.assert_array_equal(whole[start:stop], unit_design(design, 27, 3, seed=5, start=start, stop=stop), f"{design} {start}:{stop}")
+
+    def test_saltelli_order_merges_designs(self):
+        # Two designs with 2 and 1 base samples for one parameter: blocks A, B, AB_1.
+        rows = ['A0', 'A1', 'B0', 'B1', 'C0', 'C1', 'a0', 'b0', 'c0']
+        self.assertEqual(['A0', 'A1', 'a0', 'B0', 'B1', 'b0', 'C0', 'C1', 'c0'], [rows[i] for i in saltelli_order([2, 1], 1)])
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, sample_parameters, {'a': {'distribution': 'cauchy', 'p1': 0.0}}, 10)
+        self.assertRaises(ValueError, unit_design, 'grid', 10, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+from mps_server.sensitivity import output_statistics, rank_correlation, simulation_statistics, sobol_indices
+
+
+class SensitivityTestCase(unittest.TestCase):
+
+    def test_output_statistics(self):
+        values = np.array([[0.0, 1.0], [2.0, 3.0], [4.0, 5.0]])
+        statistics = output_statistics(values, percentiles=(50,))
+        self.assertEqual([2.0, 3.0], statistics['mean'])
+        self.assertEqual([4.0, 4.0], statistics['variance'])
+        self.assertEqual([2.0, 3.0], statistics['percentiles']['50'])
+
+    def test_rank_correlation(self):
+        rng = np.random.default_rng(1)
+        parameters = rng.random((200, 2))
+        values = np.exp(parameters[:, 0])
+        correlation = rank_correlation(parameters, values)
+        self.assertAlmostEqual(1.0, correlation[0, 0])
+        self.assertLess(abs(correlation[1, 0]), 0.2)
+
+    def test_rank_correlation_without_failed_trials(self):
+        rng = np.random.default_rng(1)
+        parameters = rng.random((200, 2))
+        values = np.column_stack([np.exp(parameters[:, 0]), parameters[:, 1]])
+        # A fifth of the trials failed at every time point, and one more at the second only.
+        values[::5] = np.nan
+        values[1, 1] = np.nan
+        correlation = rank_correlation(parameters, values)
+        self.assertAlmostEqual(1.0, correlation[0, 0])
+        self.assertAlmostEqual(1.0, correlation[1, 1])
+        self.assertLess(abs(correlation[1, 0]), 0.2)
+
+    def test_sobol_indices(self):
+        rng = np.random.default_rng(2)
+        base_samples = 4096
+        a = rng.random((base_samples, 2))
+        b = rng.random((base_samples, 2))
+        blocks = [a, b]
+        for index in range(2):
+            ab = a.copy()
+            ab[:, index] = b[:, index]
+            blocks.append(ab)
+        parameters = np.concatenate(blocks)
+        values = 4.0 * parameters[:, 0] + parameters[:, 1]
+
+        first_order, total, trials_used = sobol_indices(values, 2)
+        self.assertAlmostEqual(16.0 / 17.0, first_order[0, 0], delta=0.05)
+        self.assertAlmostEqual(1.0 / 17.0, first_order[1, 0], delta=0.05)
+        self.assertAlmostEqual(16.0 / 17.0, total[0, 0], delta=0.05)
+        self.assertEqual([4 * base_samples], trials_used.tolist())
+
+        # A failed trial leaves its Saltelli block out.
+        values[[3, base_samples + 5, 3 * base_samples + 7]] = np.nan
+        first_order, total, trials_used = sobol_indices(values, 2)
+        self.assertEqual([4 * (base_samples - 3)], trials_used.tolist())
+        self.assertAlmostEqual(16.0 / 17.0, first_order[0, 0], delta=0.05)
+        self.assertAlmostEqual(16.0 / 17.0, total[0, 0], delta=0.05)
+
+    def test_simulation_statistics(self):
+        result = {'apd': np.array([1.0, 2.0, 3.0]), 'a': np.array([0.1, 0.2, 0.3]), 'label': ['x', 'y', 'z']}
+        statistics = simulation_statistics(result, ['a'], np.array([[0.1], [0.2], [0.3]]))
+        self.assertEqual(3, statistics['trials'])
+        self.assertEqual(['apd'], list(statistics['outputs'].keys()))
+        self.assertAlmostEqual(1.0, statistics['rank_correlation']['apd']['a'])
+        self.assertNotIn('sobol', statistics)
+
+    def test_simulation_statistics_with_failed_trials(self):
+        result = {'apd': np.array([1.0, np.nan, 3.0, 4.0]), 'a': np.array([0.1, 0.2, 0.3, 0.4])}
+        statistics = simulation_statistics(result, ['a'], np.array([[0.1], [0.2], [0.3], [0.4]]))
+        self.assertEqual(3, statistics['trials_used']['apd'])
+        self.assertAlmostEqual(1.0, statistics['rank_correlation']['apd']['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
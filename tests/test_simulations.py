@@ -0,0 +1,215 @@
+import multiprocessing as mp
+import os
+import signal
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mps_server import simulations
+from mps_server.common import Status
+from mps_server.config import Config
+from mps_server.executors import ExecutorConfigurationError
+from mps_server.job_queue import JobQueue
+from mps_server.management import get_model_file
+from mps_server.results import load_parameters
+
+
+def _submission(trials=8):
+    return {
+        'user_id': 'user',
+        'model': 'model.cellml',
+        'outputs': ['x', 'y'],
+        'uncertainties': [{'id': 'a', 'distribution': {'name': 'uniform', 'parameters': {'values': [0.0, 1.0]}}}],
+        'settings': {
+            'solver': {'maxNumSteps': 500, 'relativeTolerance': 1e-7, 'absoluteTolerance': 1e-7, 'intMethod': 'BDF', 'iterationType': 'Newton',
+                       'interpolate': True, 'linearSolver': 'Dense', 'maxStep': 0.0},
+            'simulation': {'numberTrials': trials, 'timeStart': 0.0, 'timeStop': 2.0, 'pointInterval': 0.5, 'seed': 7},
+        },
+    }
+
+
+class FakeExecutorSimulationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        # No SIMULATION_RUN_DIR, the fake executor needs neither the solver sources nor cellsolvertools.
+        for name, value in [('SIMULATION_DATA_DIR', os.path.join(self._dir.name, 'data')), ('CLIENT_WORKING_DIR', self._dir.name),
+                            ('SIMULATION_EXECUTOR', 'fake'), ('SIMULATION_RUN_DIR', None), ('SIMULATION_CONCURRENT_RUNS', 1)]:
+            patcher = mock.patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        os.makedirs(Config.SIMULATION_DATA_DIR)
+        model_file = get_model_file(Config.CLIENT_WORKING_DIR, 'user', 'model.cellml')
+        os.makedirs(os.path.dirname(model_file))
+        with open(model_file, 'w') as f:
+            f.write('<model/>')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _check_result(self, reference, trials):
+        result = simulations.get_simulation_result(reference)
+        self.assertEqual((trials, 5), result['x'].shape)
+        self.assertEqual((trials, 5), result['y'].shape)
+        np.testing.assert_allclose(1.0 + np.asarray(result['a']), result['x'][:, 0])
+        self.assertEqual(trials, simulations.get_simulation_statistics(reference)['trials'])
+
+    def test_run_simulation(self):
+        reference = simulations.queue_simulation(_submission())['reference']
+        self.assertIsNone(simulations.get_simulation_result(reference))
+        job_queue = simulations._job_queue()
+        self.assertEqual(reference, job_queue.claim(worker='test:1', lease_seconds=60))
+        simulations.run_simulation(reference, 1, 'test:1')
+
+        self.assertEqual(Status.FINISHED, job_queue.status(reference))
+        self.assertFalse(os.path.exists(simulations._run_dir(reference, 'test:1', 1)))
+        self._check_result(reference, 8)
+
+    def test_job_queue_is_set_up_once(self):
+        with mock.patch.object(simulations, 'JobQueue', wraps=JobQueue) as job_queue_class:
+            job_queue = simulations._job_queue()
+            self.assertIs(job_queue, simulations._job_queue())
+        job_queue_class.assert_called_once()
+
+    def test_attempts_have_their_own_run_directories(self):
+        submission = _submission()
+        # Without a seed every attempt samples parameter values of its own.
+        del submission['settings']['simulation']['seed']
+        reference = simulations.queue_simulation(submission)['reference']
+        job_queue = simulations._job_queue()
+        job_queue.claim(worker='old:1', lease_seconds=0)
+        job_queue.release_expired(Config.SIMULATION_MAX_ATTEMPTS)
+        job_queue.claim(worker='new:1', lease_seconds=60)
+        new_run_dir = simulations._run_dir(reference, 'new:1', 2)
+        os.makedirs(new_run_dir)
+        self.assertNotEqual(simulations._run_dir(reference, 'old:1', 1), new_run_dir)
+
+        # The worker that lost its lease finishes first, it neither completes the run, stores a result nor touches the run directory of the new attempt.
+        simulations.run_simulation(reference, 1, 'old:1', 1)
+        self.assertEqual(Status.RUNNING, job_queue.status(reference))
+        self.assertIsNone(job_queue.run_info(reference)['cpu_seconds'])
+        self.assertFalse(os.path.exists(simulations._result_dir(reference)))
+        self.assertTrue(os.path.isdir(new_run_dir))
+
+        simulations.run_simulation(reference, 1, 'new:1', 2)
+        self.assertEqual(Status.FINISHED, job_queue.status(reference))
+        self.assertEqual([], os.listdir(os.path.join(Config.SIMULATION_DATA_DIR, simulations.SIMULATION_RUNS_DIR_NAME)))
+        self._check_result(reference, 8)
+        _, parameters, _ = load_parameters(simulations._result_dir(reference))
+        info = job_queue.run_info(reference)
+
+        # Nor does it replace the result of the lease holder when it finishes last.
+        simulations.run_simulation(reference, 1, 'old:1', 1)
+        np.testing.assert_array_equal(parameters, load_parameters(simulations._result_dir(reference))[1])
+        np.testing.assert_array_equal(parameters[:, 0], simulations.get_simulation_result(reference)['a'])
+        self.assertEqual(info['cpu_seconds'], job_queue.run_info(reference)['cpu_seconds'])
+        self.assertEqual([], os.listdir(os.path.join(Config.SIMULATION_DATA_DIR, simulations.SIMULATION_RUNS_DIR_NAME)))
+
+    def test_cancelled_extension_keeps_the_result(self):
+        reference = simulations.queue_simulation(_submission())['reference']
+        job_queue = simulations._job_queue()
+        job_queue.claim(worker='test:1', lease_seconds=60)
+        simulations.run_simulation(reference, 1, 'test:1')
+        info = job_queue.run_info(reference)
+
+        self.assertIsNotNone(simulations.extend_simulation('user', reference, 4))
+        self.assertEqual(Status.FINISHED, simulations.cancel_simulation('user', reference)['status'])
+        self.assertEqual((8, 8), (job_queue.run_info(reference)['trials_total'], job_queue.run_info(reference)['trials_completed']))
+        self._check_result(reference, 8)
+
+        # The extension process, left running until the manager kills it, neither progresses nor extends the run.
+        self.assertIsNotNone(simulations.extend_simulation('user', reference, 4))
+        job_queue.claim(worker='test:1', lease_seconds=60)
+        self.assertEqual(Status.FINISHED, simulations.cancel_simulation('user', reference)['status'])
+        simulations.run_simulation(reference, 1, 'test:1')
+        self.assertEqual(Status.FINISHED, job_queue.status(reference))
+        self.assertEqual((info['trials_total'], info['trials_completed'], info['trials_failed']),
+                         tuple(job_queue.run_info(reference)[name] for name in ['trials_total', 'trials_completed', 'trials_failed']))
+        self._check_result(reference, 8)
+        self.assertIn({'status': Status.FINISHED, 'extension': Status.CANCELLED},
+                      [{name: value for name, value in entry.items() if name != 'time'} for entry in simulations._run_records().journal(reference)])
+
+    def _run_manager(self, reference):
+        manager = mp.get_context('fork').Process(target=simulations.simulation_manager)
+        manager.start()
+        try:
+            deadline = time.time() + 30
+            while simulations._job_queue().status(reference) != Status.FINISHED and time.time() < deadline:
+                time.sleep(0.1)
+        finally:
+            os.kill(manager.pid, signal.SIGTERM)
+            manager.join(30)
+
+        self.assertEqual(0, manager.exitcode)
+        self.assertEqual(Status.FINISHED, simulations._job_queue().status(reference))
+
+    def test_simulation_manager(self):
+        reference = simulations.queue_simulation(_submission())['reference']
+        self._run_manager(reference)
+        self._check_result(reference, 8)
+
+    def test_simulation_manager_refuses_unusable_executor(self):
+        with mock.patch.object(Config, 'SIMULATION_EXECUTOR', 'process-pool'), mock.patch.object(Config, 'SIMULATION_TRIAL_FUNCTION', None):
+            self.assertRaises(ExecutorConfigurationError, simulations.simulation_manager)
+        self.assertFalse(os.path.exists(simulations._manager_socket()))
+
+    def test_simulation_manager_merges_shards(self):
+        with mock.patch.object(Config, 'SIMULATION_SHARD_TRIALS', 4):
+            reference = simulations.queue_simulation(_submission())['reference']
+        shards = simulations._job_queue().shards(reference)
+        self.assertEqual(2, len(shards))
+        self._run_manager(reference)
+        self._check_result(reference, 8)
+        self.assertFalse(any(os.path.exists(simulations._result_dir(shard['reference'])) for shard in shards))
+
+    def test_failed_merge_finishes_without_result(self):
+        with mock.patch.object(Config, 'SIMULATION_SHARD_TRIALS', 4):
+            reference = simulations.queue_simulation(_submission())['reference']
+        shards = simulations._job_queue().shards(reference)
+        # The process merging the shards dies.
+        with mock.patch.object(simulations, '_merge_shards', lambda job_queue, reference, worker: os._exit(1)):
+            self._run_manager(reference)
+        self.assertIsNone(simulations.get_simulation_result(reference))
+        self.assertTrue(all(os.path.exists(simulations._result_dir(shard['reference'])) for shard in shards))
+
+    def test_merge_taken_over_is_stopped(self):
+        with mock.patch.object(Config, 'SIMULATION_SHARD_TRIALS', 4):
+            reference = simulations.queue_simulation(_submission())['reference']
+        job_queue = simulations._job_queue()
+        for shard in job_queue.shards(reference):
+            job_queue.claim(worker='test:1', lease_seconds=60)
+            simulations.run_simulation(shard['reference'], 1, 'test:1')
+        self.assertEqual(reference, job_queue.claim_merge('test:1', 60))
+        merge_process = mp.Process(target=time.sleep, args=(60,))
+        merge_process.start()
+        merging = {merge_process.sentinel: (reference, merge_process)}
+
+        # A manager that took the merge over stops this one.
+        job_queue.release_merge(reference, 'test:1')
+        self.assertEqual(reference, job_queue.claim_merge('test:2', 60))
+        simulations._check_merges(job_queue, 'test:1', merging, [], job_queue.heartbeat([reference], 'test:1', 60))
+        self.assertEqual({}, merging)
+        self.assertFalse(merge_process.is_alive())
+
+        simulations._merge_shards(job_queue, reference, 'test:2')
+        self.assertEqual(Status.FINISHED, job_queue.status(reference))
+        self._check_result(reference, 8)
+
+
+class KillSimulationProcessTestCase(unittest.TestCase):
+
+    def test_kill_before_the_process_group_exists(self):
+        simulation_process = mp.Process(target=time.sleep, args=(60,))
+        simulation_process.start()
+        with mock.patch.object(simulations, 'KILL_GRACE_PERIOD', 5.0):
+            start = time.time()
+            simulations._kill_simulation_process(simulation_process)
+        self.assertFalse(simulation_process.is_alive())
+        self.assertLess(time.time() - start, 5.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from time import time
+
+from mps_server.token_cache import VerifiedTokenCache
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+
+    def test_hit(self):
+        cache = VerifiedTokenCache(2)
+        payload = {'sub': 'user', 'exp': time() + 60}
+        self.assertIsNone(cache.get('token-a'))
+        cache.put('token-a', payload)
+        self.assertEqual(payload, cache.get('token-a'))
+        self.assertEqual(1, cache.stats()['hits'])
+        self.assertEqual(1, cache.stats()['misses'])
+
+    def test_expired_token(self):
+        cache = VerifiedTokenCache(2)
+        cache.put('token-a', {'sub': 'user', 'exp': time() - 1})
+        self.assertIsNone(cache.get('token-a'))
+        self.assertEqual(1, cache.stats()['expirations'])
+        self.assertEqual(0, cache.stats()['size'])
+
+    def test_token_without_expiry_is_not_cached(self):
+        cache = VerifiedTokenCache(2)
+        cache.put('token-a', {'sub': 'user'})
+        self.assertIsNone(cache.get('token-a'))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = VerifiedTokenCache(2)
+        expiry = time() + 60
+        cache.put('token-a', {'sub': 'a', 'exp': expiry})
+        cache.put('token-b', {'sub': 'b', 'exp': expiry})
+        cache.get('token-a')
+        cache.put('token-c', {'sub': 'c', 'exp': expiry})
+        self.assertIsNone(cache.get('token-b'))
+        self.assertIsNotNone(cache.get('token-a'))
+        self.assertIsNotNone(cache.get('token-c'))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_disabled(self):
+        cache = VerifiedTokenCache(0)
+        cache.put('token-a', {'sub': 'a', 'exp': time() + 60})
+        self.assertIsNone(cache.get('token-a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import gzip
+import unittest
+
+from mps_server.transport import available_encodings, iter_compressed
+
+
+class TransportTestCase(unittest.TestCase):
+
+    def test_gzip(self):
+        body = b''.join(iter_compressed(['{"a":', b'[1.0]}'], 'gzip'))
+        self.assertEqual(b'{"a":[1.0]}', gzip.decompress(body))
+
+    @unittest.skipUnless('zstd' in available_encodings(), 'zstandard is not installed')
+    def test_zstd(self):
+        import zstandard
+
+        body = b''.join(iter_compressed(['{"a":', b'[1.0]}'], 'zstd'))
+        self.assertEqual(b'{"a":[1.0]}', zstandard.ZstdDecompressor().decompressobj().decompress(body))
+
+
+if __name__ == '__main__':
+    unittest.main()